@@ -0,0 +1,108 @@
+"""
+Bathroom queue engine.
+
+Members are kept in arrival order in a dict indexed by seat, which gives O(1)
+duplicate detection, O(1) removal of any member and O(1) access to the head.
+Each member also holds a ticket number; a Fenwick tree over live tickets
+answers "what is my position" in O(log n) without scanning the queue.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional
+
+MIN_CAPACITY = 64
+
+
+class FenwickTree:
+    """Prefix sums over a fixed number of slots"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        """Sum of slots 0..index, both included"""
+        index += 1
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class BathroomQueue:
+    def __init__(self, items: Iterable[dict] = ()):
+        self._items: Dict[str, dict] = {}
+        self._tickets: Dict[str, int] = {}
+        self._next_ticket = 0
+        self._tree = FenwickTree(MIN_CAPACITY)
+        # Se incrementa con cada cambio para que los clientes apliquen deltas en orden
+        self.version = 0
+        for item in items:
+            self.append(item)
+        self.version = 0
+
+    def __contains__(self, seat_id: str) -> bool:
+        return seat_id in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._items.values())
+
+    def items(self) -> List[dict]:
+        return list(self._items.values())
+
+    def head(self) -> Optional[dict]:
+        return next(iter(self._items.values()), None)
+
+    def get(self, seat_id: str) -> Optional[dict]:
+        return self._items.get(seat_id)
+
+    def position(self, seat_id: str) -> Optional[int]:
+        """1-based position of a seat in the queue, None if not queued"""
+        ticket = self._tickets.get(seat_id)
+        if ticket is None:
+            return None
+        return self._tree.prefix_sum(ticket)
+
+    def append(self, item: dict) -> int:
+        """Add an item at the end of the queue, returns its 1-based position"""
+        seat_id = item["seat_id"]
+        if seat_id in self._items:
+            raise ValueError(f"Seat {seat_id} is already in the queue")
+        if self._next_ticket >= self._tree.size:
+            self._compact()
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self._items[seat_id] = item
+        self._tickets[seat_id] = ticket
+        self._tree.add(ticket, 1)
+        self.version += 1
+        return len(self._items)
+
+    def remove(self, seat_id: str) -> Optional[int]:
+        """Remove a seat from the queue, returns the 1-based position it had or None"""
+        if seat_id not in self._items:
+            return None
+        position = self.position(seat_id)
+        del self._items[seat_id]
+        self._tree.add(self._tickets.pop(seat_id), -1)
+        self.version += 1
+        return position
+
+    def _compact(self):
+        # Renumera los tickets vivos: coste O(n) amortizado entre al menos n altas
+        capacity = max(MIN_CAPACITY, 2 * (len(self._items) + 1))
+        self._tree = FenwickTree(capacity)
+        self._tickets = {}
+        for ticket, seat_id in enumerate(self._items):
+            self._tickets[seat_id] = ticket
+            self._tree.add(ticket, 1)
+        self._next_ticket = len(self._items)
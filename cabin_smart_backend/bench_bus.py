@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Latency and ordering of the broadcast bus between workers.
+
+Starts N worker processes, each with its own bus. Every worker publishes
+messages at a fixed rate and every other worker records how long each one
+took to arrive and whether it arrived in the order it was sent. Clocks are
+comparable because time.perf_counter is system-wide monotonic on Linux.
+
+    python bench_bus.py --workers 4 --messages 2000
+    python bench_bus.py --bus redis     # requiere redis y REDIS_URL
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from bench_lavatories import percentile
+from broadcast_bus import create_bus
+
+# Carga útil del tamaño de un seat_updated típico
+PAYLOAD = {"event": "seat_updated", "data": {"seatId": "12C", "is_buckled": True, "last_updated": "2024-01-01T00:00:00"}}
+
+
+def worker(index: int, kind: str, workers: int, messages: int, rate: float, barrier, results):
+    async def run():
+        bus = create_bus(kind)
+        latencies = []
+        last_seen = {}
+        out_of_order = 0
+        done = asyncio.Event()
+        expected = messages * (workers - 1)
+
+        async def deliver(message):
+            nonlocal out_of_order
+            latencies.append(time.perf_counter() - message["sent_at"])
+            if message["n"] <= last_seen.get(message["worker"], -1):
+                out_of_order += 1
+            last_seen[message["worker"]] = message["n"]
+            if len(latencies) == expected:
+                done.set()
+
+        await bus.start(deliver)
+        # Todos los workers escuchan antes de que nadie publique
+        await asyncio.to_thread(barrier.wait)
+        await asyncio.sleep(0.2)
+        interval = 1 / rate
+        started = time.perf_counter()
+        for n in range(messages):
+            bus.publish({"flight": "bench", "event": PAYLOAD, "worker": index, "n": n, "sent_at": time.perf_counter()})
+            # Ritmo constante sin acumular el retraso de cada sleep
+            await asyncio.sleep(max(0.0, started + (n + 1) * interval - time.perf_counter()))
+        try:
+            await asyncio.wait_for(done.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            pass
+        await bus.stop()
+        results.put((index, latencies, out_of_order, expected - len(latencies)))
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bus", default="unix", choices=["unix", "redis"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000, help="mensajes publicados por cada worker")
+    parser.add_argument("--rate", type=float, default=200.0, help="mensajes por segundo de cada worker")
+    args = parser.parse_args()
+
+    barrier = multiprocessing.Barrier(args.workers)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker, args=(index, args.bus, args.workers, args.messages, args.rate, barrier, results)
+        )
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [latency for _, samples, _, _ in collected for latency in samples]
+    out_of_order = sum(result[2] for result in collected)
+    lost = sum(result[3] for result in collected)
+    print(f"\nBus {args.bus}: {args.workers} workers × {args.messages} mensajes a {args.rate:.0f}/s cada uno")
+    print(f"Entregas: {len(latencies)}  perdidos: {lost}  fuera de orden (por emisor): {out_of_order}")
+    print(
+        f"Latencia añadida: p50 {percentile(latencies, 0.50) * 1e6:.0f} µs  "
+        f"p95 {percentile(latencies, 0.95) * 1e6:.0f} µs  p99 {percentile(latencies, 0.99) * 1e6:.0f} µs  "
+        f"máx {max(latencies, default=0) * 1e6:.0f} µs"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Throughput and wait-time benchmark for the lavatory scheduler.
+
+Simulates a lavatory rush on a 33-row cabin through the WebSocket handlers
+of main.py, on an in-memory flight with a crew client connected: passengers
+send join_bathroom_queue at a Poisson rate and the simulated door sensors
+send bathroom_door_sensor enter/exit to the lavatory they were given. Times
+are simulated minutes; the time per event is measured for real and includes
+CabinState, the write-behind queue and the publish to the crew.
+
+    python bench_lavatories.py --rate 4 --minutes 60
+"""
+
+import argparse
+import asyncio
+import heapq
+import random
+import statistics
+import time
+from typing import Dict, List
+
+import main
+from flights import Flight
+from lavatory_scheduler import LavatoryScheduler, parse_layout
+from repository import MemoryRepository
+
+LAYOUTS = {
+    "1 lavabo": "main:cabin:all",
+    "3 lavabos (1 business)": "fwd:forward:business,aft-l:aft:all,aft-r:aft:all",
+    "5 lavabos (2 business)": "fwd-l:forward:business,fwd-r:forward:business,mid:mid:all,aft-l:aft:all,aft-r:aft:all",
+    "8 lavabos (2 business)": ",".join(
+        ["fwd-l:forward:business", "fwd-r:forward:business"] + [f"eco-{n}:aft:all" for n in range(6)]
+    ),
+}
+
+ROWS = 33
+BUSINESS_ROWS = 8
+WALK_MINUTES = 0.5
+
+
+class CaptureWebSocket:
+    """Client that only counts the frames it receives"""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, text: str):
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def cabin_seats() -> Dict[str, str]:
+    return {
+        f"{row}{chr(64 + seat)}": "business" if row <= BUSINESS_ROWS else "economy"
+        for row in range(1, ROWS + 1) for seat in range(1, 7)
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def simulate(layout: str, rate: float, minutes: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    seats = cabin_seats()
+    flight = Flight("bench")
+    flight.state.repository = MemoryRepository("bench")
+    flight.state.lavatories = LavatoryScheduler(parse_layout(layout))
+    await flight.open()
+    lavatories = flight.state.lavatories
+    crew = CaptureWebSocket()
+    await flight.manager.connect(crew)
+    join, _ = main.handlers.get("join_bathroom_queue")
+    door_sensor, _ = main.handlers.get("bathroom_door_sensor")
+    events = []  # (minuto, orden, acción, asiento)
+    order = 0
+
+    def push(at, action, seat_id):
+        nonlocal order
+        order += 1
+        heapq.heappush(events, (at, order, action, seat_id))
+
+    # Llegadas de Poisson durante la ventana de simulación
+    now = 0.0
+    while True:
+        now += rng.expovariate(rate)
+        if now > minutes:
+            break
+        push(now, "join", rng.choice(list(seats)))
+
+    joined_at: Dict[str, float] = {}
+    walking = set()  # asientos con lavabo reservado y camino del lavabo
+    waits: Dict[str, List[float]] = {"business": [], "economy": []}
+    completed = 0
+    max_queue = 0
+    handled = 0
+    cpu = 0.0
+    last_exit = 0.0
+
+    async def handle(handler, data):
+        nonlocal cpu, handled
+        started = time.perf_counter()
+        await handler(flight, crew, data)
+        cpu += time.perf_counter() - started
+        handled += 1
+        # Deja que el writer de la conexión vacíe su cola de envío
+        await asyncio.sleep(0)
+
+    def walk_to_reserved(now):
+        # notify_next_in_queue reserva lavabos: el pasajero llega tras WALK_MINUTES
+        for lavatory in lavatories:
+            if lavatory.assigned_to and lavatory.assigned_to not in walking:
+                walking.add(lavatory.assigned_to)
+                push(now + WALK_MINUTES, "enter", lavatory.assigned_to)
+
+    try:
+        while events:
+            now, _, action, seat_id = heapq.heappop(events)
+            if action == "join":
+                if seat_id in joined_at or lavatories.lavatory_of(seat_id):
+                    continue
+                await handle(join, {"seatId": seat_id, "passengerName": seat_id})
+                lavatory = lavatories.lavatory_of(seat_id)
+                if lavatory and lavatory.current_user == seat_id:
+                    # bathroom_direct_access: el lavabo ya cuenta como ocupado
+                    waits[seats[seat_id]].append(0.0)
+                    push(now + WALK_MINUTES + rng.uniform(2, 6), "exit", seat_id)
+                else:
+                    joined_at[seat_id] = now
+                    max_queue = max(max_queue, len(flight.state.bathroom_queue))
+                    walk_to_reserved(now)
+            elif action == "enter":
+                walking.discard(seat_id)
+                lavatory = lavatories.lavatory_of(seat_id)
+                await handle(door_sensor, {"seatId": seat_id, "bathroomId": lavatory.bathroom_id, "action": "enter"})
+                waits[seats[seat_id]].append(now - joined_at.pop(seat_id))
+                push(now + rng.uniform(2, 6), "exit", seat_id)
+                walk_to_reserved(now)
+            elif action == "exit":
+                lavatory = lavatories.lavatory_of(seat_id)
+                await handle(door_sensor, {"seatId": seat_id, "bathroomId": lavatory.bathroom_id, "action": "exit"})
+                completed += 1
+                last_exit = now
+                walk_to_reserved(now)
+    finally:
+        await flight.manager.disconnect(crew)
+        await flight.close()
+
+    all_waits = waits["business"] + waits["economy"]
+    return {
+        "completed": completed,
+        "throughput": completed / (last_exit / 60) if last_exit else 0.0,
+        "p50": percentile(all_waits, 0.50),
+        "p95": percentile(all_waits, 0.95),
+        "business_p95": percentile(waits["business"], 0.95),
+        "economy_p95": percentile(waits["economy"], 0.95),
+        "mean": statistics.mean(all_waits) if all_waits else 0.0,
+        "max_queue": max_queue,
+        "us_per_event": cpu / max(1, handled) * 1e6,
+    }
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=4.0, help="pasajeros que se unen a la cola por minuto")
+    parser.add_argument("--minutes", type=float, default=60.0, help="duración de la avalancha en minutos")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"Avalancha: {args.rate}/min durante {args.minutes:.0f} min (semilla {args.seed})\n")
+    header = f"{'layout':<26}{'usos':>6}{'usos/h':>9}{'p50':>7}{'p95':>7}{'p95 bus':>9}{'p95 eco':>9}{'cola máx':>10}{'µs/evento':>11}"
+    print(header)
+    print("-" * len(header))
+    for name, layout in LAYOUTS.items():
+        result = asyncio.run(simulate(layout, args.rate, args.minutes, args.seed))
+        print(
+            f"{name:<26}{result['completed']:>6}{result['throughput']:>9.1f}"
+            f"{result['p50']:>7.1f}{result['p95']:>7.1f}{result['business_p95']:>9.1f}"
+            f"{result['economy_p95']:>9.1f}{result['max_queue']:>10}{result['us_per_event']:>11.1f}"
+        )
+    print("\nTiempos de espera en minutos (desde unirse a la cola hasta entrar)")
+    print("µs/evento: join_bathroom_queue y bathroom_door_sensor, con publicación a la tripulación")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Event-loop latency under connection churn, per logging mode.
+
+Connects and disconnects fake WebSockets on a ConnectionManager at a fixed
+rate (every connect and disconnect logs a record) while a probe task
+measures how late the event loop wakes it up. Log output goes to a sink that
+takes --sink-latency-us per write, like a stdout pipe whose reader (a
+terminal, docker's log driver) falls behind.
+
+- print: the previous behaviour, print() from the event loop
+- sync: structured records written from the event loop
+- queue: structured records handed to the background writer (default mode)
+- off: records filtered by level, the lower bound
+
+    python bench_logging.py --rate 1000 --sink-latency-us 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import connection_manager
+import structured_log
+from bench_lavatories import percentile
+from connection_manager import ConnectionManager
+
+MODES = ("print", "sync", "queue", "off")
+
+
+class SlowSink:
+    """Stream whose writes block for a while, as a pipe with a slow reader"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.writes = 0
+        self._null = open(os.devnull, "w")
+
+    def write(self, data: str) -> int:
+        time.sleep(self.latency)
+        self.writes += 1
+        return self._null.write(data)
+
+    def flush(self):
+        pass
+
+
+class PrintLogger:
+    """Old behaviour: one print() per connection change"""
+
+    def info(self, event: str, **fields):
+        print(f"{event} {fields}")
+
+    warning = error = debug = info
+
+
+class FakeWebSocket:
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def probe(samples: list, interval: float, stop: asyncio.Event):
+    # Retraso con que el bucle despierta a una tarea que duerme `interval`
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def churn(seconds: float, rate: float) -> int:
+    manager = ConnectionManager()
+    cycles = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        await manager.disconnect(websocket)
+        cycles += 1
+        # Ritmo constante; si el bucle va retrasado se sigue sin dormir
+        await asyncio.sleep(max(0.0, started + cycles / rate - time.perf_counter()))
+    return cycles
+
+
+async def run(mode: str, seconds: float, rate: float, sink: SlowSink):
+    stdout = sys.stdout
+    if mode == "print":
+        connection_manager.log = PrintLogger()
+        sys.stdout = sink
+    else:
+        connection_manager.log = structured_log.get_logger("connection_manager")
+        structured_log.configure(
+            level="WARNING" if mode == "off" else "INFO", stream=sink, background=mode == "queue"
+        )
+
+    samples = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(samples, 0.001, stop))
+    try:
+        cycles = await churn(seconds, rate)
+    finally:
+        stop.set()
+        await probe_task
+        sys.stdout = stdout
+    dropped = structured_log.dropped() if mode == "queue" else 0
+    structured_log.shutdown()
+    return cycles, samples, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0, help="duración de cada modo")
+    parser.add_argument("--rate", type=float, default=1000.0, help="conexiones (y desconexiones) por segundo")
+    parser.add_argument("--sink-latency-us", type=float, default=200.0, help="coste de cada escritura en la salida")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    print(
+        f"\nRotación de {args.rate:.0f} conexiones/s durante {args.seconds:.0f} s por modo, "
+        f"salida con {args.sink_latency_us:.0f} µs por escritura\n"
+    )
+    header = f"{'modo':<8}{'conex/s':>10}{'retraso p50':>13}{'p99':>9}{'máx':>9}{'descartados':>13}"
+    print(header)
+    print("-" * len(header))
+    for mode in args.modes.split(","):
+        if mode not in MODES:
+            raise SystemExit(f"Modo desconocido {mode!r}, opciones: {', '.join(MODES)}")
+        sink = SlowSink(args.sink_latency_us / 1e6)
+        cycles, samples, dropped = asyncio.run(run(mode, args.seconds, args.rate, sink))
+        print(
+            f"{mode:<8}{cycles / args.seconds:>10.0f}{percentile(samples, 0.50) * 1e3:>10.2f} ms"
+            f"{percentile(samples, 0.99) * 1e3:>6.2f} ms{max(samples, default=0) * 1e3:>6.2f} ms{dropped:>13}"
+        )
+    print("\nRetraso: cuánto tarda de más el bucle en despertar una tarea que duerme 1 ms.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Per-operation latency of the storage backends.
+
+Runs every repository operation the server issues against the in-memory,
+SQLite (WAL, temporary file) and, with --mongo, MongoDB backends and prints
+p50/p95/p99 latency in microseconds. Operations are awaited one by one, as
+the write-behind task does.
+
+    python bench_repositories.py --iterations 2000
+    python bench_repositories.py --mongo
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from bench_lavatories import percentile
+from database import connect_to_mongo, close_mongo_connection, get_database, collection_name
+from repository import CabinRepository, MemoryRepository, MongoRepository, SqliteRepository
+from write_batch import WriteBatch
+
+BATHROOM_IDS = ["fwd", "aft"]
+FLIGHT_ID = "bench"
+
+
+async def measure(iterations: int, operation: Callable[[int], Awaitable]) -> List[float]:
+    samples = []
+    for index in range(iterations):
+        started = time.perf_counter()
+        await operation(index)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def bench(repository: CabinRepository, iterations: int) -> Dict[str, List[float]]:
+    await repository.init(BATHROOM_IDS)
+    seat_ids = [seat["seat_id"] for seat in await repository.load_seats()]
+    rng = random.Random(7)
+    queued = [seat_ids[index % len(seat_ids)] for index in range(iterations)]
+
+    async def add(index):
+        # Se vacía la cola cada vuelta completa de asientos para no repetir seat_id
+        if index and index % len(seat_ids) == 0:
+            await repository.init(BATHROOM_IDS)
+        await repository.add_to_queue({"seat_id": queued[index], "passenger_name": "Bench", "timestamp": f"{index:08d}"})
+
+    results = {
+        "update_seat": await measure(iterations, lambda index: repository.update_seat(
+            rng.choice(seat_ids), {"is_occupied": bool(index % 2), "last_updated": str(index)}
+        )),
+        "toggle_seat_belt": await measure(iterations, lambda index: repository.toggle_seat_belt(rng.choice(seat_ids), str(index))),
+        "update_lavatory": await measure(iterations, lambda index: repository.update_lavatory(
+            BATHROOM_IDS[index % 2], {"is_occupied": bool(index % 2), "current_user": None, "last_updated": str(index)}
+        )),
+    }
+    await repository.init(BATHROOM_IDS)
+    results["add_to_queue"] = await measure(iterations, add)
+    await repository.init(BATHROOM_IDS)
+    for seat_id in seat_ids:
+        await repository.add_to_queue({"seat_id": seat_id, "passenger_name": "Bench", "timestamp": seat_id})
+    results["remove_from_queue"] = await measure(len(seat_ids), lambda index: repository.remove_from_queue(seat_ids[index]))
+
+    def seat_belt_sign(index):
+        # Señal de cinturones: todos los asientos cambian a la vez, un único lote
+        batch = WriteBatch()
+        for seat_id in seat_ids:
+            batch.add(("update_seat", (seat_id, {"is_buckled": bool(index % 2), "last_updated": str(index)})))
+        return repository.apply_batch(batch)
+
+    results["apply_batch (198)"] = await measure(max(1, iterations // 20), seat_belt_sign)
+    results["load_seats"] = await measure(max(1, iterations // 20), lambda index: repository.load_seats())
+    await repository.close()
+    return results
+
+
+async def main(iterations: int, with_mongo: bool):
+    backends = {"memory": lambda: MemoryRepository(FLIGHT_ID)}
+    directory = tempfile.TemporaryDirectory()
+    backends["sqlite (WAL)"] = lambda: SqliteRepository(FLIGHT_ID, os.path.join(directory.name, "bench.db"))
+    if with_mongo:
+        await connect_to_mongo()
+        backends["mongo"] = lambda: MongoRepository(FLIGHT_ID)
+
+    results = {}
+    try:
+        for name, factory in backends.items():
+            results[name] = await bench(factory(), iterations)
+    finally:
+        directory.cleanup()
+        if with_mongo:
+            db = await get_database()
+            for base in ("seats", "bathroom_queue", "bathroom_status"):
+                await db.drop_collection(collection_name(base, FLIGHT_ID))
+            await close_mongo_connection()
+
+    print(f"\n{iterations} iteraciones por operación, latencias en µs\n")
+    header = f"{'operación':<20}{'backend':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'ops/s':>10}"
+    print(header)
+    print("-" * len(header))
+    for operation in next(iter(results.values())):
+        for name, result in results.items():
+            samples = result[operation]
+            print(
+                f"{operation:<20}{name:<16}{percentile(samples, 0.50) * 1e6:>9.1f}"
+                f"{percentile(samples, 0.95) * 1e6:>9.1f}{percentile(samples, 0.99) * 1e6:>9.1f}"
+                f"{len(samples) / sum(samples):>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--mongo", action="store_true", help="incluir MongoDB (requiere MONGODB_URL)")
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.mongo))
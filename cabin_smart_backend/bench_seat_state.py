@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Memory and snapshot size of the seat state, dicts vs columns and bitmaps.
+
+Loads N cabins of the demo layout (every seat updated once, so each one has
+a last_updated) and measures with tracemalloc the memory held by:
+
+- dicts: the previous model, one dict per seat as decoded from storage
+- table: SeatTable, one bit per flag and one column per field
+
+then builds the initial_state of one flight in both snapshot formats
+(/ws?snapshot=json and /ws?snapshot=bitmap) and prints their size and build
+time.
+
+    python bench_seat_state.py --flights 50
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime
+
+from database import build_default_seats
+from encoding import dumps, loads
+from flights import SNAPSHOT_FORMATS, Flight
+from repository import MemoryRepository
+from seat_table import SeatTable
+
+
+def stored_seats() -> bytes:
+    """Seats of a cabin as the storage returns them, after a flight of updates"""
+    seats = build_default_seats()
+    for seat in seats:
+        seat["last_updated"] = datetime.now().isoformat()
+    return dumps(seats)
+
+
+def measure(build, documents: list) -> int:
+    """Bytes still allocated after building the seat state of every cabin"""
+    tracemalloc.start()
+    # Cada cabina se decodifica aparte, como al cargarla del backend
+    cabins = [build(loads(document)) for document in documents]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cabins
+    return current
+
+
+async def snapshot_sizes(iterations: int) -> dict:
+    flight = Flight("bench")
+    flight.state.repository = MemoryRepository("bench")
+    await flight.open()
+    await flight.state.toggle_seat_belt("12C")
+    results = {}
+    try:
+        for snapshot_format in SNAPSHOT_FORMATS:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                message = await flight.build_initial_state(snapshot_format)
+            results[snapshot_format] = (len(message.text.encode("utf-8")), (time.perf_counter() - started) / iterations)
+        results["seats"] = len(dumps(flight.state.get_all_seats()))
+        results["seatBitmap"] = len(dumps(flight.state.get_seat_bitmap()))
+    finally:
+        await flight.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flights", type=int, default=50, help="cabinas cargadas a la vez")
+    parser.add_argument("--iterations", type=int, default=200, help="initial_state construidos por formato")
+    args = parser.parse_args()
+
+    documents = [stored_seats() for _ in range(args.flights)]
+    seats = len(loads(documents[0]))
+    dicts = measure(lambda loaded: {seat["seat_id"]: seat for seat in loaded}, documents)
+    table = measure(SeatTable, documents)
+
+    print(f"\nMemoria del estado de asientos, {args.flights} vuelos de {seats} asientos\n")
+    header = f"{'modelo':<8}{'por vuelo':>12}{'por asiento':>14}"
+    print(header)
+    print("-" * len(header))
+    for name, used in (("dicts", dicts), ("table", table)):
+        per_flight = used / args.flights
+        print(f"{name:<8}{per_flight / 1024:>9.1f} KB{per_flight / seats:>12.0f} B")
+    print(f"\nReducción: {dicts / table:.1f}x")
+
+    results = asyncio.run(snapshot_sizes(args.iterations))
+    print(f"\ninitial_state de un vuelo ({args.iterations} construcciones por formato)\n")
+    header = f"{'formato':<8}{'tamaño':>12}{'construcción':>15}"
+    print(header)
+    print("-" * len(header))
+    for snapshot_format in SNAPSHOT_FORMATS:
+        size, seconds = results[snapshot_format]
+        print(f"{snapshot_format:<8}{size:>10} B{seconds * 1e6:>12.0f} µs")
+    print(
+        f"\nAsientos: {results['seats']} B como seats, {results['seatBitmap']} B como seatBitmap. "
+        f"Reducción del initial_state: {results['json'][0] / results['bitmap'][0]:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Frame size and encode time of every /ws event type, JSON vs MessagePack.
+
+Runs the WebSocket handlers of main.py against an in-memory flight (belts,
+seat status, queue joins and leaves, door sensors, a rejected message),
+captures every message sent to a crew client and encodes each one as:
+
+- json: the text frames of existing clients
+- msgpack: MessagePack with the same keys and texts
+- compact: the cabin-smart.msgpack.v1 subprotocol (short keys, event and
+  message codes)
+
+Size is the average frame of the event type, time the average encode time.
+
+    python bench_ws_encoding.py --iterations 2000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List
+
+import msgpack
+
+import main
+from binary_protocol import pack
+from encoding import dumps, loads
+from flights import Flight
+from repository import MemoryRepository
+
+CLIENT_MESSAGES = [
+    ("toggle_seat_belt", {"seatId": "12C"}),
+    ("update_seat_status", {"seatId": "12D", "updates": {"isInSeat": False}}),
+    ("join_bathroom_queue", {"seatId": "20A", "passengerName": "Ana"}),
+    ("join_bathroom_queue", {"seatId": "21B", "passengerName": "Luis"}),
+    ("bathroom_door_sensor", {"seatId": "20A", "action": "enter"}),
+    ("leave_bathroom_queue", {"seatId": "21B"}),
+    ("bathroom_door_sensor", {"seatId": "20A", "action": "exit"}),
+    ("join_bathroom_queue", {"seatId": "22C", "passengerName": "Eva"}),
+    ("leave_bathroom_queue", {"seatId": "30A"}),
+    ("subscribe", {"topics": ["crew:all"]}),
+]
+
+
+class CaptureWebSocket:
+    def __init__(self):
+        self.frames: List[str] = []
+
+    async def send_text(self, text: str):
+        self.frames.append(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def capture() -> Dict[str, List[dict]]:
+    """Messages received by a crew client during a short session, by event type"""
+    flight = Flight("bench")
+    flight.state.repository = MemoryRepository("bench")
+    await flight.open()
+    crew = CaptureWebSocket()
+    await flight.manager.connect(crew)
+    try:
+        for snapshot_format in ("json", "bitmap"):
+            await flight.manager.send_personal(crew, await flight.snapshot(snapshot_format))
+        for event, data in CLIENT_MESSAGES:
+            handler, _ = main.handlers.get(event)
+            await handler(flight, crew, data)
+        # Deja salir los summary_updated y vaciar la cola de envío
+        await asyncio.sleep(0.5)
+    finally:
+        await flight.manager.disconnect(crew)
+        await flight.close()
+
+    samples: Dict[str, List[dict]] = {}
+    for frame in crew.frames:
+        payload = loads(frame)
+        event = payload["event"]
+        if event == "initial_state":
+            event += " (bitmap)" if "seatBitmap" in payload["data"] else " (json)"
+        samples.setdefault(event, []).append(payload)
+    return samples
+
+
+def measure(encoder, payloads: List[dict], iterations: int):
+    """Average size and encode time of the payloads of an event type"""
+    size = sum(len(encoder(payload)) for payload in payloads) / len(payloads)
+    rounds = max(1, iterations // len(payloads))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            encoder(payload)
+    return size, (time.perf_counter() - started) / (rounds * len(payloads))
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="codificaciones por tipo de evento y formato")
+    args = parser.parse_args()
+
+    encoders = {
+        "json": dumps,
+        "msgpack": lambda payload: msgpack.packb(payload, use_bin_type=True),
+        "compact": pack,
+    }
+    samples = asyncio.run(capture())
+
+    print(f"\nTamaño medio del frame (B) y tiempo de codificación (µs) por tipo de evento\n")
+    header = f"{'evento':<34}" + "".join(f"{name:>17}" for name in encoders) + f"{'ahorro':>9}"
+    print(header)
+    print("-" * len(header))
+    totals = dict.fromkeys(encoders, 0.0)
+    for event in sorted(samples):
+        payloads = samples[event]
+        row = f"{event:<34}"
+        sizes = {}
+        for name, encoder in encoders.items():
+            size, seconds = measure(encoder, payloads, args.iterations)
+            sizes[name] = size
+            totals[name] += size * len(payloads)
+            row += f"{size:>8.0f} B{seconds * 1e6:>6.1f} µs"
+        print(row + f"{1 - sizes['compact'] / sizes['json']:>8.0%}")
+    print("-" * len(header))
+    print(
+        f"{'sesión completa':<34}" + "".join(f"{totals[name]:>10.0f} B{'':>6}" for name in encoders)
+        + f"{1 - totals['compact'] / totals['json']:>8.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,206 @@
+"""
+MessagePack subprotocol of /ws.
+
+A client that offers the `cabin-smart.msgpack.v1` subprotocol (the
+Sec-WebSocket-Protocol header) gets binary frames instead of JSON text:
+the same messages packed with MessagePack, with every known field name
+replaced by a one or two character key, event names by event codes and
+the Spanish texts of `message` by message codes:
+
+    {"event": "bathroom_available", "seq": 42, "data": {"seatId": "12C", ...,
+     "message": "El baño está disponible. Es tu turno."}}
+    ->
+    {"e": 19, "q": 42, "d": {"s": "12C", ..., "m": 6}}
+
+Names and texts that are not in the tables are sent unchanged. The client
+may send its messages in the same binary form (short keys, event codes) or
+as JSON text frames. Clients that do not ask for the subprotocol keep
+receiving JSON.
+
+The tables are part of the protocol version: codes are never reused or
+renumbered, new names get new codes. GET /ws/protocol returns them.
+
+Requires the optional `msgpack` package; without it the subprotocol is not
+offered and every client gets JSON.
+"""
+
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depende del entorno
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "cabin-smart.msgpack.v1"
+
+EVENT_CODES = {
+    # Cliente -> servidor
+    "toggle_seat_belt": 1,
+    "join_bathroom_queue": 2,
+    "leave_bathroom_queue": 3,
+    "update_seat_status": 4,
+    "bathroom_door_sensor": 5,
+    "subscribe": 6,
+    # Servidor -> cliente
+    "initial_state": 10,
+    "resumed": 11,
+    "error": 12,
+    "seat_updated": 13,
+    "seats_patch": 14,
+    "seat_belt_toggled": 15,
+    "seat_status_updated": 16,
+    "bathroom_queue_joined": 17,
+    "bathroom_queue_left": 18,
+    "bathroom_available": 19,
+    "bathroom_direct_access": 20,
+    "bathroom_status_updated": 21,
+    "bathroom_queue_updated": 22,
+    "bathroom_door_sensor_processed": 23,
+    "queue_item_added": 24,
+    "queue_item_removed": 25,
+    "subscribed": 26,
+    "summary_updated": 27,
+}
+
+MESSAGE_CODES = {
+    "ID de asiento requerido": 1,
+    "Asiento no encontrado": 2,
+    "Ya estás en la cola": 3,
+    "No encontrado en la cola": 4,
+    "Baño no encontrado": 5,
+    "El baño está disponible. Es tu turno.": 6,
+    "Puedes ir al baño directamente. ¡Está libre!": 7,
+    "Demasiadas solicitudes, inténtalo más tarde": 8,
+    "Temas de suscripción no válidos": 9,
+    "Vuelo no encontrado": 10,
+    "Formato de snapshot no válido": 11,
+    "Mensaje no válido": 12,
+}
+
+# Ninguna clave corta coincide con un nombre que se envía sin cambiar (ids de asiento, filas, clases)
+KEYS = {
+    "event": "e",
+    "data": "d",
+    "seq": "q",
+    "message": "m",
+    "code": "c",
+    "seatId": "s",
+    "seat_id": "si",
+    "passengerName": "p",
+    "passenger_name": "pn",
+    "bathroomId": "b",
+    "bathroom_id": "bi",
+    "is_occupied": "o",
+    "is_buckled": "k",
+    "seat_class": "sc",
+    "last_updated": "u",
+    "timestamp": "t",
+    "isOccupied": "io",
+    "isInSeat": "is",
+    "currentUser": "cu",
+    "current_user": "cr",
+    "assigned_to": "at",
+    "zone": "z",
+    "seats": "S",
+    "item": "i",
+    "position": "P",
+    "version": "v",
+    "queue": "Q",
+    "updates": "U",
+    "success": "ok",
+    "action": "a",
+    "topics": "T",
+    "scope": "sp",
+    "retryAfterMs": "r",
+    "missed": "mi",
+    "flightId": "f",
+    "epoch": "ep",
+    "bathroomQueue": "bq",
+    "bathroomQueueVersion": "bv",
+    "bathroomStatus": "bs",
+    "lavatories": "l",
+    "summary": "sm",
+    "connectedUsers": "cn",
+    "seatBitmap": "sb",
+    "firstRow": "fr",
+    "lastRow": "lr",
+    "letters": "lt",
+    "occupied": "oc",
+    "buckled": "bk",
+    "classes": "cl",
+    "missing": "ms",
+    "unbuckled": "ub",
+    "unbuckledSeats": "us",
+    "byClass": "bc",
+    "byRow": "br",
+    "length": "n",
+    "oldestTimestamp": "ot",
+}
+
+# Valores que se sustituyen por códigos, según la clave
+VALUE_CODES = {"event": EVENT_CODES, "message": MESSAGE_CODES}
+
+LONG_KEYS = {short: key for key, short in KEYS.items()}
+EVENT_NAMES = {code: event for event, code in EVENT_CODES.items()}
+CONTAINERS = (dict, list, tuple)
+
+
+class BinaryDecodeError(ValueError):
+    pass
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def compact(value: Any) -> Any:
+    """Message with short keys and coded values"""
+    # Los escalares no se visitan: un initial_state tiene miles de campos
+    if isinstance(value, dict):
+        return {
+            KEYS.get(key, key): (
+                VALUE_CODES[key].get(item, item) if key in VALUE_CODES and isinstance(item, str)
+                else compact(item) if isinstance(item, CONTAINERS)
+                else item
+            )
+            for key, item in value.items()
+        }
+    return [compact(item) if isinstance(item, CONTAINERS) else item for item in value]
+
+
+def expand(value: Any) -> Any:
+    """Inverse of compact for client messages (message codes are never sent by clients)"""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            key = LONG_KEYS.get(key, key)
+            if key == "event" and isinstance(item, int):
+                item = EVENT_NAMES.get(item, item)
+            else:
+                item = expand(item)
+            result[key] = item
+        return result
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+    return value
+
+
+def pack(payload: dict) -> bytes:
+    return msgpack.packb(compact(payload), use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    try:
+        return expand(msgpack.unpackb(data, raw=False))
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise BinaryDecodeError(str(e)) from e
+
+
+def protocol_tables() -> Dict[str, Any]:
+    return {
+        "subprotocol": MSGPACK_SUBPROTOCOL,
+        "available": msgpack_available(),
+        "events": EVENT_CODES,
+        "messages": MESSAGE_CODES,
+        "keys": KEYS,
+    }
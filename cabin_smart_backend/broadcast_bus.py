@@ -0,0 +1,309 @@
+"""
+Broadcast bus between uvicorn workers.
+
+With `--workers N` every worker owns its WebSocket connections and its copy
+of the cabin state. The bus relays two kinds of messages to the other
+workers:
+
+- state changes (the repository operation of every mutation, with absolute
+  values, plus the lavatory reservations, which are not persisted), which
+  peers apply to their in-memory state without persisting it
+- published events, which peers stamp with their own sequence number and
+  broadcast to their own sockets
+
+Implementations (BROADCAST_BUS):
+
+- "local": a single worker, nothing is relayed
+- "unix": one Unix datagram socket per worker in BROADCAST_BUS_DIR; every
+  message is sent to each peer socket. A worker lists the directory after
+  binding its socket and greets the peers it found, so any two workers know
+  each other whichever starts first
+- "redis": Redis pub/sub on one channel (optional `redis` package)
+
+Startup: a worker asks has_peers() before opening its flights and starts
+the bus afterwards. The first workers of a deployment find nobody and clear
+the persisted bathroom queue; a worker respawned under `--workers N` finds
+its peers and loads the queue they still hold instead of wiping it. A peer
+only becomes visible once it has opened its flights, so no worker loads a
+queue that is about to be cleared.
+
+Ordering: messages of one worker are delivered to every peer in the order
+they were published (per-sender FIFO), and a state change always arrives
+before the event announcing it. There is no total order between workers:
+two workers changing the same seat at the same time may be seen in
+different orders by different peers (with "redis" the server imposes one
+order for everybody).
+"""
+
+import asyncio
+import glob
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+from encoding import DecodeError, dumps, loads
+from structured_log import get_logger
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - depende del entorno
+    aioredis = None
+
+log = get_logger("broadcast_bus")
+
+BROADCAST_BUS = os.getenv("BROADCAST_BUS", "local")
+BROADCAST_BUSES = ("local", "unix", "redis")
+
+BUS_DIR = os.getenv("BROADCAST_BUS_DIR", "/tmp/cabin_smart_bus")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_CHANNEL = os.getenv("REDIS_CHANNEL", "cabin_smart:bus")
+
+# Buffer de los sockets Unix: limita el tamaño máximo de un mensaje relayado
+UNIX_SOCKET_BUFFER = 4 * 1024 * 1024
+
+Deliver = Callable[[dict], Awaitable[None]]
+
+
+class BroadcastBus:
+    """Relays messages to the other workers"""
+
+    def __init__(self):
+        # Identifica a este worker: sus propios mensajes se ignoran al recibirlos
+        self.origin = uuid.uuid4().hex[:8]
+        self.relayed = 0
+        self.received = 0
+        self._deliver: Optional[Deliver] = None
+        self._inbox: Optional[asyncio.Queue] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def has_peers(self) -> bool:
+        """Whether other workers are already running, asked before start()"""
+        return False
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._inbox = asyncio.Queue()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def publish(self, message: dict):
+        """Relay a message to every other worker; it is encoded right away, so it can be modified afterwards"""
+        raise NotImplementedError
+
+    def _encode(self, message: dict) -> bytes:
+        self.relayed += 1
+        return dumps(dict(message, origin=self.origin))
+
+    def _receive(self, data: bytes):
+        try:
+            message = loads(data)
+        except DecodeError as e:
+            log.warning("bus_message_malformed", error=str(e))
+            return
+        if self._control(message):
+            return
+        if message.get("origin") != self.origin and self._inbox is not None:
+            self.received += 1
+            self._inbox.put_nowait(message)
+
+    def _control(self, message: dict) -> bool:
+        """Handle a bus-internal message, returns True if it must not be delivered"""
+        return False
+
+    async def _dispatch(self):
+        # Un único consumidor: los mensajes se aplican en el orden en que llegaron
+        while True:
+            message = await self._inbox.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                log.error("bus_deliver_failed", error=str(e))
+
+
+class LocalBus(BroadcastBus):
+    """Single worker: there is nobody to relay to"""
+
+    async def start(self, deliver: Deliver):
+        pass
+
+    def publish(self, message: dict):
+        pass
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bus: "UnixSocketBus"):
+        self.bus = bus
+
+    def datagram_received(self, data, addr):
+        self.bus._receive(data)
+
+    def error_received(self, exc):
+        # Un worker que ya no existe: se vuelve a listar el directorio en el siguiente envío
+        self.bus._stale_peers = True
+
+
+class UnixSocketBus(BroadcastBus):
+    """One datagram socket per worker; datagrams between two Unix sockets are reliable and ordered"""
+
+    def __init__(self, directory: str = BUS_DIR):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}-{self.origin}.sock")
+        self.peers: List[str] = []
+        self._stale_peers = False
+        self._transport: Optional[asyncio.DatagramTransport] = None
+
+    async def has_peers(self) -> bool:
+        self._refresh_peers()
+        return bool(self.peers)
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        os.makedirs(self.directory, exist_ok=True)
+        self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), local_addr=self.path, family=socket.AF_UNIX
+        )
+        sock = self._transport.get_extra_info("socket")
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UNIX_SOCKET_BUFFER)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UNIX_SOCKET_BUFFER)
+        # Primero se enlaza el socket y después se lista: de dos workers, al menos uno ve al otro y lo saluda
+        self._refresh_peers()
+        hello = dumps({"hello": self.path, "origin": self.origin})
+        for peer in self.peers:
+            self._transport.sendto(hello, peer)
+        log.info("bus_listening", path=self.path, peers=len(self.peers))
+
+    async def stop(self):
+        await super().stop()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def publish(self, message: dict):
+        if self._transport is None:
+            return
+        if self._stale_peers:
+            self._refresh_peers()
+        data = self._encode(message)
+        for peer in self.peers:
+            # Si el socket no admite más datos el transporte los guarda y los envía en orden
+            self._transport.sendto(data, peer)
+
+    def _refresh_peers(self):
+        peers = []
+        for path in glob.glob(os.path.join(self.directory, "*.sock")):
+            if path == self.path:
+                continue
+            try:
+                pid = int(os.path.basename(path).split("-", 1)[0])
+            except ValueError:
+                # No es el socket de un worker (<pid>-<origin>.sock)
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Socket de un worker muerto
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            peers.append(path)
+        self.peers = peers
+        self._stale_peers = False
+
+    def _control(self, message: dict) -> bool:
+        path = message.get("hello")
+        if path is None:
+            return False
+        if path != self.path and path not in self.peers:
+            self.peers.append(path)
+        return True
+
+
+class RedisBus(BroadcastBus):
+    """Redis pub/sub; Redis orders the messages of every worker in a single stream"""
+
+    def __init__(self, url: str = REDIS_URL, channel: str = REDIS_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._pubsub = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def has_peers(self) -> bool:
+        if aioredis is None:
+            return False
+        client = aioredis.from_url(self.url)
+        try:
+            # Cada worker en marcha está suscrito al canal
+            return any(count for _, count in await client.pubsub_numsub(self.channel))
+        finally:
+            await client.close()
+
+    async def start(self, deliver: Deliver):
+        if aioredis is None:
+            raise RuntimeError("BROADCAST_BUS=redis requires the redis package (pip install redis)")
+        await super().start(deliver)
+        self._client = aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._outbox = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._sender()), asyncio.create_task(self._listener())]
+        log.info("bus_connected", url=self.url, channel=self.channel)
+
+    async def stop(self):
+        if self._outbox is not None:
+            await self._outbox.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await super().stop()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+        if self._client is not None:
+            await self._client.close()
+
+    def publish(self, message: dict):
+        if self._outbox is not None:
+            self._outbox.put_nowait(self._encode(message))
+
+    async def _sender(self):
+        # Un único publicador por worker mantiene el orden FIFO
+        while True:
+            data = await self._outbox.get()
+            try:
+                await self._client.publish(self.channel, data)
+            except Exception as e:
+                log.error("bus_publish_failed", error=str(e))
+            finally:
+                self._outbox.task_done()
+
+    async def _listener(self):
+        async for item in self._pubsub.listen():
+            if item["type"] == "message":
+                self._receive(item["data"])
+
+
+def create_bus(kind: str = BROADCAST_BUS) -> BroadcastBus:
+    """Broadcast bus for the configured deployment"""
+    if kind == "local":
+        return LocalBus()
+    if kind == "unix":
+        return UnixSocketBus()
+    if kind == "redis":
+        return RedisBus()
+    raise ValueError(f"Unknown broadcast bus {kind!r}, expected one of {BROADCAST_BUSES}")
@@ -0,0 +1,435 @@
+"""
+In-memory authoritative cabin state.
+
+The state is loaded once from the storage backend (see repository.py) at
+startup and every read and validation is served from memory. Writes are
+applied to memory first and persisted according to the configured
+durability mode:
+
+- "async": write-behind, the mutation is queued and a background task flushes
+  the queue in coalesced batches (see write_batch.py)
+- "sync": the handler waits until the backend has acknowledged the write
+
+Every seat and lavatory mutation is a single atomic repository call that
+returns the post-image. In "sync" mode that post-image is adopted as the
+in-memory value, so the backend arbitrates concurrent writers (a belt toggle
+is computed by the backend).
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bathroom_queue import BathroomQueue
+from cabin_summary import CabinSummary
+from lavatory_scheduler import LAVATORY_LAYOUT, Lavatory, LavatoryScheduler, parse_layout
+from database import DEFAULT_FLIGHT_ID
+from metrics import STORAGE_SECONDS
+from repository import CabinRepository, create_repository
+from seat_table import SeatTable
+from structured_log import get_logger
+from write_batch import WRITE_BATCH_MS, WRITE_BATCH_SIZE, WRITE_RETRY_MAX_MS, WRITE_RETRY_MS, WriteBatch, WriteMetrics
+
+log = get_logger("cabin_state")
+
+# Modo de durabilidad de las escrituras: "async" (write-behind) o "sync"
+WRITE_MODE = os.getenv("CABIN_WRITE_MODE", "async")
+WRITE_MODES = ("async", "sync")
+
+# Operación pendiente: (método del repositorio, argumentos)
+WriteOp = Tuple[str, tuple]
+
+# Marca en la cola de escrituras que cierra el lote en curso sin esperar
+FLUSH = object()
+
+# Tiempo máximo que stop() espera a que se escriba lo pendiente (p. ej. con el almacenamiento caído)
+WRITE_STOP_TIMEOUT_MS = float(os.getenv("WRITE_STOP_TIMEOUT_MS", "10000"))
+
+
+class CabinState:
+    def __init__(self, flight_id: str = DEFAULT_FLIGHT_ID, write_mode: str = WRITE_MODE,
+                 lavatory_layout: str = LAVATORY_LAYOUT, repository: Optional[CabinRepository] = None,
+                 batch_ms: float = WRITE_BATCH_MS, batch_size: int = WRITE_BATCH_SIZE):
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode {write_mode!r}, expected one of {WRITE_MODES}")
+        self.flight_id = flight_id
+        self.write_mode = write_mode
+        self.repository = repository or create_repository(flight_id)
+        # Asientos por columnas (bits de ocupado y cinturón), ver seat_table.py
+        self.seats = SeatTable()
+        # Versión del estado completo, se incrementa con cualquier cambio
+        self.version = 0
+        self.bathroom_queue = BathroomQueue()
+        # Agregados para la tripulación, se actualizan con cada cambio de asiento o de la cola
+        self.summary = CabinSummary(self.bathroom_queue)
+        self.lavatories = LavatoryScheduler(parse_layout(lavatory_layout))
+        self.batch_ms = batch_ms
+        self.batch_size = batch_size
+        self.write_metrics = WriteMetrics()
+        # (instante en que se encoló, operación)
+        self._pending: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        # Recibe cada cambio aplicado (con valores absolutos) para replicarlo en otros workers
+        self.replicate: Optional[Callable[[WriteOp], None]] = None
+
+    async def load(self, clear_queue: bool = True):
+        """Initialize the storage of the flight and load the full cabin state from it"""
+        await self.repository.init(self.lavatory_ids(), clear_queue)
+        self.seats = SeatTable(await self.repository.load_seats())
+        self.bathroom_queue = BathroomQueue(await self.repository.load_queue())
+        for status in await self.repository.load_lavatories(self.lavatory_ids()):
+            self._set_lavatory(self.lavatories.get(status["bathroom_id"]), status)
+        self.summary.load(self.seats.values(), self.bathroom_queue)
+        self.version += 1
+        log.info("cabin_state_loaded", flight=self.flight_id, seats=len(self.seats), queued=len(self.bathroom_queue))
+
+    def start(self):
+        """Start the write-behind task"""
+        self._pending = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Flush pending writes right away and stop the write-behind task"""
+        if self._writer_task is None:
+            return
+        self._pending.put_nowait((time.monotonic(), FLUSH))
+        try:
+            await asyncio.wait_for(self._pending.join(), WRITE_STOP_TIMEOUT_MS / 1000)
+        except asyncio.TimeoutError:
+            log.error("write_flush_abandoned", flight=self.flight_id, pending=self._pending.qsize())
+        self._writer_task.cancel()
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        self._writer_task = None
+        await self.repository.close()
+
+    # Reads
+    def get_seat(self, seat_id: str) -> Optional[dict]:
+        return self.seats.get(seat_id)
+
+    def get_all_seats(self) -> Dict[str, dict]:
+        return self.seats.to_dict()
+
+    def get_seat_bitmap(self) -> dict:
+        return self.seats.to_bitmap()
+
+    def get_bathroom_queue(self) -> List[dict]:
+        return self.bathroom_queue.items()
+
+    @property
+    def queue_version(self) -> int:
+        return self.bathroom_queue.version
+
+    def queue_position(self, seat_id: str) -> Optional[int]:
+        return self.bathroom_queue.position(seat_id)
+
+    def queue_head(self) -> Optional[dict]:
+        return self.bathroom_queue.head()
+
+    def lavatory_ids(self) -> List[str]:
+        return list(self.lavatories.lavatories)
+
+    def get_lavatories(self) -> List[dict]:
+        return [lavatory.to_dict() for lavatory in self.lavatories]
+
+    def get_bathroom_status(self) -> dict:
+        """Status of the only lavatory, or an aggregate when the cabin has several"""
+        lavatories = list(self.lavatories)
+        if len(lavatories) == 1:
+            return lavatories[0].to_dict()
+        return {
+            "bathroom_id": "all",
+            "is_occupied": all(lavatory.is_occupied for lavatory in lavatories),
+            "current_user": None,
+            "last_updated": max((lavatory.last_updated or "" for lavatory in lavatories), default=None) or None
+        }
+
+    def free_lavatory(self, seat_class: str) -> Optional[Lavatory]:
+        return self.lavatories.find_free(seat_class)
+
+    def resolve_lavatory(self, bathroom_id: Optional[str], seat_id: Optional[str]) -> Optional[Lavatory]:
+        seat = self.seats.get(seat_id) if seat_id else None
+        return self.lavatories.resolve(bathroom_id, seat_id, seat["seat_class"] if seat else None)
+
+    def is_in_queue(self, seat_id: str) -> bool:
+        return seat_id in self.bathroom_queue
+
+    def write_stats(self) -> dict:
+        return dict(
+            self.write_metrics.to_dict(),
+            writeMode=self.write_mode,
+            pending=self._pending.qsize() if self._pending is not None else 0
+        )
+
+    # Writes
+    async def update_seat(self, seat_id: str, updates: dict) -> dict:
+        """Apply field updates to a seat and persist them, returns the applied updates"""
+        updates = dict(updates)
+        updates["last_updated"] = datetime.now().isoformat()
+        op = ("update_seat", (seat_id, updates))
+        if self.write_mode == "sync":
+            # Se adopta la post-imagen devuelta por la misma operación
+            seat = await self._apply(op)
+            self._set_seat(seat_id, {key: seat[key] for key in updates})
+        else:
+            self._set_seat(seat_id, updates)
+            await self._persist(op)
+        self._replicate(("update_seat", (seat_id, {key: self.seats[seat_id][key] for key in updates})))
+        return updates
+
+    async def toggle_seat_belt(self, seat_id: str) -> dict:
+        """Toggle the belt of a seat, returns the applied updates"""
+        if self.write_mode != "sync":
+            new_buckled_status = not self.seats.is_buckled(seat_id)
+            return await self.update_seat(seat_id, {"is_buckled": new_buckled_status})
+
+        # El backend calcula el nuevo valor: dos toggles simultáneos nunca se pisan
+        seat = await self._apply(("toggle_seat_belt", (seat_id, datetime.now().isoformat())))
+        updates = {"is_buckled": seat["is_buckled"], "last_updated": seat["last_updated"]}
+        self._set_seat(seat_id, updates)
+        self._replicate(("update_seat", (seat_id, updates)))
+        return updates
+
+    async def add_to_queue(self, seat_id: str, passenger_name: str) -> dict:
+        """Append a passenger to the bathroom queue"""
+        queue_item = {
+            "seat_id": seat_id,
+            "passenger_name": passenger_name,
+            "timestamp": datetime.now().isoformat()
+        }
+        self.bathroom_queue.append(queue_item)
+        self.summary.queue_changed()
+        self.version += 1
+        await self._persist(("add_to_queue", (queue_item,)))
+        self._replicate(("add_to_queue", (queue_item,)))
+        return queue_item
+
+    async def remove_from_queue(self, seat_id: str) -> Optional[int]:
+        """Remove a passenger from the bathroom queue, returns their 1-based position or None if not queued"""
+        position = self.bathroom_queue.remove(seat_id)
+        if position is not None:
+            self.lavatories.release(seat_id)
+            self.summary.queue_changed()
+            self.version += 1
+            await self._persist(("remove_from_queue", (seat_id,)))
+            self._replicate(("remove_from_queue", (seat_id,)))
+        return position
+
+    async def enter_lavatory(self, lavatory: Lavatory, seat_id: Optional[str]):
+        """Mark a lavatory as occupied by a passenger"""
+        self.lavatories.enter(lavatory, seat_id, datetime.now().isoformat())
+        await self._persist_lavatory(lavatory)
+
+    async def exit_lavatory(self, lavatory: Lavatory):
+        """Mark a lavatory as free"""
+        self.lavatories.exit(lavatory, datetime.now().isoformat())
+        await self._persist_lavatory(lavatory)
+
+    async def apply_sensor_batch(self, seats: Dict[str, dict], doors: Dict[str, Tuple[bool, Optional[str]]]):
+        """Apply settled sensor readings as one transition, persisted as one write batch
+
+        Returns the applied seat updates, the lavatories whose door changed and the
+        (seat_id, position) of every passenger who left the queue by entering one.
+        """
+        now = datetime.now().isoformat()
+        ops: List[WriteOp] = []
+        applied: Dict[str, dict] = {}
+        for seat_id, updates in seats.items():
+            updates = dict(updates, last_updated=now)
+            self._merge_seat(seat_id, updates)
+            applied[seat_id] = updates
+            ops.append(("update_seat", (seat_id, updates)))
+        lavatories: List[Lavatory] = []
+        removed: List[Tuple[str, int]] = []
+        for bathroom_id, (occupied, seat_id) in doors.items():
+            lavatory = self.lavatories.get(bathroom_id)
+            if occupied:
+                self.lavatories.enter(lavatory, seat_id, now)
+                position = self.bathroom_queue.remove(seat_id) if seat_id else None
+                if position is not None:
+                    self.lavatories.release(seat_id)
+                    self.summary.queue_changed()
+                    removed.append((seat_id, position))
+                    ops.append(("remove_from_queue", (seat_id,)))
+            else:
+                self.lavatories.exit(lavatory, now)
+            lavatories.append(lavatory)
+            ops.append(("update_lavatory", (bathroom_id, {
+                "zone": lavatory.zone,
+                "is_occupied": lavatory.is_occupied,
+                "current_user": lavatory.current_user,
+                "last_updated": lavatory.last_updated
+            })))
+        self.version += 1
+
+        if self.write_mode == "sync" or self._pending is None:
+            batch = WriteBatch()
+            for op in ops:
+                batch.add(op)
+            await self._timed("apply_batch", self.repository.apply_batch(batch))
+        else:
+            queued_at = time.monotonic()
+            for op in ops:
+                self._pending.put_nowait((queued_at, op))
+        for op in ops:
+            method, args = op
+            if method == "update_lavatory":
+                op = (method, (args[0], self.lavatories.get(args[0]).to_dict()))
+            self._replicate(op)
+        return applied, lavatories, removed
+
+    def assign_lavatories(self) -> List[Tuple[Lavatory, dict]]:
+        """Reserve every free lavatory for the next eligible passenger in queue"""
+        assigned = self.lavatories.schedule(self.bathroom_queue, self.seats.class_of)
+        if assigned:
+            self.version += 1
+        # Las reservas no se persisten, pero los demás workers deben verlas para no dar el lavabo a otro
+        for lavatory, item in assigned:
+            self._replicate(("reserve_lavatory", (lavatory.bathroom_id, item["seat_id"])))
+        return assigned
+
+    async def _persist_lavatory(self, lavatory: Lavatory):
+        self.version += 1
+        updates = {
+            "zone": lavatory.zone,
+            "is_occupied": lavatory.is_occupied,
+            "current_user": lavatory.current_user,
+            "last_updated": lavatory.last_updated
+        }
+        op = ("update_lavatory", (lavatory.bathroom_id, updates))
+        if self.write_mode == "sync":
+            self._set_lavatory(lavatory, await self._apply(op))
+        else:
+            await self._persist(op)
+        self._replicate(("update_lavatory", (lavatory.bathroom_id, lavatory.to_dict())))
+
+    def _set_lavatory(self, lavatory: Optional[Lavatory], status: dict):
+        if lavatory is None:
+            return
+        lavatory.is_occupied = status.get("is_occupied", False)
+        lavatory.current_user = status.get("current_user")
+        lavatory.last_updated = status.get("last_updated")
+
+    def _set_seat(self, seat_id: str, updates: dict):
+        self._merge_seat(seat_id, updates)
+        self.version += 1
+
+    def _merge_seat(self, seat_id: str, updates: dict):
+        self.summary.discard(self.seats[seat_id])
+        self.seats.update(seat_id, updates)
+        self.summary.add(self.seats[seat_id])
+
+    # Replication
+    def _replicate(self, op: WriteOp):
+        if self.replicate is not None:
+            self.replicate(op)
+
+    def apply_replicated(self, op: WriteOp):
+        """Apply a change made by another worker to memory only, that worker already persisted it"""
+        method, args = op
+        if method == "update_seat":
+            seat_id, updates = args
+            if seat_id in self.seats:
+                self._set_seat(seat_id, updates)
+        elif method == "add_to_queue":
+            item = args[0]
+            if item["seat_id"] not in self.bathroom_queue:
+                self.bathroom_queue.append(item)
+                self.summary.queue_changed()
+                self.version += 1
+        elif method == "remove_from_queue":
+            if self.bathroom_queue.remove(args[0]) is not None:
+                self.lavatories.release(args[0])
+                self.summary.queue_changed()
+                self.version += 1
+        elif method == "update_lavatory":
+            bathroom_id, status = args
+            lavatory = self.lavatories.get(bathroom_id)
+            if lavatory is not None:
+                # Entrar y salir como en el worker de origen, que también libera las reservas afectadas
+                if status.get("is_occupied"):
+                    self.lavatories.enter(lavatory, status.get("current_user"), status.get("last_updated"))
+                else:
+                    self.lavatories.exit(lavatory, status.get("last_updated"))
+                self.version += 1
+        elif method == "reserve_lavatory":
+            bathroom_id, seat_id = args
+            lavatory = self.lavatories.get(bathroom_id)
+            if lavatory is not None and seat_id in self.bathroom_queue:
+                self.lavatories.reserve(lavatory, seat_id)
+                self.version += 1
+
+    # Persistence
+    async def _persist(self, op: WriteOp):
+        if self.write_mode == "sync" or self._pending is None:
+            await self._apply(op)
+        else:
+            self._pending.put_nowait((time.monotonic(), op))
+
+    async def _apply(self, op: WriteOp):
+        """Run a single repository operation and return its result"""
+        method, args = op
+        return await self._timed(method, getattr(self.repository, method)(*args))
+
+    async def _timed(self, operation: str, call: Awaitable):
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            STORAGE_SECONDS.labels(self.repository.backend, operation).observe(time.perf_counter() - started)
+
+    async def _writer(self):
+        # Lote cuya escritura falló, se reintenta con lo que llegue mientras tanto detrás
+        failed: Optional[WriteBatch] = None
+        oldest = 0.0
+        received = 0
+        delay = WRITE_RETRY_MS
+        while True:
+            if failed is None:
+                oldest, op = await self._pending.get()
+                received = 1
+                batch = WriteBatch()
+                deadline = time.monotonic() + self.batch_ms / 1000
+            else:
+                # Las operaciones nuevas se añaden detrás de las del lote fallido: gana la última escritura
+                batch, failed = failed, None
+                op = None
+                if not self._pending.empty():
+                    _, op = self._pending.get_nowait()
+                    received += 1
+                deadline = time.monotonic()
+            # El lote se cierra al llegar a batch_size operaciones, al vencer batch_ms o con FLUSH
+            while op is not None and op is not FLUSH:
+                batch.add(op)
+                if batch.ops >= self.batch_size:
+                    break
+                if self._pending.empty():
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        _, op = await asyncio.wait_for(self._pending.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    _, op = self._pending.get_nowait()
+                received += 1
+            try:
+                if batch.ops:
+                    await self._timed("apply_batch", self.repository.apply_batch(batch))
+                    self.write_metrics.record(batch, oldest)
+            except Exception as e:
+                self.write_metrics.record(batch, oldest, failed=True)
+                log.error("write_flush_failed", flight=self.flight_id, ops=batch.ops, retry_ms=delay, error=str(e))
+                batch.retrying()
+                failed = batch
+                await asyncio.sleep(delay / 1000)
+                delay = min(delay * 2, WRITE_RETRY_MAX_MS)
+                continue
+            delay = WRITE_RETRY_MS
+            for _ in range(received):
+                self._pending.task_done()
@@ -0,0 +1,126 @@
+"""
+Incrementally maintained cabin aggregates for crew views.
+
+Instead of every crew client scanning the full seats map, the server keeps
+counters per class and per row (seats, occupied, buckled) and the set of
+occupied seats whose belt is not buckled. Each seat mutation removes the
+seat's old contribution and adds the new one, so an update is O(1) whatever
+the size of the cabin; only load() scans the seats.
+
+The summary is served by GET /cabin/summary, included in initial_state and
+pushed to crew:all subscribers as a `summary_updated` event, at most once per
+CABIN_SUMMARY_INTERVAL_MS while the cabin keeps changing.
+"""
+
+import os
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from bathroom_queue import BathroomQueue
+from topics import SEAT_ID_PATTERN
+
+# Intervalo mínimo entre dos summary_updated, 0 envía uno por cada cambio
+CABIN_SUMMARY_INTERVAL_MS = int(os.getenv("CABIN_SUMMARY_INTERVAL_MS", "250"))
+
+
+class Counts:
+    __slots__ = ("seats", "occupied", "buckled")
+
+    def __init__(self):
+        self.seats = 0
+        self.occupied = 0
+        self.buckled = 0
+
+    def add(self, seat: dict, sign: int):
+        self.seats += sign
+        self.occupied += sign * bool(seat.get("is_occupied"))
+        self.buckled += sign * bool(seat.get("is_buckled"))
+
+    def to_dict(self) -> dict:
+        return {"seats": self.seats, "occupied": self.occupied, "buckled": self.buckled}
+
+
+def seat_row(seat_id: str) -> Optional[str]:
+    match = SEAT_ID_PATTERN.match(seat_id)
+    return match.group(1) if match else None
+
+
+class CabinSummary:
+    def __init__(self, queue: Optional[BathroomQueue] = None):
+        self.total = Counts()
+        self.by_class: Dict[str, Counts] = {}
+        self.by_row: Dict[str, Counts] = {}
+        # Asientos ocupados sin el cinturón abrochado
+        self.unbuckled: Set[str] = set()
+        self.queue = queue or BathroomQueue()
+        self.version = 0
+        # Avisa de cada cambio (el vuelo programa el summary_updated)
+        self.on_change: Optional[Callable[[], None]] = None
+
+    def load(self, seats: Iterable[dict], queue: BathroomQueue):
+        """Rebuild every aggregate from scratch, the only full scan"""
+        self.total = Counts()
+        self.by_class = {}
+        self.by_row = {}
+        self.unbuckled = set()
+        self.queue = queue
+        for seat in seats:
+            self._apply(seat, 1)
+        self._changed()
+
+    def add(self, seat: dict):
+        self._apply(seat, 1)
+        self._changed()
+
+    def discard(self, seat: dict):
+        """Remove the contribution of a seat, before it changes"""
+        self._apply(seat, -1)
+
+    def queue_changed(self, queue: Optional[BathroomQueue] = None):
+        if queue is not None:
+            self.queue = queue
+        self._changed()
+
+    def _apply(self, seat: dict, sign: int):
+        seat_id = seat["seat_id"]
+        self.total.add(seat, sign)
+        seat_class = seat.get("seat_class")
+        if seat_class:
+            counts = self.by_class.get(seat_class)
+            if counts is None:
+                counts = self.by_class[seat_class] = Counts()
+            counts.add(seat, sign)
+        row = seat_row(seat_id)
+        if row:
+            counts = self.by_row.get(row)
+            if counts is None:
+                counts = self.by_row[row] = Counts()
+            counts.add(seat, sign)
+        if seat.get("is_occupied") and not seat.get("is_buckled"):
+            if sign > 0:
+                self.unbuckled.add(seat_id)
+            else:
+                self.unbuckled.discard(seat_id)
+
+    def _changed(self):
+        self.version += 1
+        if self.on_change is not None:
+            self.on_change()
+
+    def to_dict(self, detail: bool = True) -> dict:
+        """Summary as sent to clients, without the per-row counts and seat list if not detail"""
+        head = self.queue.head()
+        summary = dict(
+            self.total.to_dict(),
+            version=self.version,
+            unbuckled=len(self.unbuckled),
+            byClass={seat_class: counts.to_dict() for seat_class, counts in self.by_class.items()},
+            bathroomQueue={
+                "length": len(self.queue),
+                "version": self.queue.version,
+                "oldestTimestamp": head["timestamp"] if head else None
+            }
+        )
+        if detail:
+            summary["unbuckledSeats"] = sorted(self.unbuckled, key=lambda seat_id: (len(seat_id), seat_id))
+            summary["byRow"] = {row: counts.to_dict() for row, counts in self.by_row.items()}
+        return summary
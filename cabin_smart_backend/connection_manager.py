@@ -0,0 +1,215 @@
+"""
+WebSocket connection manager with per-client outbound queues.
+
+Every connection owns a bounded queue drained by its own writer task, so
+broadcasting never awaits a socket: a slow client only fills its own queue.
+When a queue overflows the slow-consumer policy decides what happens:
+
+- "disconnect": the client is closed and has to reconnect
+- "resync": pending messages are discarded and a fresh snapshot is sent instead
+
+Clients subscribe to topics (see topics.py); events published with topics
+are only queued for the subscribers of those topics, so fan-out cost is
+proportional to the number of interested clients.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from encoding import EncodedMessage
+from metrics import BROADCAST_RECIPIENTS, BROADCAST_SECONDS
+from structured_log import get_logger
+from topics import ALL_TOPIC, DEFAULT_TOPICS
+
+log = get_logger("connection_manager")
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+SLOW_CONSUMER_POLICIES = ("disconnect", "resync")
+
+# Código de cierre "Try Again Later"
+CLOSE_SLOW_CONSUMER = 1013
+
+# Marca en la cola que indica al writer que envíe un snapshot completo
+RESYNC = object()
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int, snapshot_format: str = "json", binary: bool = False):
+        self.websocket = websocket
+        # Subprotocolo MessagePack: frames binarios en lugar de texto JSON
+        self.binary = binary
+        # Formato del initial_state que pidió el cliente, también el de las resincronizaciones
+        self.snapshot_format = snapshot_format
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.topics: Set[str] = set()
+        self.dropped = 0
+
+    def enqueue(self, message) -> bool:
+        """Queue a message without waiting, returns False if the queue is full"""
+        if self.binary and isinstance(message, EncodedMessage):
+            # Se empaqueta ahora, una vez para todos los clientes binarios
+            message.binary
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def resync(self):
+        """Discard pending messages and schedule a full snapshot"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(RESYNC)
+
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, slow_consumer_policy: str = SLOW_CONSUMER_POLICY):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(
+                f"Unknown slow consumer policy {slow_consumer_policy!r}, expected one of {SLOW_CONSUMER_POLICIES}"
+            )
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        # Tema -> clientes suscritos
+        self.subscribers: Dict[str, Set[ClientConnection]] = {}
+        # Construye el mensaje de resincronización (initial_state) para un cliente lento, en su formato
+        self.snapshot_builder: Optional[Callable[[str], Awaitable[EncodedMessage]]] = None
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = DEFAULT_TOPICS,
+                      snapshot_format: str = "json", binary: bool = False):
+        if websocket not in self.connections:
+            client = ClientConnection(websocket, self.queue_size, snapshot_format, binary)
+            client.writer_task = asyncio.create_task(self._writer(client))
+            self.connections[websocket] = client
+            self._set_topics(client, topics)
+            log.info("ws_connected", connections=len(self.connections))
+
+    async def disconnect(self, websocket: WebSocket):
+        client = self.connections.pop(websocket, None)
+        if client:
+            self._set_topics(client, ())
+            if client.writer_task and client.writer_task is not asyncio.current_task():
+                client.writer_task.cancel()
+            log.info("ws_disconnected", connections=len(self.connections))
+
+    async def send_personal(self, websocket: WebSocket, message: EncodedMessage):
+        """Queue a message for a single client, keeping order with broadcasts"""
+        client = self.connections.get(websocket)
+        if client and not client.enqueue(message):
+            self._handle_slow_consumer(client)
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        """Replace the topics a client is subscribed to"""
+        client = self.connections.get(websocket)
+        if client:
+            self._set_topics(client, topics)
+
+    def topics_of(self, websocket: WebSocket) -> Set[str]:
+        client = self.connections.get(websocket)
+        return set(client.topics) if client else set(DEFAULT_TOPICS)
+
+    def send_queue_lengths(self) -> List[int]:
+        """Messages waiting in the outbound queue of every client"""
+        return [client.queue.qsize() for client in self.connections.values()]
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscribers.get(topic))
+
+    async def broadcast(self, message: EncodedMessage, topics: Optional[Iterable[str]] = None, include_all: bool = True):
+        """Queue a message for every client, or only for the subscribers of the given topics"""
+        started = time.perf_counter()
+        if topics is None:
+            recipients = list(self.connections.values())
+        else:
+            recipients = set()
+            for topic in topics:
+                recipients.update(self.subscribers.get(topic, ()))
+            if include_all:
+                recipients.update(self.subscribers.get(ALL_TOPIC, ()))
+        for client in recipients:
+            if not client.enqueue(message):
+                self._handle_slow_consumer(client)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        BROADCAST_RECIPIENTS.observe(len(recipients))
+
+    async def broadcast_by_topics(self, topics: Iterable[str],
+                                  build: Callable[[Set[str]], Optional[EncodedMessage]]):
+        """Queue for every subscriber of the topics that is not on crew:all one message built for all its topics
+
+        The message is built once per distinct set of subscriptions, None sends nothing.
+        """
+        started = time.perf_counter()
+        crew = self.subscribers.get(ALL_TOPIC, set())
+        recipients = set()
+        for topic in topics:
+            recipients.update(self.subscribers.get(topic, ()))
+        recipients -= crew
+        messages: Dict[frozenset, Optional[EncodedMessage]] = {}
+        for client in recipients:
+            subscribed = frozenset(client.topics)
+            if subscribed not in messages:
+                messages[subscribed] = build(client.topics)
+            message = messages[subscribed]
+            if message is not None and not client.enqueue(message):
+                self._handle_slow_consumer(client)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+        BROADCAST_RECIPIENTS.observe(len(recipients))
+
+    def _set_topics(self, client: ClientConnection, topics: Iterable[str]):
+        for topic in client.topics:
+            subscribers = self.subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscribers[topic]
+        client.topics = set(topics)
+        for topic in client.topics:
+            self.subscribers.setdefault(topic, set()).add(client)
+
+    def _handle_slow_consumer(self, client: ClientConnection):
+        if self.slow_consumer_policy == "resync" and self.snapshot_builder is not None:
+            log.warning("slow_consumer_resync", dropped=client.queue.qsize())
+            client.resync()
+            return
+
+        log.warning("slow_consumer_closed", pending=client.queue.qsize())
+        self.connections.pop(client.websocket, None)
+        self._set_topics(client, ())
+        if client.writer_task:
+            client.writer_task.cancel()
+        asyncio.create_task(self._close(client.websocket, CLOSE_SLOW_CONSUMER))
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self, client: ClientConnection):
+        websocket = client.websocket
+        try:
+            while True:
+                message = await client.queue.get()
+                if message is RESYNC:
+                    message = await self.snapshot_builder(client.snapshot_format)
+                if client.binary:
+                    await websocket.send_bytes(message.binary)
+                else:
+                    await websocket.send_text(message.text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("ws_send_failed", error=str(e))
+            await self.disconnect(websocket)
@@ -1,9 +1,15 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from typing import Optional
 import asyncio
 import random
 
+from structured_log import get_logger
+
+log = get_logger("database")
+
 # MongoDB connection
 client: Optional[AsyncIOMotorClient] = None
 database = None
@@ -14,6 +20,9 @@ SEATS_COLLECTION = "seats"
 BATHROOM_QUEUE_COLLECTION = "bathroom_queue"
 BATHROOM_STATUS_COLLECTION = "bathroom_status"
 
+# Vuelo que usa las colecciones sin prefijo (compatibilidad con datos existentes)
+DEFAULT_FLIGHT_ID = os.getenv("DEFAULT_FLIGHT_ID", "default")
+
 # Lista de nombres aleatorios para los pasajeros
 RANDOM_NAMES = [
     'Ana García', 'Carlos López', 'María Rodríguez', 'José Martínez', 'Laura Sánchez',
@@ -71,9 +80,9 @@ async def connect_to_mongo():
     # Test connection
     try:
         await client.admin.command('ping')
-        print("Connected to MongoDB successfully!")
+        log.info("mongo_connected")
     except Exception as e:
-        print(f"Failed to connect to MongoDB: {e}")
+        log.error("mongo_connect_failed", error=str(e))
         raise
 
 async def close_mongo_connection():
@@ -81,71 +90,111 @@ async def close_mongo_connection():
     global client
     if client:
         client.close()
-        print("Disconnected from MongoDB")
+        log.info("mongo_disconnected")
 
 async def get_database():
     """Get database instance"""
     return database
 
-async def init_seats_collection():
+# Índices declarados por colección: (campos, opciones)
+INDEXES = {
+    SEATS_COLLECTION: [
+        ([("seat_id", ASCENDING)], {"unique": True, "name": "seat_id_unique"}),
+    ],
+    BATHROOM_QUEUE_COLLECTION: [
+        ([("seat_id", ASCENDING)], {"unique": True, "name": "seat_id_unique"}),
+        ([("timestamp", ASCENDING)], {"name": "timestamp"}),
+    ],
+    BATHROOM_STATUS_COLLECTION: [
+        ([("bathroom_id", ASCENDING)], {"unique": True, "name": "bathroom_id_unique"}),
+    ],
+}
+
+def collection_name(base: str, flight_id: str = DEFAULT_FLIGHT_ID) -> str:
+    """Name of a collection for a flight; each flight gets its own set of collections"""
+    if flight_id == DEFAULT_FLIGHT_ID:
+        return base
+    return f"flight_{flight_id}.{base}"
+
+async def init_indexes(flight_id: str = DEFAULT_FLIGHT_ID):
+    """Create the declared indexes on every collection"""
+    for base, indexes in INDEXES.items():
+        collection = database[collection_name(base, flight_id)]
+        for keys, options in indexes:
+            await collection.create_index(keys, **options)
+    log.info("indexes_ensured", flight=flight_id, collections=len(INDEXES))
+
+def build_default_seats():
+    """Build the demo cabin: 33 rows of 6 seats, rows 1-8 business"""
+    seats_data = []
+    rows = 33  # Updated to 33 rows
+    seats_per_row = 6
+    
+    for row in range(1, rows + 1):
+        for seat_num in range(1, seats_per_row + 1):
+            seat_letter = chr(64 + seat_num)  # A, B, C, etc.
+            seat_id = f"{row}{seat_letter}"
+            
+            # Determine seat class
+            is_business = row <= 8
+            seat_class = "business" if is_business else "economy"
+            
+            # Todos los asientos están ocupados para la demo
+            # Aleatoriamente algunos tienen cinturón abrochado y otros no
+            is_buckled = random.choice([True, False])
+            
+            seats_data.append({
+                "seat_id": seat_id,
+                "passenger_name": get_random_name(),
+                "is_occupied": True,
+                "is_buckled": is_buckled,
+                "seat_class": seat_class,
+                "last_updated": None
+            })
+    return seats_data
+
+async def init_seats_collection(flight_id: str = DEFAULT_FLIGHT_ID):
     """Initialize seats collection with default data"""
-    seats_collection = database[SEATS_COLLECTION]
+    seats_collection = database[collection_name(SEATS_COLLECTION, flight_id)]
     
     # Check if collection is empty
     count = await seats_collection.count_documents({})
     if count == 0:
         # Create default seats
-        seats_data = []
-        rows = 33  # Updated to 33 rows
-        seats_per_row = 6
-        
-        for row in range(1, rows + 1):
-            for seat_num in range(1, seats_per_row + 1):
-                seat_letter = chr(64 + seat_num)  # A, B, C, etc.
-                seat_id = f"{row}{seat_letter}"
-                
-                # Determine seat class
-                is_business = row <= 8
-                seat_class = "business" if is_business else "economy"
-                
-                # Todos los asientos están ocupados para la demo
-                # Aleatoriamente algunos tienen cinturón abrochado y otros no
-                is_buckled = random.choice([True, False])
-                
-                seats_data.append({
-                    "seat_id": seat_id,
-                    "passenger_name": get_random_name(),
-                    "is_occupied": True,
-                    "is_buckled": is_buckled,
-                    "seat_class": seat_class,
-                    "last_updated": None
-                })
-        
-        await seats_collection.insert_many(seats_data)
-        print(f"Initialized {len(seats_data)} seats in database (Business: 1-8, Economy: 9-33)")
+        seats_data = build_default_seats()
+        try:
+            await seats_collection.insert_many(seats_data, ordered=False)
+            log.info("seats_initialized", backend="mongo", flight=flight_id, seats=len(seats_data))
+        except BulkWriteError:
+            # Otro worker arrancado a la vez ya los creó (índice único en seat_id)
+            log.info("seats_already_initialized", flight=flight_id)
 
-async def init_bathroom_queue_collection():
+async def init_bathroom_queue_collection(flight_id: str = DEFAULT_FLIGHT_ID):
     """Initialize bathroom queue collection"""
-    queue_collection = database[BATHROOM_QUEUE_COLLECTION]
+    queue_collection = database[collection_name(BATHROOM_QUEUE_COLLECTION, flight_id)]
     
     # Clear existing queue on startup
     await queue_collection.delete_many({})
-    print("Initialized bathroom queue collection")
+    log.info("bathroom_queue_initialized", flight=flight_id)
 
-async def init_bathroom_status_collection():
+async def init_bathroom_status_collection(bathroom_ids=("main",), flight_id: str = DEFAULT_FLIGHT_ID):
     """Initialize bathroom status collection"""
-    status_collection = database[BATHROOM_STATUS_COLLECTION]
+    status_collection = database[collection_name(BATHROOM_STATUS_COLLECTION, flight_id)]
     
-    # Check if bathroom status already exists
-    existing_status = await status_collection.find_one({"bathroom_id": "main"})
-    if not existing_status:
-        # Initialize bathroom as available
-        await status_collection.insert_one({
-            "bathroom_id": "main",
-            "is_occupied": False,
-            "current_user": None,
-            "last_updated": None
-        })
-        print("Initialized bathroom status collection")
-    else:
-        print("Bathroom status already exists")
+    for bathroom_id in bathroom_ids:
+        # Check if bathroom status already exists
+        existing_status = await status_collection.find_one({"bathroom_id": bathroom_id})
+        if not existing_status:
+            # Initialize bathroom as available
+            try:
+                await status_collection.insert_one({
+                    "bathroom_id": bathroom_id,
+                    "is_occupied": False,
+                    "current_user": None,
+                    "last_updated": None
+                })
+                log.info("bathroom_status_initialized", flight=flight_id, bathroom=bathroom_id)
+            except DuplicateKeyError:
+                log.debug("bathroom_status_exists", flight=flight_id, bathroom=bathroom_id)
+        else:
+            log.debug("bathroom_status_exists", flight=flight_id, bathroom=bathroom_id)
@@ -0,0 +1,128 @@
+"""
+WebSocket message dispatch.
+
+Handlers are registered by event name together with a function that returns
+the ordering keys of a message (e.g. "seat:12C", "bathroom:aft"). The
+receive loop of a connection no longer awaits each handler: it hands the
+message to a ConnectionDispatcher, which runs it as a task and goes back to
+reading frames. Two messages sharing a key always run one after the other,
+in the order they were received; messages with disjoint keys run
+concurrently. A message without keys is ordered with every other keyless
+message of the connection.
+
+At most WS_MAX_IN_FLIGHT messages of a connection run at the same time; when
+the limit is reached the receive loop stops reading until one finishes, so
+the client is slowed down by TCP backpressure. WS_MAX_IN_FLIGHT=1 restores
+fully sequential handling.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import HANDLER_SECONDS
+from structured_log import get_logger
+
+log = get_logger("dispatcher")
+
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "16"))
+
+# Clave de los mensajes que no declaran ninguna
+CONNECTION_KEY = "connection"
+
+Handler = Callable[..., Awaitable[None]]
+KeyFunc = Callable[..., Iterable[str]]
+
+
+class HandlerRegistry:
+    def __init__(self):
+        self.handlers: Dict[str, Tuple[Handler, Optional[KeyFunc]]] = {}
+
+    def register(self, event: str, keys: Optional[KeyFunc] = None):
+        """Decorator registering the handler of an event and the keys that order it"""
+        def decorator(handler: Handler) -> Handler:
+            if event in self.handlers:
+                raise ValueError(f"Handler for {event!r} already registered")
+            self.handlers[event] = (handler, keys)
+            return handler
+        return decorator
+
+    def get(self, event: str) -> Optional[Tuple[Handler, Optional[KeyFunc]]]:
+        return self.handlers.get(event)
+
+    def __contains__(self, event) -> bool:
+        return isinstance(event, str) and event in self.handlers
+
+
+class ConnectionDispatcher:
+    """Runs the messages of one connection concurrently, ordered per key"""
+
+    def __init__(self, registry: HandlerRegistry, max_in_flight: int = WS_MAX_IN_FLIGHT):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.registry = registry
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        # Clave -> última tarea que la usa
+        self._tails: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def dispatch(self, event: str, *args, handler: Optional[Handler] = None, label: Optional[str] = None) -> bool:
+        """Schedule the handler of an event, waiting for a free slot; returns False if the event is unknown
+
+        A given handler runs instead of the registered one, ordered by the keys of the event
+        (e.g. the answer to a rejected message); label names it in the handler metrics.
+        """
+        entry = self.registry.get(event)
+        if entry is None:
+            return False
+        registered, key_func = entry
+        handler = handler or registered
+        label = label or event
+        try:
+            keys = set(key_func(*args)) if key_func else set()
+        except Exception as e:
+            # Un mensaje mal formado no cierra la conexión: se ordena con los mensajes sin clave
+            log.warning("handler_keys_failed", ws_event=event, error=str(e))
+            keys = set()
+        if not keys:
+            keys = {CONNECTION_KEY}
+
+        await self._slots.acquire()
+        previous = [self._tails[key] for key in keys if key in self._tails]
+        task = asyncio.create_task(self._run(label, handler, args, previous))
+        for key in keys:
+            self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finished(done, keys))
+        return True
+
+    async def _run(self, event: str, handler: Handler, args: tuple, previous: List[asyncio.Task]):
+        # Espera a los mensajes anteriores con alguna clave en común; sus errores no le afectan
+        if previous:
+            await asyncio.wait(previous)
+        started = time.perf_counter()
+        try:
+            await handler(*args)
+        except Exception as e:
+            log.error("handler_failed", ws_event=event, error=str(e))
+        finally:
+            # Solo el tiempo del handler, sin la espera a los mensajes anteriores
+            HANDLER_SECONDS.labels(event).observe(time.perf_counter() - started)
+
+    def _finished(self, task: asyncio.Task, keys: Set[str]):
+        self._tasks.discard(task)
+        for key in keys:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+        self._slots.release()
+
+    async def drain(self):
+        """Wait for every scheduled message, a handler that started is never cut in half"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
@@ -0,0 +1,71 @@
+"""
+Message encoding layer.
+
+Each outgoing event is serialized exactly once into an EncodedMessage whose
+buffer is shared by every recipient. orjson is used when installed, the
+standard library json module otherwise. The MessagePack form for clients of
+the binary subprotocol (see binary_protocol.py) is also built once, the
+first time a binary recipient needs it.
+"""
+
+import json
+from typing import Any, Optional
+
+from binary_protocol import pack
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(payload: Any) -> bytes:
+        return orjson.dumps(payload)
+
+    def loads(data):
+        return orjson.loads(data)
+
+    DecodeError = orjson.JSONDecodeError
+else:
+    def dumps(payload: Any) -> bytes:
+        return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
+
+    DecodeError = json.JSONDecodeError
+
+
+class EncodedMessage:
+    """A serialized message, shared by every recipient of a broadcast"""
+
+    __slots__ = ("data", "payload", "_text", "_binary")
+
+    def __init__(self, data: bytes, payload: Optional[dict] = None):
+        self.data = data
+        self.payload = payload
+        self._text: Optional[str] = None
+        self._binary: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        # Los frames de texto ASGI necesitan str: se decodifica una sola vez
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        # Se construye al encolarlo para el primer cliente binario, con el payload tal como se publicó
+        if self._binary is None:
+            self._binary = pack(self.payload)
+        return self._binary
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def encode(payload: dict) -> EncodedMessage:
+    """Serialize a message once"""
+    return EncodedMessage(dumps(payload), payload)
@@ -0,0 +1,60 @@
+"""
+Sequence-numbered broadcast log with a bounded replay ring.
+
+Every broadcast gets a monotonically increasing `seq` and is kept, already
+encoded, in a ring buffer. A client reconnecting with the last sequence it
+saw receives only the events it missed; if those were already evicted (or
+the server restarted, which changes the epoch) it needs a full snapshot.
+"""
+
+import os
+import uuid
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from encoding import EncodedMessage, encode
+from topics import ALL_TOPIC, patch_for, wants
+
+REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "1024"))
+
+# (seq, mensaje, temas, include_all, temas de cada asiento si es un seats_patch)
+Entry = Tuple[int, EncodedMessage, Optional[Tuple[str, ...]], bool, Optional[Dict[str, List[str]]]]
+
+
+class EventLog:
+    def __init__(self, size: int = REPLAY_BUFFER_SIZE):
+        # Identifica esta instancia del servidor: las secuencias no sobreviven a un reinicio
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        # Los temas permiten filtrar el replay por suscripción
+        self.ring: Deque[Entry] = deque(maxlen=size)
+
+    def record(self, payload: dict, topics: Optional[Iterable[str]] = None, include_all: bool = True,
+               parts: Optional[Dict[str, List[str]]] = None) -> EncodedMessage:
+        """Stamp a broadcast with the next sequence number, encode and keep it"""
+        self.seq += 1
+        payload["seq"] = self.seq
+        message = encode(payload)
+        self.ring.append((self.seq, message, tuple(topics) if topics is not None else None, include_all, parts))
+        return message
+
+    def since(self, last_seq: int, epoch: str, subscribed: Optional[Set[str]] = None) -> Optional[List[EncodedMessage]]:
+        """Events after last_seq the subscriber wants, or None if they can no longer be replayed"""
+        if epoch != self.epoch or last_seq > self.seq:
+            return None
+        if last_seq == self.seq:
+            return []
+        if not self.ring or self.ring[0][0] > last_seq + 1:
+            return None
+        # El ring es contiguo: el primer evento perdido está en una posición conocida
+        start = last_seq + 1 - self.ring[0][0]
+        missed = []
+        for _, message, topics, include_all, parts in list(self.ring)[start:]:
+            if parts is not None and subscribed is not None and ALL_TOPIC not in subscribed:
+                # Del patch solo los asientos de sus temas, como lo recibió en directo
+                patch = patch_for(message.payload, parts, subscribed)
+                if patch is not None:
+                    missed.append(encode(patch))
+            elif subscribed is None or wants(subscribed, topics, include_all):
+                missed.append(message)
+        return missed
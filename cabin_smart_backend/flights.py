@@ -0,0 +1,210 @@
+"""
+Per-flight partitioning.
+
+A Flight bundles everything that used to be global for the single aircraft:
+its cabin state (persisted in its own collections or tables), its WebSocket room, its
+event log and its snapshot cache. Events of one flight are only ever sent
+to the sockets of that flight's room. With several workers, state changes
+and events are also relayed through the broadcast bus (broadcast_bus.py).
+"""
+
+import asyncio
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+from broadcast_bus import BroadcastBus, LocalBus
+from cabin_state import CabinState, WriteOp
+from cabin_summary import CABIN_SUMMARY_INTERVAL_MS
+from connection_manager import ConnectionManager
+from database import DEFAULT_FLIGHT_ID
+from encoding import EncodedMessage, encode
+from event_log import EventLog
+from rate_limit import WS_SEAT_RATE_LIMITS, RateLimiter, parse_limits
+from seat_coalescer import SeatUpdateCoalescer
+from sensor_ingest import SensorIngestor
+from snapshot_cache import SnapshotCache
+from topics import ALL_TOPIC, patch_for, seat_topics
+
+# Vuelos que se abren al arrancar, separados por comas
+FLIGHT_IDS = [flight_id.strip() for flight_id in os.getenv("FLIGHT_IDS", DEFAULT_FLIGHT_ID).split(",") if flight_id.strip()]
+
+# Se comprueba con fullmatch: "$" también aceptaría un salto de línea al final
+FLIGHT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+# Vuelos que se pueden abrir con POST /flights/{id} además de FLIGHT_IDS: cada uno inicializa su
+# almacenamiento y arranca sus tareas. Con 0 solo se sirven los de FLIGHT_IDS
+MAX_RUNTIME_FLIGHTS = int(os.getenv("MAX_RUNTIME_FLIGHTS", "16"))
+
+# Formatos de initial_state: asientos completos o bits de ocupación y cinturón (seat_table.py)
+SNAPSHOT_FORMATS = ("json", "bitmap")
+
+
+class Flight:
+    def __init__(self, flight_id: str, bus: Optional[BroadcastBus] = None):
+        self.flight_id = flight_id
+        self.bus = bus or LocalBus()
+        self.state = CabinState(flight_id)
+        self.state.replicate = self.relay_change
+        self.state.summary.on_change = self.schedule_summary
+        self._summary_task: Optional[asyncio.Task] = None
+        self.manager = ConnectionManager()
+        self.event_log = EventLog()
+        self.seat_updates = SeatUpdateCoalescer(self.publish, topics_for=self.seat_topics)
+        # El número de usuarios conectados del snapshot es el del momento en que se construyó
+        self.snapshot_cache = SnapshotCache(
+            self.build_initial_state, lambda: (self.state.version, self.event_log.seq)
+        )
+        self.bitmap_snapshot_cache = SnapshotCache(
+            lambda: self.build_initial_state("bitmap"), lambda: (self.state.version, self.event_log.seq)
+        )
+        self.manager.snapshot_builder = self.snapshot
+        # Límites por asiento, compartidos por todas las conexiones del vuelo
+        self.seat_limits = RateLimiter(parse_limits(WS_SEAT_RATE_LIMITS))
+        # Ingesta de sensores por lotes, se crea con el primer lote recibido
+        self.sensors: Optional[SensorIngestor] = None
+
+    async def open(self, clear_queue: bool = True):
+        """Initialize the flight storage and load its state"""
+        await self.state.load(clear_queue)
+        self.state.start()
+
+    def schedule_summary(self):
+        """Publish summary_updated once the current burst of changes is over"""
+        if self._summary_task is None:
+            self._summary_task = asyncio.create_task(self._publish_summary())
+
+    async def _publish_summary(self):
+        try:
+            await asyncio.sleep(CABIN_SUMMARY_INTERVAL_MS / 1000)
+        finally:
+            self._summary_task = None
+        # Cada worker publica su propio resumen: no se reenvía por el bus
+        await self.publish({
+            "event": "summary_updated",
+            "data": self.state.summary.to_dict()
+        }, [ALL_TOPIC], relay=False)
+
+    async def close(self):
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
+        if self.sensors is not None:
+            await self.sensors.stop()
+        await self.seat_updates.stop()
+        await self.state.stop()
+
+    async def publish(self, payload: dict, topics: Optional[Iterable[str]] = None, include_all: bool = True,
+                      relay: bool = True, parts: Optional[Dict[str, List[str]]] = None):
+        """Stamp an event with its sequence number and broadcast it to the flight room (or its topic subscribers)
+
+        With parts (topics of each seat of a seats_patch) crew:all subscribers get the
+        whole patch and every other subscriber one patch with only the seats of its topics.
+        """
+        if topics is not None:
+            topics = list(topics)
+        if relay:
+            # Sin seq: cada worker numera los eventos de sus propios clientes
+            self.bus.publish({
+                "flight": self.flight_id, "event": payload, "topics": topics, "include_all": include_all, "parts": parts
+            })
+        message = self.event_log.record(payload, topics, include_all, parts)
+        if parts is None:
+            await self.manager.broadcast(message, topics, include_all)
+            return
+        await self.manager.broadcast(message, [ALL_TOPIC])
+
+        def partial(subscribed):
+            # Los patches parciales llevan el seq del completo, el event log solo guarda este
+            patch = patch_for(payload, parts, subscribed)
+            return encode(patch) if patch is not None else None
+
+        # Un solo patch por cliente con los asientos de todos sus temas
+        await self.manager.broadcast_by_topics(topics, partial)
+
+    def relay_change(self, op: WriteOp):
+        self.bus.publish({"flight": self.flight_id, "change": op})
+
+    def seat_topics(self, seat_id: str) -> List[str]:
+        seats = self.state.seats
+        return seat_topics(seat_id, seats.class_of(seat_id) if seat_id in seats else None)
+
+    async def snapshot(self, snapshot_format: str = "json") -> EncodedMessage:
+        """Cached initial_state message in the given snapshot format"""
+        if snapshot_format == "bitmap":
+            return await self.bitmap_snapshot_cache.get()
+        return await self.snapshot_cache.get()
+
+    async def build_initial_state(self, snapshot_format: str = "json") -> EncodedMessage:
+        """Build the initial_state message with the full cabin snapshot"""
+        data = {"flightId": self.flight_id, "epoch": self.event_log.epoch}
+        if snapshot_format == "bitmap":
+            # Ocupación y cinturones en bits, sin nombres (GET /seats) ni listas por fila del resumen
+            data["seatBitmap"] = self.state.get_seat_bitmap()
+        else:
+            data["seats"] = self.state.get_all_seats()
+        data.update({
+            "bathroomQueue": self.state.get_bathroom_queue(),
+            "bathroomQueueVersion": self.state.queue_version,
+            "bathroomStatus": self.state.get_bathroom_status(),
+            "lavatories": self.state.get_lavatories(),
+            "summary": self.state.summary.to_dict(detail=snapshot_format != "bitmap"),
+            "connectedUsers": len(self.manager.active_connections)
+        })
+        return encode({
+            "event": "initial_state",
+            "seq": self.event_log.seq,
+            "data": data
+        })
+
+
+class TooManyFlights(Exception):
+    pass
+
+
+class FlightRegistry:
+    def __init__(self, bus: Optional[BroadcastBus] = None):
+        self.flights: Dict[str, Flight] = {}
+        self.bus = bus or LocalBus()
+        # Falso si al arrancar había otros workers: la cola persistida es la que ellos tienen
+        self.clear_queue = True
+        self._lock = asyncio.Lock()
+
+    def get(self, flight_id: str) -> Optional[Flight]:
+        return self.flights.get(flight_id)
+
+    def ids(self) -> List[str]:
+        return list(self.flights)
+
+    async def open(self, flight_id: str) -> Flight:
+        """Open a flight, loading it if it is not open yet; raises TooManyFlights past MAX_RUNTIME_FLIGHTS"""
+        if not isinstance(flight_id, str) or not FLIGHT_ID_PATTERN.fullmatch(flight_id):
+            raise ValueError(f"Invalid flight id {flight_id!r}")
+        async with self._lock:
+            flight = self.flights.get(flight_id)
+            if flight is None:
+                runtime = sum(1 for open_id in self.flights if open_id not in FLIGHT_IDS)
+                if flight_id not in FLIGHT_IDS and runtime >= MAX_RUNTIME_FLIGHTS:
+                    raise TooManyFlights(f"Cannot open {flight_id!r}, {runtime} flights besides FLIGHT_IDS are open")
+                flight = Flight(flight_id, self.bus)
+                await flight.open(self.clear_queue)
+                self.flights[flight_id] = flight
+        return flight
+
+    async def deliver(self, message: dict):
+        """Apply a state change or publish an event relayed by another worker"""
+        # Solo vuelos abiertos aquí: abrir uno reinicializaría su almacenamiento (y vaciaría la cola)
+        flight = self.flights.get(message.get("flight"))
+        if flight is None:
+            return
+        if "change" in message:
+            flight.state.apply_replicated(tuple(message["change"]))
+        else:
+            await flight.publish(
+                message["event"], message["topics"], message["include_all"], relay=False, parts=message.get("parts")
+            )
+
+    async def close_all(self):
+        for flight in self.flights.values():
+            await flight.close()
+        self.flights = {}
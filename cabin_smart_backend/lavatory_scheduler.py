@@ -0,0 +1,163 @@
+"""
+Lavatory scheduling engine.
+
+A cabin has several lavatories, each with a zone and the seat classes allowed
+to use it (e.g. forward lavatories reserved for business). Passengers wait in
+a single FIFO queue; whenever a lavatory is free the scheduler assigns it to
+the earliest queued passenger allowed to use it and reserves it until that
+passenger enters.
+
+The layout is read from LAVATORY_LAYOUT as a comma separated list of
+`id:zone:classes` entries, `classes` being `all` or classes joined by `|`:
+
+    LAVATORY_LAYOUT="fwd:forward:business,mid-l:mid:all,mid-r:mid:all,aft:aft:all"
+
+Without it the cabin has a single lavatory, "main", open to everyone.
+"""
+
+import os
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+DEFAULT_LAYOUT = "main:cabin:all"
+LAVATORY_LAYOUT = os.getenv("LAVATORY_LAYOUT", DEFAULT_LAYOUT)
+
+
+class Lavatory:
+    __slots__ = ("bathroom_id", "zone", "allowed_classes", "is_occupied", "current_user", "assigned_to", "last_updated")
+
+    def __init__(self, bathroom_id: str, zone: str, allowed_classes: Optional[FrozenSet[str]] = None):
+        self.bathroom_id = bathroom_id
+        self.zone = zone
+        # None: cualquier clase puede usarlo
+        self.allowed_classes = allowed_classes
+        self.is_occupied = False
+        self.current_user: Optional[str] = None
+        self.assigned_to: Optional[str] = None
+        self.last_updated: Optional[str] = None
+
+    @property
+    def is_free(self) -> bool:
+        return not self.is_occupied and self.assigned_to is None
+
+    def allows(self, seat_class: str) -> bool:
+        return self.allowed_classes is None or seat_class in self.allowed_classes
+
+    def to_dict(self) -> dict:
+        return {
+            "bathroom_id": self.bathroom_id,
+            "zone": self.zone,
+            "is_occupied": self.is_occupied,
+            "current_user": self.current_user,
+            "assigned_to": self.assigned_to,
+            "last_updated": self.last_updated
+        }
+
+
+def parse_layout(layout: str = LAVATORY_LAYOUT) -> List[Lavatory]:
+    """Build the lavatories described by a layout string"""
+    lavatories = []
+    for entry in filter(None, (part.strip() for part in layout.split(","))):
+        bathroom_id, zone, classes = (entry.split(":") + ["", "all"])[:3]
+        allowed = None if classes in ("", "all") else frozenset(classes.split("|"))
+        lavatories.append(Lavatory(bathroom_id, zone or bathroom_id, allowed))
+    if not lavatories:
+        raise ValueError(f"Lavatory layout {layout!r} does not define any lavatory")
+    return lavatories
+
+
+class LavatoryScheduler:
+    def __init__(self, lavatories: Iterable[Lavatory]):
+        self.lavatories: Dict[str, Lavatory] = {lavatory.bathroom_id: lavatory for lavatory in lavatories}
+        # Pasajero -> lavabo reservado para él
+        self.assignments: Dict[str, str] = {}
+
+    def __iter__(self):
+        return iter(self.lavatories.values())
+
+    def get(self, bathroom_id: str) -> Optional[Lavatory]:
+        return self.lavatories.get(bathroom_id)
+
+    def find_free(self, seat_class: str) -> Optional[Lavatory]:
+        """First free lavatory this seat class may use"""
+        for lavatory in self.lavatories.values():
+            if lavatory.is_free and lavatory.allows(seat_class):
+                return lavatory
+        return None
+
+    def lavatory_of(self, seat_id: str) -> Optional[Lavatory]:
+        """Lavatory assigned to or occupied by a passenger"""
+        bathroom_id = self.assignments.get(seat_id)
+        if bathroom_id:
+            return self.lavatories[bathroom_id]
+        for lavatory in self.lavatories.values():
+            if lavatory.current_user == seat_id:
+                return lavatory
+        return None
+
+    def resolve(self, bathroom_id: Optional[str], seat_id: Optional[str], seat_class: Optional[str] = None) -> Optional[Lavatory]:
+        """Lavatory a door sensor event refers to when the sensor does not say"""
+        if bathroom_id:
+            # Un id que no es str (p. ej. una lista enviada por un cliente) no es un lavabo
+            return self.lavatories.get(bathroom_id) if isinstance(bathroom_id, str) else None
+        if isinstance(seat_id, str) and seat_id:
+            lavatory = self.lavatory_of(seat_id)
+            if lavatory:
+                return lavatory
+            if seat_class:
+                lavatory = self.find_free(seat_class)
+                if lavatory:
+                    return lavatory
+        if len(self.lavatories) == 1:
+            return next(iter(self.lavatories.values()))
+        return None
+
+    def enter(self, lavatory: Lavatory, seat_id: Optional[str], now: Optional[str] = None):
+        if lavatory.assigned_to:
+            self.assignments.pop(lavatory.assigned_to, None)
+        if seat_id and seat_id in self.assignments and self.assignments[seat_id] != lavatory.bathroom_id:
+            # Entró en otro lavabo distinto del reservado: se libera la reserva
+            self.lavatories[self.assignments.pop(seat_id)].assigned_to = None
+        lavatory.assigned_to = None
+        lavatory.is_occupied = True
+        lavatory.current_user = seat_id
+        lavatory.last_updated = now
+
+    def exit(self, lavatory: Lavatory, now: Optional[str] = None):
+        lavatory.is_occupied = False
+        lavatory.current_user = None
+        lavatory.last_updated = now
+
+    def reserve(self, lavatory: Lavatory, seat_id: str):
+        """Reserve a lavatory for a passenger, dropping any other reservation of either"""
+        if lavatory.assigned_to and lavatory.assigned_to != seat_id:
+            self.assignments.pop(lavatory.assigned_to, None)
+        self.release(seat_id)
+        lavatory.assigned_to = seat_id
+        self.assignments[seat_id] = lavatory.bathroom_id
+
+    def release(self, seat_id: str):
+        """Drop the reservation of a passenger who left the queue"""
+        bathroom_id = self.assignments.pop(seat_id, None)
+        if bathroom_id:
+            self.lavatories[bathroom_id].assigned_to = None
+
+    def schedule(self, queue: Iterable[dict], seat_class_of: Callable[[str], str]) -> List[Tuple[Lavatory, dict]]:
+        """Assign every free lavatory to the earliest waiting passenger allowed to use it"""
+        free = [lavatory for lavatory in self.lavatories.values() if lavatory.is_free]
+        assigned = []
+        if not free:
+            return assigned
+        for item in queue:
+            seat_id = item["seat_id"]
+            if seat_id in self.assignments:
+                continue
+            seat_class = seat_class_of(seat_id)
+            for lavatory in free:
+                if lavatory.allows(seat_class):
+                    self.reserve(lavatory, seat_id)
+                    free.remove(lavatory)
+                    assigned.append((lavatory, item))
+                    break
+            if not free:
+                break
+        return assigned
@@ -1,25 +1,38 @@
-import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import math
+import time
+from functools import partial
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List
-import json
+from fastapi.responses import PlainTextResponse
+from typing import List, Optional, Tuple
 import uvicorn
 from pydantic import BaseModel
-from datetime import datetime
 import os
 from database import (
     connect_to_mongo, 
-    close_mongo_connection, 
-    get_database,
-    init_seats_collection,
-    init_bathroom_queue_collection,
-    init_bathroom_status_collection,
-    SEATS_COLLECTION,
-    BATHROOM_QUEUE_COLLECTION,
-    BATHROOM_STATUS_COLLECTION
+    close_mongo_connection,
+    DEFAULT_FLIGHT_ID
 )
+from encoding import encode, loads, DecodeError
+from binary_protocol import MSGPACK_SUBPROTOCOL, BinaryDecodeError, msgpack_available, protocol_tables, unpack
+from repository import STORAGE
+from broadcast_bus import create_bus
+from dispatcher import ConnectionDispatcher, HandlerRegistry
+from flights import Flight, FlightRegistry, FLIGHT_IDS, SNAPSHOT_FORMATS, TooManyFlights
+from metrics import RATE_LIMITED, REGISTRY
+from rate_limit import WS_RATE_LIMITS, RateLimiter, parse_limits
+from sensor_ingest import SensorBatch, SensorIngestor
+from structured_log import dropped as dropped_log_records, get_logger
+from topics import parse_topics
 
 app = FastAPI(title="CabinSmart API")
+log = get_logger("main")
+
+# Enviar también la cola completa (bathroom_queue_updated) tras cada delta
+BATHROOM_QUEUE_FULL_EVENTS = os.getenv("BATHROOM_QUEUE_FULL_EVENTS", "1") == "1"
+
+# Límites por conexión y tipo de evento (ver rate_limit.py)
+CONNECTION_RATE_LIMITS = parse_limits(WS_RATE_LIMITS)
 
 # Configuración de CORS
 app.add_middleware(
@@ -47,312 +60,314 @@ class BathroomQueueItem(BaseModel):
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    await connect_to_mongo()
-    await init_seats_collection()
-    await init_bathroom_queue_collection()
-    await init_bathroom_status_collection()
-    print("Application started successfully")
+    if STORAGE == "mongo":
+        await connect_to_mongo()
+    # Un worker reiniciado con otros en marcha no vacía la cola que ellos siguen teniendo
+    flights.clear_queue = not await flights.bus.has_peers()
+    for flight_id in FLIGHT_IDS:
+        await flights.open(flight_id)
+    await flights.bus.start(flights.deliver)
+    log.info("app_started", flights=len(FLIGHT_IDS), storage=STORAGE, queue_cleared=flights.clear_queue)
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
+    await flights.bus.stop()
+    # Cerrar cada vuelo fuerza el volcado de las escrituras pendientes
+    for flight in flights.flights.values():
+        log.info("writes_flushing", flight=flight.flight_id, pending=flight.state.write_stats()["pending"])
+    await flights.close_all()
     await close_mongo_connection()
-    print("Application shutdown complete")
-
-# WebSocket manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.lock = asyncio.Lock()
-
-    async def connect(self, websocket: WebSocket):
-        async with self.lock:
-            if websocket not in self.active_connections:
-                self.active_connections.append(websocket)
-                print(f"New connection. Total connections: {len(self.active_connections)}")
-
-    async def disconnect(self, websocket: WebSocket):
-        async with self.lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
-                print(f"Connection closed. Total connections: {len(self.active_connections)}")
-
-    async def broadcast(self, message: str):
-        disconnected = []
-        async with self.lock:
-            for connection in self.active_connections.copy():
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    print(f"Error broadcasting message: {e}")
-                    disconnected.append(connection)
-        
-            # Clean up disconnected clients
-            for connection in disconnected:
-                if connection in self.active_connections:
-                    self.active_connections.remove(connection)
+    log.info("app_stopped")
+
+# Flights, each one with its own state and WebSocket room
+flights = FlightRegistry(create_bus())
+
+# Métricas leídas del estado de cada vuelo al consultar /metrics
+def per_flight(value):
+    return lambda: [((flight.flight_id,), value(flight)) for flight in flights.flights.values()]
 
-manager = ConnectionManager()
+REGISTRY.gauge("cabin_ws_connections", "Open WebSocket connections",
+               per_flight(lambda flight: len(flight.manager.connections)), ["flight"])
+REGISTRY.gauge("cabin_ws_send_queue_messages", "Messages waiting in the outbound queues of all clients",
+               per_flight(lambda flight: sum(flight.manager.send_queue_lengths())), ["flight"])
+REGISTRY.gauge("cabin_ws_send_queue_max_messages", "Longest outbound queue of a client",
+               per_flight(lambda flight: max(flight.manager.send_queue_lengths(), default=0)), ["flight"])
+REGISTRY.gauge("cabin_bathroom_queue_length", "Passengers waiting for a lavatory",
+               per_flight(lambda flight: len(flight.state.bathroom_queue)), ["flight"])
+REGISTRY.gauge("cabin_write_pending", "Writes waiting for the write-behind task",
+               per_flight(lambda flight: flight.state.write_stats()["pending"]), ["flight"])
+REGISTRY.counter_callback("cabin_events_total", "Events published to the flight room",
+                          per_flight(lambda flight: flight.event_log.seq), ["flight"])
+REGISTRY.counter_callback("cabin_write_ops_total", "Mutations persisted by the write-behind task",
+                          per_flight(lambda flight: flight.state.write_metrics.ops), ["flight"])
+REGISTRY.counter_callback("cabin_writes_total", "Storage writes after coalescing",
+                          per_flight(lambda flight: flight.state.write_metrics.writes), ["flight"])
+REGISTRY.counter_callback("cabin_write_failed_ops_total", "Mutations in failed flushes, retried until written",
+                          per_flight(lambda flight: flight.state.write_metrics.failed_ops), ["flight"])
+REGISTRY.counter_callback("cabin_bus_relayed_total", "Messages relayed to other workers",
+                          lambda: [((), flights.bus.relayed)])
+REGISTRY.counter_callback("cabin_bus_received_total", "Messages received from other workers",
+                          lambda: [((), flights.bus.received)])
+REGISTRY.counter_callback("cabin_log_dropped_total", "Log records dropped because the log queue was full",
+                          lambda: [((), dropped_log_records())])
 
 # Helper functions
-async def get_all_seats():
-    """Get all seats from database"""
-    db = await get_database()
-    seats_collection = db[SEATS_COLLECTION]
-    seats_cursor = seats_collection.find({}, {"_id": 0})
-    seats_list = await seats_cursor.to_list(length=None)
-    return {seat["seat_id"]: seat for seat in seats_list}
-
-async def get_bathroom_queue():
-    """Get bathroom queue from database"""
-    db = await get_database()
-    queue_collection = db[BATHROOM_QUEUE_COLLECTION]
-    queue_cursor = queue_collection.find({}, {"_id": 0}).sort("timestamp", 1)
-    return await queue_cursor.to_list(length=None)
-
-async def get_bathroom_status():
-    """Get bathroom status from database"""
-    db = await get_database()
-    status_collection = db[BATHROOM_STATUS_COLLECTION]
-    status = await status_collection.find_one({"bathroom_id": "main"}, {"_id": 0})
-    return status if status else {"bathroom_id": "main", "is_occupied": False, "current_user": None, "last_updated": None}
-
-async def update_bathroom_status(is_occupied: bool, current_user: str = None):
-    """Update bathroom status"""
-    db = await get_database()
-    status_collection = db[BATHROOM_STATUS_COLLECTION]
-    
-    await status_collection.update_one(
-        {"bathroom_id": "main"},
-        {
-            "$set": {
-                "is_occupied": is_occupied,
-                "current_user": current_user,
-                "last_updated": datetime.now().isoformat()
+async def get_all_seats(flight: Flight):
+    """Get all seats from the in-memory cabin state"""
+    return flight.state.get_all_seats()
+
+async def get_bathroom_queue(flight: Flight):
+    """Get bathroom queue from the in-memory cabin state"""
+    return flight.state.get_bathroom_queue()
+
+async def broadcast_queue_update(flight: Flight):
+    """Broadcast the full queue, kept for clients that do not apply deltas"""
+    if BATHROOM_QUEUE_FULL_EVENTS:
+        await flight.publish({
+            "event": "bathroom_queue_updated",
+            "data": {
+                "queue": await get_bathroom_queue(flight),
+                "version": flight.state.queue_version
             }
-        },
-        upsert=True
-    )
-
-async def notify_next_in_queue():
-    """Notify the next person in queue when bathroom becomes available"""
-    queue = await get_bathroom_queue()
-    if queue:
-        next_person = queue[0]
-        await manager.broadcast(json.dumps({
+        })
+
+async def broadcast_queue_item_added(flight: Flight, queue_item: dict, position: int):
+    """Broadcast a passenger joining the queue at the given 1-based position"""
+    await flight.publish({
+        "event": "queue_item_added",
+        "data": {
+            "item": queue_item,
+            "position": position,
+            "version": flight.state.queue_version
+        }
+    })
+    await broadcast_queue_update(flight)
+
+async def broadcast_queue_item_removed(flight: Flight, seat_id: str, position: int):
+    """Broadcast a passenger leaving the queue; everyone behind moves up one position"""
+    await flight.publish({
+        "event": "queue_item_removed",
+        "data": {
+            "seatId": seat_id,
+            "position": position,
+            "version": flight.state.queue_version
+        }
+    })
+    await broadcast_queue_update(flight)
+
+async def notify_next_in_queue(flight: Flight):
+    """Assign every free lavatory to the next eligible person in queue and notify them"""
+    for lavatory, next_person in flight.state.assign_lavatories():
+        await flight.publish({
             "event": "bathroom_available",
             "data": {
                 "seatId": next_person["seat_id"],
                 "passengerName": next_person["passenger_name"],
+                "bathroomId": lavatory.bathroom_id,
                 "message": "El baño está disponible. Es tu turno."
             }
-        }))
+        }, [f"seat:{next_person['seat_id']}"])
+
+# WebSocket event handlers, ordered per seat and per bathroom (see dispatcher.py)
+handlers = HandlerRegistry()
+
+def seat_keys(flight: Flight, websocket: WebSocket, data: dict) -> List[str]:
+    seat_id = data.get("seatId") if isinstance(data, dict) else None
+    return [f"seat:{seat_id}"] if seat_id else []
+
+def door_sensor_keys(flight: Flight, websocket: WebSocket, data: dict) -> List[str]:
+    if not isinstance(data, dict):
+        return []
+    lavatory = flight.state.resolve_lavatory(data.get("bathroomId"), data.get("seatId"))
+    return seat_keys(flight, websocket, data) + [f"bathroom:{lavatory.bathroom_id if lavatory else '?'}"]
 
-# WebSocket event handlers
-async def handle_toggle_seat_belt(websocket: WebSocket, data: dict):
+def check_rate_limits(flight: Flight, limiter: RateLimiter, event: str, data: dict) -> Tuple[float, str]:
+    """Take the tokens of an event, returns 0 or the retry-after in seconds, and the scope of the limit checked last"""
+    now = time.monotonic()
+    scope = "connection"
+    retry_after = limiter.retry_after(event, now=now)
+    seat_id = data.get("seatId") if isinstance(data, dict) else None
+    # Solo los asientos de la cabina tienen bucket: un seatId inventado no crea ninguno
+    seat_limited = seat_id in flight.state.seats
+    if not retry_after and seat_limited:
+        scope = "seat"
+        retry_after = flight.seat_limits.retry_after(event, seat_id, now)
+    if not retry_after:
+        # Los tokens se cogen solo cuando ambos límites lo permiten
+        limiter.take(event, now=now)
+        if seat_limited:
+            flight.seat_limits.take(event, seat_id, now)
+    return retry_after, scope
+
+async def send_rate_limited(flight: Flight, websocket: WebSocket, data: dict, event: str, scope: str, retry_after: float):
+    """Answer an event rejected by a rate limit, in the turn of the event (see the receive loop)"""
+    error = {
+        "code": "rate_limited",
+        "message": "Demasiadas solicitudes, inténtalo más tarde",
+        "event": event,
+        "scope": scope,
+        "retryAfterMs": math.ceil(retry_after * 1000)
+    }
+    if data.get("seatId") is not None:
+        error["seatId"] = data["seatId"]
+    await flight.manager.send_personal(websocket, encode({"event": "error", "data": error}))
+
+@handlers.register("toggle_seat_belt", seat_keys)
+async def handle_toggle_seat_belt(flight: Flight, websocket: WebSocket, data: dict):
     seat_id = data.get("seatId")
     if not seat_id:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "ID de asiento requerido"}
-        })
+        }))
         return
     
-    db = await get_database()
-    seats_collection = db[SEATS_COLLECTION]
-    
     # Find the seat
-    seat = await seats_collection.find_one({"seat_id": seat_id})
+    seat = flight.state.get_seat(seat_id)
     if not seat:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "Asiento no encontrado"}
-        })
+        }))
         return
     
     # Toggle belt status
-    new_buckled_status = not seat.get("is_buckled", False)
-    
-    # Update in database
-    await seats_collection.update_one(
-        {"seat_id": seat_id},
-        {
-            "$set": {
-                "is_buckled": new_buckled_status,
-                "last_updated": datetime.now().isoformat()
-            }
-        }
-    )
+    updates = await flight.state.toggle_seat_belt(seat_id)
+    new_buckled_status = updates["is_buckled"]
     
     # Broadcast the update
-    await manager.broadcast(json.dumps({
-        "event": "seat_updated",
-        "data": {
-            "seatId": seat_id,
-            "updates": {
-                "is_buckled": new_buckled_status,
-                "last_updated": datetime.now().isoformat()
-            }
-        }
-    }))
+    await flight.seat_updates.publish(seat_id, updates)
     
     # Send response back to sender
-    await websocket.send_json({
+    await flight.manager.send_personal(websocket, encode({
         "event": "seat_belt_toggled",
         "data": {"success": True, "seatId": seat_id, "is_buckled": new_buckled_status}
-    })
+    }))
 
-async def handle_join_bathroom_queue(websocket: WebSocket, data: dict):
+@handlers.register("join_bathroom_queue", seat_keys)
+async def handle_join_bathroom_queue(flight: Flight, websocket: WebSocket, data: dict):
     seat_id = data.get("seatId")
     passenger_name = data.get("passengerName")
     
     if not seat_id:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "ID de asiento requerido"}
-        })
+        }))
         return
     
-    db = await get_database()
-    seats_collection = db[SEATS_COLLECTION]
-    queue_collection = db[BATHROOM_QUEUE_COLLECTION]
-    
     # Check if seat exists
-    seat = await seats_collection.find_one({"seat_id": seat_id})
+    seat = flight.state.get_seat(seat_id)
     if not seat:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "Asiento no encontrado"}
-        })
+        }))
         return
     
     # Check if already in queue
-    existing_entry = await queue_collection.find_one({"seat_id": seat_id})
-    if existing_entry:
-        await websocket.send_json({
+    if flight.state.is_in_queue(seat_id):
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "Ya estás en la cola"}
-        })
+        }))
         return
     
-    # Check current bathroom status and queue
-    bathroom_status = await get_bathroom_status()
-    current_queue = await get_bathroom_queue()
-    
-    # If bathroom is free and no one is in queue, allow direct access
-    if not bathroom_status["is_occupied"] and len(current_queue) == 0:
+    # A free lavatory means nobody allowed to use it is waiting: allow direct access
+    lavatory = flight.state.free_lavatory(seat["seat_class"])
+    if lavatory:
         # Mark bathroom as occupied
-        await update_bathroom_status(True, seat_id)
+        await flight.state.enter_lavatory(lavatory, seat_id)
         
         # Send direct access message
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "bathroom_direct_access",
             "data": {
                 "success": True, 
                 "message": "Puedes ir al baño directamente. ¡Está libre!",
-                "seatId": seat_id
+                "seatId": seat_id,
+                "bathroomId": lavatory.bathroom_id
             }
-        })
+        }))
         
         # Broadcast bathroom status update
-        await manager.broadcast(json.dumps({
+        await flight.publish({
             "event": "bathroom_status_updated",
             "data": {
                 "isOccupied": True,
                 "currentUser": seat_id,
-                "passengerName": passenger_name or f"Pasajero {seat_id}"
+                "passengerName": passenger_name or f"Pasajero {seat_id}",
+                "bathroomId": lavatory.bathroom_id
             }
-        }))
+        })
         
         return
     
     # Otherwise, add to queue
-    queue_item = {
-        "seat_id": seat_id,
-        "passenger_name": passenger_name or f"Pasajero {seat_id}",
-        "timestamp": datetime.now().isoformat()
-    }
-    
-    await queue_collection.insert_one(queue_item)
-    
-    # Get updated queue
-    updated_queue = await get_bathroom_queue()
+    queue_item = await flight.state.add_to_queue(seat_id, passenger_name or f"Pasajero {seat_id}")
+    position = flight.state.queue_position(seat_id)
     
     # Broadcast the update
-    await manager.broadcast(json.dumps({
-        "event": "bathroom_queue_updated",
-        "data": {
-            "queue": updated_queue
-        }
-    }))
+    await broadcast_queue_item_added(flight, queue_item, position)
     
     # Send response back to sender
-    await websocket.send_json({
+    await flight.manager.send_personal(websocket, encode({
         "event": "bathroom_queue_joined",
-        "data": {"success": True, "position": len(updated_queue)}
-    })
+        "data": {"success": True, "position": position}
+    }))
 
-async def handle_leave_bathroom_queue(websocket: WebSocket, data: dict):
+@handlers.register("leave_bathroom_queue", seat_keys)
+async def handle_leave_bathroom_queue(flight: Flight, websocket: WebSocket, data: dict):
     seat_id = data.get("seatId")
     
     if not seat_id:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "ID de asiento requerido"}
-        })
+        }))
         return
     
-    db = await get_database()
-    queue_collection = db[BATHROOM_QUEUE_COLLECTION]
-    
     # Remove from queue
-    result = await queue_collection.delete_one({"seat_id": seat_id})
-    
-    if result.deleted_count == 0:
-        await websocket.send_json({
+    position = await flight.state.remove_from_queue(seat_id)
+    if position is None:
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "No encontrado en la cola"}
-        })
+        }))
         return
     
-    # Get updated queue
-    updated_queue = await get_bathroom_queue()
-    
     # Broadcast the update
-    await manager.broadcast(json.dumps({
-        "event": "bathroom_queue_updated",
-        "data": {
-            "queue": updated_queue
-        }
-    }))
+    await broadcast_queue_item_removed(flight, seat_id, position)
+    
+    # A lavatory reserved for them goes to the next person
+    await notify_next_in_queue(flight)
     
     # Send response back to sender
-    await websocket.send_json({
+    await flight.manager.send_personal(websocket, encode({
         "event": "bathroom_queue_left",
         "data": {"success": True}
-    })
+    }))
 
-async def handle_update_seat_status(websocket: WebSocket, data: dict):
+@handlers.register("update_seat_status", seat_keys)
+async def handle_update_seat_status(flight: Flight, websocket: WebSocket, data: dict):
     seat_id = data.get("seatId")
     updates = data.get("updates", {})
     
     if not seat_id:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "ID de asiento requerido"}
-        })
+        }))
         return
     
-    db = await get_database()
-    seats_collection = db[SEATS_COLLECTION]
-    
     # Check if seat exists
-    seat = await seats_collection.find_one({"seat_id": seat_id})
+    seat = flight.state.get_seat(seat_id)
     if not seat:
-        await websocket.send_json({
+        await flight.manager.send_personal(websocket, encode({
             "event": "error",
             "data": {"message": "Asiento no encontrado"}
-        })
+        }))
         return
     
     # Prepare updates
@@ -365,157 +380,358 @@ async def handle_update_seat_status(websocket: WebSocket, data: dict):
         elif key == "passenger_name":
             db_updates["passenger_name"] = value
     
-    db_updates["last_updated"] = datetime.now().isoformat()
-    
-    # Update in database
-    await seats_collection.update_one(
-        {"seat_id": seat_id},
-        {"$set": db_updates}
-    )
+    # Update cabin state
+    db_updates = await flight.state.update_seat(seat_id, db_updates)
     
     # Broadcast the update
-    await manager.broadcast(json.dumps({
-        "event": "seat_updated",
-        "data": {
-            "seatId": seat_id,
-            "updates": db_updates
-        }
-    }))
+    await flight.seat_updates.publish(seat_id, db_updates)
     
     # Send response back to sender
-    await websocket.send_json({
+    await flight.manager.send_personal(websocket, encode({
         "event": "seat_status_updated",
         "data": {"success": True, "seatId": seat_id}
-    })
+    }))
 
-async def handle_bathroom_door_sensor(websocket: WebSocket, data: dict):
+@handlers.register("bathroom_door_sensor", door_sensor_keys)
+async def handle_bathroom_door_sensor(flight: Flight, websocket: WebSocket, data: dict):
     """Handle bathroom door sensor events (entry/exit)"""
     action = data.get("action")  # "enter" or "exit"
     seat_id = data.get("seatId")
     
+    # Sensors of a multi-lavatory cabin send bathroomId; otherwise it is inferred
+    lavatory = flight.state.resolve_lavatory(data.get("bathroomId"), seat_id)
+    if action in ("enter", "exit") and lavatory is None:
+        await flight.manager.send_personal(websocket, encode({
+            "event": "error",
+            "data": {"message": "Baño no encontrado"}
+        }))
+        return
+    
     if action == "enter":
         # Someone entered the bathroom
-        await update_bathroom_status(True, seat_id)
+        await flight.state.enter_lavatory(lavatory, seat_id)
         
         # If they were in queue, remove them
-        if seat_id:
-            db = await get_database()
-            queue_collection = db[BATHROOM_QUEUE_COLLECTION]
-            await queue_collection.delete_one({"seat_id": seat_id})
+        position = await flight.state.remove_from_queue(seat_id) if seat_id else None
         
         # Broadcast status update
-        await manager.broadcast(json.dumps({
+        await flight.publish({
             "event": "bathroom_status_updated",
             "data": {
                 "isOccupied": True,
                 "currentUser": seat_id,
+                "bathroomId": lavatory.bathroom_id,
                 "action": "entered"
             }
-        }))
+        })
         
         # Update queue
-        updated_queue = await get_bathroom_queue()
-        await manager.broadcast(json.dumps({
-            "event": "bathroom_queue_updated",
-            "data": {
-                "queue": updated_queue
-            }
-        }))
+        if position is not None:
+            await broadcast_queue_item_removed(flight, seat_id, position)
+        
+        # Entering another lavatory than the reserved one frees the reservation
+        await notify_next_in_queue(flight)
         
     elif action == "exit":
         # Someone exited the bathroom
-        await update_bathroom_status(False, None)
+        await flight.state.exit_lavatory(lavatory)
         
         # Broadcast status update
-        await manager.broadcast(json.dumps({
+        await flight.publish({
             "event": "bathroom_status_updated",
             "data": {
                 "isOccupied": False,
                 "currentUser": None,
+                "bathroomId": lavatory.bathroom_id,
                 "action": "exited"
             }
-        }))
+        })
         
         # Notify next person in queue
-        await notify_next_in_queue()
+        await notify_next_in_queue(flight)
     
     # Send confirmation back to sender
-    await websocket.send_json({
+    await flight.manager.send_personal(websocket, encode({
         "event": "bathroom_door_sensor_processed",
         "data": {"success": True, "action": action}
-    })
+    }))
+
+async def apply_sensor_batch(flight: Flight, batch: SensorBatch):
+    """Apply settled sensor readings as one state transition and broadcast it"""
+    seats, lavatories, removed = await flight.state.apply_sensor_batch(batch.seats, batch.doors)
+    
+    # All seat changes of the batch in one frame, after any older change still in the coalescing window
+    if seats:
+        await flight.seat_updates.flush()
+        await flight.seat_updates.publish_patch(seats)
+    
+    for lavatory in lavatories:
+        await flight.publish({
+            "event": "bathroom_status_updated",
+            "data": {
+                "isOccupied": lavatory.is_occupied,
+                "currentUser": lavatory.current_user,
+                "bathroomId": lavatory.bathroom_id,
+                "action": "entered" if lavatory.is_occupied else "exited"
+            }
+        })
+    for seat_id, position in removed:
+        await broadcast_queue_item_removed(flight, seat_id, position)
+    
+    # A single assignment pass for every lavatory freed by the batch
+    if lavatories:
+        await notify_next_in_queue(flight)
+
+def sensor_ingestor(flight: Flight) -> SensorIngestor:
+    if flight.sensors is None:
+        flight.sensors = SensorIngestor(flight.state, lambda batch: apply_sensor_batch(flight, batch))
+    return flight.sensors
+
+@handlers.register("subscribe")
+async def handle_subscribe(flight: Flight, websocket: WebSocket, data: dict):
+    """Replace the topics this connection is subscribed to"""
+    try:
+        topics = parse_topics(data.get("topics") or [])
+    except ValueError:
+        await flight.manager.send_personal(websocket, encode({
+            "event": "error",
+            "data": {"message": "Temas de suscripción no válidos"}
+        }))
+        return
+    
+    flight.manager.subscribe(websocket, topics)
+    await flight.manager.send_personal(websocket, encode({
+        "event": "subscribed",
+        "data": {"success": True, "topics": sorted(topics)}
+    }))
 
 # API Routes
 @app.get("/")
 async def read_root():
     return {"message": "Bienvenido a CabinSmart API"}
 
+@app.get("/ws/protocol")
+async def get_ws_protocol():
+    """Codes and short keys of the MessagePack subprotocol"""
+    return protocol_tables()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/flights")
+async def get_flights():
+    return flights.ids()
+
+@app.post("/flights/{flight_id}")
+async def open_flight(flight_id: str):
+    try:
+        flight = await flights.open(flight_id)
+    except ValueError:
+        return {"error": "Identificador de vuelo no válido"}
+    except TooManyFlights:
+        return {"error": "Demasiados vuelos abiertos"}
+    return {"flightId": flight.flight_id, "seats": len(flight.state.get_all_seats())}
+
+@app.get("/flights/{flight_id}/seats")
+async def get_flight_seats(flight_id: str):
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return await get_all_seats(flight)
+
+@app.get("/flights/{flight_id}/seats/{seat_id}")
+async def get_flight_seat(flight_id: str, seat_id: str):
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    seat = flight.state.get_seat(seat_id)
+    return seat if seat else {"error": "Asiento no encontrado"}
+
+@app.get("/flights/{flight_id}/bathroom/queue")
+async def get_flight_bathroom_queue(flight_id: str):
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return await get_bathroom_queue(flight)
+
+@app.get("/flights/{flight_id}/bathrooms")
+async def get_flight_bathrooms(flight_id: str):
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return flight.state.get_lavatories()
+
+@app.get("/flights/{flight_id}/cabin/summary")
+async def get_flight_cabin_summary(flight_id: str):
+    """Aggregates for crew views: counts per class and row, unbuckled seats, queue stats"""
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return flight.state.summary.to_dict()
+
+@app.get("/flights/{flight_id}/writes")
+async def get_flight_writes(flight_id: str):
+    """Write-behind batching metrics: flush sizes and lag"""
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return flight.state.write_stats()
+
+@app.post("/flights/{flight_id}/sensors")
+async def ingest_flight_sensors(flight_id: str, request: Request):
+    """Batch of sensor readings, one JSON object per line (NDJSON)"""
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    body = await request.body()
+    return await sensor_ingestor(flight).ingest(body.splitlines())
+
+@app.get("/flights/{flight_id}/sensors")
+async def get_flight_sensors(flight_id: str):
+    """Sensor ingestion counters and changes waiting for the debounce window"""
+    flight = flights.get(flight_id)
+    if not flight:
+        return {"error": "Vuelo no encontrado"}
+    return sensor_ingestor(flight).stats()
+
+# Rutas del vuelo por defecto, compatibles con los clientes existentes
 @app.get("/seats")
 async def get_seats():
-    return await get_all_seats()
+    return await get_flight_seats(DEFAULT_FLIGHT_ID)
 
 @app.get("/seats/{seat_id}")
 async def get_seat(seat_id: str):
-    seats = await get_all_seats()
-    return seats.get(seat_id, {"error": "Asiento no encontrado"})
+    return await get_flight_seat(DEFAULT_FLIGHT_ID, seat_id)
 
 @app.get("/bathroom/queue")
 async def get_bathroom_queue_route():
-    return await get_bathroom_queue()
+    return await get_flight_bathroom_queue(DEFAULT_FLIGHT_ID)
+
+@app.get("/bathrooms")
+async def get_bathrooms_route():
+    return await get_flight_bathrooms(DEFAULT_FLIGHT_ID)
+
+@app.get("/cabin/summary")
+async def get_cabin_summary():
+    return await get_flight_cabin_summary(DEFAULT_FLIGHT_ID)
+
+@app.post("/sensors")
+async def ingest_sensors(request: Request):
+    return await ingest_flight_sensors(DEFAULT_FLIGHT_ID, request)
+
+async def reject_connection(websocket: WebSocket, binary: bool, message: str):
+    """Answer with an error in the negotiated format and close the connection"""
+    error = encode({"event": "error", "data": {"message": message}})
+    if binary:
+        await websocket.send_bytes(error.binary)
+    else:
+        await websocket.send_text(error.text)
+    await websocket.close(code=1008)
+
+async def receive_message(websocket: WebSocket):
+    """Next client message, from a JSON text frame or a MessagePack binary frame"""
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    if frame.get("bytes") is not None:
+        return unpack(frame["bytes"])
+    return loads(frame["text"])
 
 # WebSocket endpoint
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    await manager.connect(websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    flightId: str = DEFAULT_FLIGHT_ID,
+    lastSeq: Optional[int] = None,
+    epoch: Optional[str] = None,
+    topics: str = "",
+    snapshot: str = "json"
+):
+    # MessagePack solo si el cliente lo ofrece y el paquete está instalado
+    binary = msgpack_available() and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if binary else None)
     
     try:
-        # Send initial state
-        seats = await get_all_seats()
-        bathroom_queue = await get_bathroom_queue()
-        bathroom_status = await get_bathroom_status()
-        
-        await websocket.send_json({
-            "event": "initial_state",
-            "data": {
-                "seats": seats,
-                "bathroomQueue": bathroom_queue,
-                "bathroomStatus": bathroom_status,
-                "connectedUsers": len(manager.active_connections)
-            }
-        })
+        subscribed = parse_topics(topics)
+    except ValueError:
+        await reject_connection(websocket, binary, "Temas de suscripción no válidos")
+        return
+    
+    if snapshot not in SNAPSHOT_FORMATS:
+        await reject_connection(websocket, binary, "Formato de snapshot no válido")
+        return
+    
+    flight = flights.get(flightId)
+    if not flight:
+        await reject_connection(websocket, binary, "Vuelo no encontrado")
+        return
+    
+    manager = flight.manager
+    await manager.connect(websocket, subscribed, snapshot, binary)
+    dispatcher = ConnectionDispatcher(handlers)
+    limiter = RateLimiter(CONNECTION_RATE_LIMITS)
+    
+    try:
+        # Resume from the last event the client saw, or send the full initial state
+        missed = flight.event_log.since(lastSeq, epoch, subscribed) if lastSeq is not None else None
+        if missed is not None:
+            await manager.send_personal(websocket, encode({
+                "event": "resumed",
+                "seq": lastSeq,
+                "data": {"epoch": flight.event_log.epoch, "missed": len(missed)}
+            }))
+            for message in missed:
+                await manager.send_personal(websocket, message)
+        else:
+            await manager.send_personal(websocket, await flight.snapshot(snapshot))
         
         # Keep connection alive and handle messages
         while True:
             try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
+                message = await receive_message(websocket)
                 
-                # Handle different event types
-                if message.get("event") == "toggle_seat_belt":
-                    await handle_toggle_seat_belt(websocket, message.get("data", {}))
-                elif message.get("event") == "join_bathroom_queue":
-                    await handle_join_bathroom_queue(websocket, message.get("data", {}))
-                elif message.get("event") == "leave_bathroom_queue":
-                    await handle_leave_bathroom_queue(websocket, message.get("data", {}))
-                elif message.get("event") == "update_seat_status":
-                    await handle_update_seat_status(websocket, message.get("data", {}))
-                elif message.get("event") == "bathroom_door_sensor":
-                    await handle_bathroom_door_sensor(websocket, message.get("data", {}))
+                event, payload = (message.get("event"), message.get("data", {})) if isinstance(message, dict) else (None, None)
+                if not isinstance(payload, dict):
+                    # Un mensaje o un data que no es un objeto no llega a los handlers
+                    await manager.send_personal(websocket, encode({
+                        "event": "error",
+                        "data": {"message": "Mensaje no válido"}
+                    }))
+                    continue
+                if event not in handlers:
+                    continue
+                retry_after, scope = check_rate_limits(flight, limiter, event, payload)
+                if retry_after:
+                    RATE_LIMITED.labels(event, scope).inc()
+                    # El rechazo sigue el orden de las claves del evento: nunca adelanta a las respuestas anteriores
+                    await dispatcher.dispatch(event, flight, websocket, payload, handler=partial(
+                        send_rate_limited, event=event, scope=scope, retry_after=retry_after
+                    ), label="rate_limited")
+                    continue
+                
+                # Runs concurrently with earlier messages that touch other seats and bathrooms
+                await dispatcher.dispatch(event, flight, websocket, payload)
                     
             except WebSocketDisconnect:
-                print("WebSocket disconnected normally")
+                log.debug("ws_closed_by_client", flight=flight.flight_id)
                 break
-            except json.JSONDecodeError:
-                print("Invalid JSON received")
+            except DecodeError:
+                log.warning("ws_invalid_json", flight=flight.flight_id)
+                continue
+            except BinaryDecodeError:
+                log.warning("ws_invalid_msgpack", flight=flight.flight_id)
                 continue
             except Exception as e:
-                print(f"Error in WebSocket connection: {e}")
+                log.error("ws_receive_failed", flight=flight.flight_id, error=str(e))
                 break
                 
     except Exception as e:
-        print(f"WebSocket error: {str(e)}")
+        log.error("ws_error", flight=flight.flight_id, error=str(e))
     finally:
+        # Messages already received still change the state, even if nobody reads the answer
+        await dispatcher.drain()
         await manager.disconnect(websocket)
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics.
+
+A minimal registry that renders the Prometheus text exposition format
+(version 0.0.4) on GET /metrics, without extra dependencies. Recording is
+meant to stay on in production: observing a histogram is a bisect over the
+bucket bounds and two additions, and the label children are cached so the
+hot path never builds strings. Values that already live elsewhere (open
+connections, queue lengths, write-behind counters) are not recorded at all:
+callback metrics read them when the endpoint is scraped.
+
+Histograms recorded on the hot path:
+
+- cabin_ws_handler_seconds{event}: time spent in a WebSocket handler
+- cabin_storage_seconds{backend,operation}: round trip of a storage call
+- cabin_broadcast_seconds: time to queue a broadcast for every recipient
+- cabin_broadcast_recipients: recipients of a broadcast
+
+Counters recorded on the hot path:
+
+- cabin_ws_rate_limited_total{event,scope}: events rejected by a rate limit
+
+Callback metrics are registered in main.py, among them
+cabin_log_dropped_total: log records dropped because the log queue was full.
+"""
+
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from structured_log import get_logger
+
+log = get_logger("metrics")
+
+# Segundos: de 100 µs a 2,5 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RECIPIENT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+LabelValues = Tuple[str, ...]
+Collect = Callable[[], Iterable[Tuple[LabelValues, float]]]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # Un contador por cubo, no acumulado; el último es +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.bounds = tuple(sorted(buckets))
+        self.children: Dict[LabelValues, _HistogramChild] = {}
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            child = self.children[values] = _HistogramChild(self.bounds)
+        return child
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                labels = _labels(self.label_names + ("le",), values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.children: Dict[LabelValues, _CounterChild] = {}
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            child = self.children[values] = _CounterChild()
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, values)} {_format_value(child.value)}"
+            for values, child in self.children.items()
+        ]
+
+
+class CallbackMetric:
+    """A gauge or counter whose samples are read from the application when scraped"""
+
+    def __init__(self, name: str, help: str, kind: str, labels: Sequence[str], collect: Collect):
+        if kind not in ("gauge", "counter"):
+            raise ValueError(f"Unknown metric type {kind!r}")
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.label_names = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, values)} {_format_value(value)}"
+            for values, value in self.collect()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name!r} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, collect: Collect, labels: Sequence[str] = ()) -> CallbackMetric:
+        return self._add(CallbackMetric(name, help, "gauge", labels, collect))
+
+    def counter_callback(self, name: str, help: str, collect: Collect, labels: Sequence[str] = ()) -> CallbackMetric:
+        return self._add(CallbackMetric(name, help, "counter", labels, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.render()
+            except Exception as e:
+                # Una métrica rota no puede dejar sin el resto al scraper
+                log.error("metric_collect_failed", metric=metric.name, error=str(e))
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "cabin_ws_handler_seconds", "Time spent handling a WebSocket event", ["event"]
+)
+STORAGE_SECONDS = REGISTRY.histogram(
+    "cabin_storage_seconds", "Round trip of a storage backend call", ["backend", "operation"]
+)
+BROADCAST_SECONDS = REGISTRY.histogram(
+    "cabin_broadcast_seconds", "Time to queue a broadcast for every recipient"
+)
+BROADCAST_RECIPIENTS = REGISTRY.histogram(
+    "cabin_broadcast_recipients", "Connections a broadcast was queued for", buckets=RECIPIENT_BUCKETS
+)
+RATE_LIMITED = REGISTRY.counter(
+    "cabin_ws_rate_limited_total", "WebSocket events rejected by a rate limit", ["event", "scope"]
+)
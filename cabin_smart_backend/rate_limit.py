@@ -0,0 +1,143 @@
+"""
+Token-bucket rate limiting of WebSocket events.
+
+Every event is checked against two sets of buckets before it is dispatched:
+
+- per connection (WS_RATE_LIMITS): one bucket per connection and event type
+- per seat (WS_SEAT_RATE_LIMITS): one bucket per seat and event type, shared
+  by every connection of the flight, so a seat cannot be hammered from
+  several phones at once
+
+Limits are written as `event:rate/burst` entries separated by commas, rate
+being tokens per second and burst the bucket size. `*` applies to every event
+without its own entry; an event without entry and without `*` is not limited:
+
+    WS_RATE_LIMITS="*:20/40,subscribe:1/5"
+    WS_SEAT_RATE_LIMITS="toggle_seat_belt:2/5,join_bathroom_queue:0.5/3"
+
+An event takes a token of each of its buckets only when all of them have
+one, so an event rejected by one limit does not spend the tokens of the
+other. Seat buckets are only kept for seats of the cabin, and buckets that
+have refilled are dropped (a full bucket is the same as no bucket), so the
+number of buckets follows the seats and connections that are actually busy.
+
+A rejected event is answered with an error whose code is `rate_limited` and
+which says after how many milliseconds a token will be available.
+"""
+
+import os
+import time
+from typing import Dict, Hashable, NamedTuple, Optional
+
+# Número de buckets a partir del cual se descartan los que ya están llenos
+PRUNE_AT = 1024
+
+WS_RATE_LIMITS = os.getenv("WS_RATE_LIMITS", "*:20/40")
+WS_SEAT_RATE_LIMITS = os.getenv(
+    "WS_SEAT_RATE_LIMITS",
+    "toggle_seat_belt:2/5,update_seat_status:5/10,join_bathroom_queue:1/3,leave_bathroom_queue:1/3"
+)
+
+
+class Limit(NamedTuple):
+    rate: float
+    burst: float
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """Parse `event:rate/burst` entries into a limit per event"""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            event, values = entry.rsplit(":", 1)
+            rate, burst = values.split("/")
+            limit = Limit(float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {entry!r}, expected event:rate/burst") from None
+        if limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f"Invalid rate limit {entry!r}, rate must be positive and burst at least 1")
+        limits[event.strip()] = limit
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: Limit, now: float):
+        self.limit = limit
+        self.tokens = limit.burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        """Tokens available now"""
+        self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * self.limit.rate)
+        self.updated = now
+        return self.tokens
+
+    def retry_after(self, now: float) -> float:
+        """0 if there is a token, otherwise the seconds until there is"""
+        tokens = self.refill(now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.limit.rate
+
+    def take(self, now: float) -> float:
+        """Take a token, returns 0 if there was one or the seconds until there is"""
+        retry_after = self.retry_after(now)
+        if not retry_after:
+            self.tokens -= 1
+        return retry_after
+
+
+class RateLimiter:
+    """Token buckets of one scope (a connection, or the seats of a flight)"""
+
+    def __init__(self, limits: Dict[str, Limit]):
+        self.limits = limits
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.rejected = 0
+        self.prune_at = PRUNE_AT
+
+    def limit_for(self, event: str) -> Optional[Limit]:
+        return self.limits.get(event) or self.limits.get("*")
+
+    def retry_after(self, event: str, key: Hashable = None, now: Optional[float] = None) -> float:
+        """Seconds until the bucket of an event (and key) has a token, 0 if it has one; takes nothing"""
+        bucket = self.buckets.get((event, key))
+        if bucket is None:
+            # Un bucket que no existe está lleno
+            return 0.0
+        retry_after = bucket.retry_after(time.monotonic() if now is None else now)
+        if retry_after:
+            self.rejected += 1
+        return retry_after
+
+    def take(self, event: str, key: Hashable = None, now: Optional[float] = None):
+        """Take a token of the bucket of an event (and key), after retry_after said there is one"""
+        limit = self.limit_for(event)
+        if limit is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get((event, key))
+        if bucket is None:
+            if len(self.buckets) >= self.prune_at:
+                self.prune(now)
+            bucket = self.buckets[(event, key)] = TokenBucket(limit, now)
+        bucket.take(now)
+
+    def check(self, event: str, key: Hashable = None, now: Optional[float] = None) -> float:
+        """Take a token of the bucket of an event (and key), returns the retry-after in seconds or 0"""
+        if now is None:
+            now = time.monotonic()
+        retry_after = self.retry_after(event, key, now)
+        if not retry_after:
+            self.take(event, key, now)
+        return retry_after
+
+    def prune(self, now: float):
+        """Drop the buckets that have refilled"""
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if bucket.refill(now) < bucket.limit.burst
+        }
+        # Si casi todos siguen en uso no se vuelve a recorrer hasta que el diccionario doble su tamaño
+        self.prune_at = max(PRUNE_AT, 2 * len(self.buckets))
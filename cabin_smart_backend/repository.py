@@ -0,0 +1,421 @@
+"""
+Storage backends for the cabin state.
+
+CabinState never talks to a database directly: it loads and persists through
+a CabinRepository. Three implementations share the same contract (checked
+by test_repositories.py):
+
+- "mongo": MongoDB through Motor, one set of collections per flight
+- "sqlite": a local SQLite file in WAL mode, for onboard servers without MongoDB
+- "memory": plain dicts, nothing survives a restart (benchmarks, load tests)
+
+Every write is atomic and the seat and lavatory updates return the
+post-image of the document, so CabinState can adopt it in "sync" mode.
+Write-behind batches (write_batch.py) are applied with apply_batch.
+"""
+
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import (
+    get_database,
+    build_default_seats,
+    collection_name,
+    init_indexes,
+    init_seats_collection,
+    init_bathroom_queue_collection,
+    init_bathroom_status_collection,
+    DEFAULT_FLIGHT_ID,
+    SEATS_COLLECTION,
+    BATHROOM_QUEUE_COLLECTION,
+    BATHROOM_STATUS_COLLECTION
+)
+from encoding import dumps, loads
+from write_batch import WriteBatch
+from structured_log import get_logger
+
+log = get_logger("repository")
+
+# Backend de almacenamiento: "mongo", "sqlite" o "memory"
+STORAGE = os.getenv("CABIN_STORAGE", "mongo")
+STORAGES = ("mongo", "sqlite", "memory")
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "cabin_smart.db")
+
+# Las modificaciones son una única operación atómica que devuelve el documento resultante
+POST_IMAGE = {"projection": {"_id": 0}, "return_document": ReturnDocument.AFTER}
+
+
+def empty_lavatory(bathroom_id: str) -> dict:
+    return {"bathroom_id": bathroom_id, "is_occupied": False, "current_user": None, "last_updated": None}
+
+
+class CabinRepository:
+    """Persistence contract of a flight's cabin state"""
+
+    # Nombre del backend en las métricas
+    backend = "base"
+
+    async def init(self, bathroom_ids: Iterable[str], clear_queue: bool = True):
+        """Create the storage, seed the cabin if empty, clear the queue (if asked) and make sure every lavatory exists"""
+        raise NotImplementedError
+
+    async def load_seats(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def load_queue(self) -> List[dict]:
+        """Queued passengers in arrival order"""
+        raise NotImplementedError
+
+    async def load_lavatories(self, bathroom_ids: Iterable[str]) -> List[dict]:
+        raise NotImplementedError
+
+    async def update_seat(self, seat_id: str, updates: dict) -> Optional[dict]:
+        """Set fields of a seat, returns the updated seat or None if it does not exist"""
+        raise NotImplementedError
+
+    async def toggle_seat_belt(self, seat_id: str, last_updated: str) -> Optional[dict]:
+        """Flip is_buckled atomically, returns the updated seat or None if it does not exist"""
+        raise NotImplementedError
+
+    async def add_to_queue(self, item: dict):
+        """Append a passenger to the queue, raises ValueError if the seat is already queued"""
+        raise NotImplementedError
+
+    async def remove_from_queue(self, seat_id: str) -> bool:
+        """Remove a passenger from the queue, returns whether they were queued"""
+        raise NotImplementedError
+
+    async def update_lavatory(self, bathroom_id: str, updates: dict) -> dict:
+        """Set fields of a lavatory, creating it if needed, returns the updated lavatory"""
+        raise NotImplementedError
+
+    async def apply_batch(self, batch: WriteBatch):
+        """Apply a coalesced batch of writes; backends override it to use fewer round trips"""
+        for seat_id, updates in batch.seats.items():
+            await self.update_seat(seat_id, updates)
+        for seat_id in batch.queue_deletes:
+            await self.remove_from_queue(seat_id)
+        for item in batch.queue_inserts:
+            await self.add_to_queue(item)
+        for bathroom_id, updates in batch.lavatories.items():
+            await self.update_lavatory(bathroom_id, updates)
+
+    async def close(self):
+        pass
+
+
+class MemoryRepository(CabinRepository):
+    backend = "memory"
+
+    def __init__(self, flight_id: str = DEFAULT_FLIGHT_ID):
+        self.flight_id = flight_id
+        self.seats: Dict[str, dict] = {}
+        # Los dict conservan el orden de inserción: es el orden de llegada a la cola
+        self.queue: Dict[str, dict] = {}
+        self.lavatories: Dict[str, dict] = {}
+
+    async def init(self, bathroom_ids: Iterable[str], clear_queue: bool = True):
+        if not self.seats:
+            self.seats = {seat["seat_id"]: seat for seat in build_default_seats()}
+        if clear_queue:
+            self.queue = {}
+        for bathroom_id in bathroom_ids:
+            self.lavatories.setdefault(bathroom_id, empty_lavatory(bathroom_id))
+
+    async def load_seats(self) -> List[dict]:
+        return [dict(seat) for seat in self.seats.values()]
+
+    async def load_queue(self) -> List[dict]:
+        return [dict(item) for item in self.queue.values()]
+
+    async def load_lavatories(self, bathroom_ids: Iterable[str]) -> List[dict]:
+        return [dict(self.lavatories[bathroom_id]) for bathroom_id in bathroom_ids if bathroom_id in self.lavatories]
+
+    async def update_seat(self, seat_id: str, updates: dict) -> Optional[dict]:
+        seat = self.seats.get(seat_id)
+        if seat is None:
+            return None
+        seat.update(updates)
+        return dict(seat)
+
+    async def toggle_seat_belt(self, seat_id: str, last_updated: str) -> Optional[dict]:
+        seat = self.seats.get(seat_id)
+        if seat is None:
+            return None
+        return await self.update_seat(seat_id, {"is_buckled": not seat.get("is_buckled", False), "last_updated": last_updated})
+
+    async def add_to_queue(self, item: dict):
+        if item["seat_id"] in self.queue:
+            raise ValueError(f"Seat {item['seat_id']} is already in queue")
+        self.queue[item["seat_id"]] = dict(item)
+
+    async def remove_from_queue(self, seat_id: str) -> bool:
+        return self.queue.pop(seat_id, None) is not None
+
+    async def update_lavatory(self, bathroom_id: str, updates: dict) -> dict:
+        lavatory = self.lavatories.setdefault(bathroom_id, empty_lavatory(bathroom_id))
+        lavatory.update(updates)
+        return dict(lavatory)
+
+
+class SqliteRepository(CabinRepository):
+    """Documents stored as JSON, keyed by their id; WAL lets readers run alongside the writer"""
+
+    backend = "sqlite"
+
+    def __init__(self, flight_id: str = DEFAULT_FLIGHT_ID, path: str = SQLITE_PATH):
+        self.flight_id = flight_id
+        self.path = path
+        # Mismos nombres que las colecciones de MongoDB, entre comillas por el punto del prefijo de vuelo
+        self.seats_table = f'"{collection_name(SEATS_COLLECTION, flight_id)}"'
+        self.queue_table = f'"{collection_name(BATHROOM_QUEUE_COLLECTION, flight_id)}"'
+        self.status_table = f'"{collection_name(BATHROOM_STATUS_COLLECTION, flight_id)}"'
+        # sqlite3 es bloqueante: todas las operaciones van a un único hilo, que además las serializa
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{flight_id}")
+        self._connection: Optional[sqlite3.Connection] = None
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Autocommit: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+            self._connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # En WAL, NORMAL solo sincroniza en los checkpoints y sigue siendo consistente tras un corte
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        return self._connection
+
+    def _transaction(self, function, *args):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(connection, *args)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def _get(self, connection: sqlite3.Connection, table: str, key_column: str, key: str) -> Optional[dict]:
+        row = connection.execute(f"SELECT doc FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def _init(self, connection: sqlite3.Connection, bathroom_ids: List[str], clear_queue: bool):
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.seats_table} (seat_id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.queue_table} "
+            "(seat_id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, doc BLOB NOT NULL)"
+        )
+        connection.execute(
+            f'CREATE INDEX IF NOT EXISTS "{collection_name(BATHROOM_QUEUE_COLLECTION, self.flight_id)}.timestamp" '
+            f"ON {self.queue_table} (timestamp)"
+        )
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.status_table} (bathroom_id TEXT PRIMARY KEY, doc BLOB NOT NULL)")
+
+        if connection.execute(f"SELECT COUNT(*) FROM {self.seats_table}").fetchone()[0] == 0:
+            seats_data = build_default_seats()
+            connection.executemany(
+                f"INSERT INTO {self.seats_table} (seat_id, doc) VALUES (?, ?)",
+                [(seat["seat_id"], dumps(seat)) for seat in seats_data]
+            )
+            log.info("seats_initialized", backend="sqlite", flight=self.flight_id, seats=len(seats_data))
+        if clear_queue:
+            connection.execute(f"DELETE FROM {self.queue_table}")
+        connection.executemany(
+            f"INSERT OR IGNORE INTO {self.status_table} (bathroom_id, doc) VALUES (?, ?)",
+            [(bathroom_id, dumps(empty_lavatory(bathroom_id))) for bathroom_id in bathroom_ids]
+        )
+
+    async def init(self, bathroom_ids: Iterable[str], clear_queue: bool = True):
+        await self._run(self._transaction, self._init, list(bathroom_ids), clear_queue)
+
+    def _select(self, query: str, params: tuple = ()) -> List[dict]:
+        return [loads(row[0]) for row in self._connect().execute(query, params)]
+
+    async def load_seats(self) -> List[dict]:
+        return await self._run(self._select, f"SELECT doc FROM {self.seats_table}")
+
+    async def load_queue(self) -> List[dict]:
+        # rowid desempata las llegadas con el mismo timestamp
+        return await self._run(self._select, f"SELECT doc FROM {self.queue_table} ORDER BY timestamp, rowid")
+
+    async def load_lavatories(self, bathroom_ids: Iterable[str]) -> List[dict]:
+        bathroom_ids = list(bathroom_ids)
+        placeholders = ",".join("?" * len(bathroom_ids))
+        return await self._run(
+            self._select, f"SELECT doc FROM {self.status_table} WHERE bathroom_id IN ({placeholders})", tuple(bathroom_ids)
+        )
+
+    def _update(self, connection: sqlite3.Connection, table: str, key_column: str, key: str, updates: dict,
+                upsert: bool = False) -> Optional[dict]:
+        document = self._get(connection, table, key_column, key)
+        if document is None:
+            if not upsert:
+                return None
+            document = empty_lavatory(key)
+        document.update(updates)
+        connection.execute(f"INSERT OR REPLACE INTO {table} ({key_column}, doc) VALUES (?, ?)", (key, dumps(document)))
+        return document
+
+    def _toggle(self, connection: sqlite3.Connection, seat_id: str, last_updated: str) -> Optional[dict]:
+        seat = self._get(connection, self.seats_table, "seat_id", seat_id)
+        if seat is None:
+            return None
+        updates = {"is_buckled": not seat.get("is_buckled", False), "last_updated": last_updated}
+        return self._update(connection, self.seats_table, "seat_id", seat_id, updates)
+
+    async def update_seat(self, seat_id: str, updates: dict) -> Optional[dict]:
+        return await self._run(self._transaction, self._update, self.seats_table, "seat_id", seat_id, updates)
+
+    async def toggle_seat_belt(self, seat_id: str, last_updated: str) -> Optional[dict]:
+        return await self._run(self._transaction, self._toggle, seat_id, last_updated)
+
+    def _insert(self, item: dict):
+        try:
+            self._connect().execute(
+                f"INSERT INTO {self.queue_table} (seat_id, timestamp, doc) VALUES (?, ?, ?)",
+                (item["seat_id"], item["timestamp"], dumps(item))
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Seat {item['seat_id']} is already in queue")
+
+    async def add_to_queue(self, item: dict):
+        await self._run(self._insert, item)
+
+    def _delete(self, seat_id: str) -> bool:
+        return self._connect().execute(f"DELETE FROM {self.queue_table} WHERE seat_id = ?", (seat_id,)).rowcount > 0
+
+    async def remove_from_queue(self, seat_id: str) -> bool:
+        return await self._run(self._delete, seat_id)
+
+    async def update_lavatory(self, bathroom_id: str, updates: dict) -> dict:
+        return await self._run(self._transaction, self._update, self.status_table, "bathroom_id", bathroom_id, updates, True)
+
+    def _apply_batch(self, connection: sqlite3.Connection, batch: WriteBatch):
+        for seat_id, updates in batch.seats.items():
+            self._update(connection, self.seats_table, "seat_id", seat_id, updates)
+        connection.executemany(f"DELETE FROM {self.queue_table} WHERE seat_id = ?", [(seat_id,) for seat_id in batch.queue_deletes])
+        connection.executemany(
+            f"INSERT OR REPLACE INTO {self.queue_table} (seat_id, timestamp, doc) VALUES (?, ?, ?)",
+            [(item["seat_id"], item["timestamp"], dumps(item)) for item in batch.queue_inserts]
+        )
+        for bathroom_id, updates in batch.lavatories.items():
+            self._update(connection, self.status_table, "bathroom_id", bathroom_id, updates, True)
+
+    async def apply_batch(self, batch: WriteBatch):
+        # Un único commit (y un único fsync del WAL) para todo el lote
+        await self._run(self._transaction, self._apply_batch, batch)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def close(self):
+        if self._executor is None:
+            return
+        await self._run(self._close)
+        self._executor.shutdown()
+        self._executor = None
+
+
+class MongoRepository(CabinRepository):
+    backend = "mongo"
+
+    def __init__(self, flight_id: str = DEFAULT_FLIGHT_ID):
+        self.flight_id = flight_id
+        self.seats_collection = collection_name(SEATS_COLLECTION, flight_id)
+        self.queue_collection = collection_name(BATHROOM_QUEUE_COLLECTION, flight_id)
+        self.status_collection = collection_name(BATHROOM_STATUS_COLLECTION, flight_id)
+
+    async def init(self, bathroom_ids: Iterable[str], clear_queue: bool = True):
+        await init_indexes(self.flight_id)
+        await init_seats_collection(self.flight_id)
+        if clear_queue:
+            await init_bathroom_queue_collection(self.flight_id)
+        await init_bathroom_status_collection(list(bathroom_ids), self.flight_id)
+
+    async def load_seats(self) -> List[dict]:
+        db = await get_database()
+        return await db[self.seats_collection].find({}, {"_id": 0}).to_list(length=None)
+
+    async def load_queue(self) -> List[dict]:
+        db = await get_database()
+        return await db[self.queue_collection].find({}, {"_id": 0}).sort("timestamp", 1).to_list(length=None)
+
+    async def load_lavatories(self, bathroom_ids: Iterable[str]) -> List[dict]:
+        db = await get_database()
+        cursor = db[self.status_collection].find({"bathroom_id": {"$in": list(bathroom_ids)}}, {"_id": 0})
+        return await cursor.to_list(length=None)
+
+    async def update_seat(self, seat_id: str, updates: dict) -> Optional[dict]:
+        db = await get_database()
+        return await db[self.seats_collection].find_one_and_update({"seat_id": seat_id}, {"$set": updates}, **POST_IMAGE)
+
+    async def toggle_seat_belt(self, seat_id: str, last_updated: str) -> Optional[dict]:
+        # La base de datos calcula el nuevo valor: dos toggles simultáneos nunca se pisan
+        toggle = [{"$set": {
+            "is_buckled": {"$not": [{"$ifNull": ["$is_buckled", False]}]},
+            "last_updated": last_updated
+        }}]
+        db = await get_database()
+        return await db[self.seats_collection].find_one_and_update({"seat_id": seat_id}, toggle, **POST_IMAGE)
+
+    async def add_to_queue(self, item: dict):
+        db = await get_database()
+        try:
+            # Copia: insert_one añade "_id" al documento
+            await db[self.queue_collection].insert_one(dict(item))
+        except DuplicateKeyError:
+            raise ValueError(f"Seat {item['seat_id']} is already in queue")
+
+    async def remove_from_queue(self, seat_id: str) -> bool:
+        db = await get_database()
+        result = await db[self.queue_collection].delete_one({"seat_id": seat_id})
+        return result.deleted_count > 0
+
+    async def update_lavatory(self, bathroom_id: str, updates: dict) -> dict:
+        db = await get_database()
+        return await db[self.status_collection].find_one_and_update(
+            {"bathroom_id": bathroom_id}, {"$set": updates}, upsert=True, **POST_IMAGE
+        )
+
+    async def apply_batch(self, batch: WriteBatch):
+        db = await get_database()
+        if batch.seats:
+            await db[self.seats_collection].bulk_write(
+                [UpdateOne({"seat_id": seat_id}, {"$set": updates}) for seat_id, updates in batch.seats.items()],
+                ordered=False
+            )
+        # Ordenado: si un asiento salió y volvió a entrar, primero se borra y luego se inserta
+        queue_ops = [DeleteOne({"seat_id": seat_id}) for seat_id in batch.queue_deletes]
+        queue_ops += [InsertOne(dict(item)) for item in batch.queue_inserts]
+        if queue_ops:
+            await db[self.queue_collection].bulk_write(queue_ops, ordered=True)
+        if batch.lavatories:
+            await db[self.status_collection].bulk_write(
+                [
+                    UpdateOne({"bathroom_id": bathroom_id}, {"$set": updates}, upsert=True)
+                    for bathroom_id, updates in batch.lavatories.items()
+                ],
+                ordered=False
+            )
+
+
+def create_repository(flight_id: str = DEFAULT_FLIGHT_ID, storage: str = STORAGE) -> CabinRepository:
+    """Repository of a flight for the configured storage backend"""
+    if storage == "mongo":
+        return MongoRepository(flight_id)
+    if storage == "sqlite":
+        return SqliteRepository(flight_id)
+    if storage == "memory":
+        return MemoryRepository(flight_id)
+    raise ValueError(f"Unknown storage {storage!r}, expected one of {STORAGES}")
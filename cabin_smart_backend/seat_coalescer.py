@@ -0,0 +1,91 @@
+"""
+Time-window coalescing of seat updates.
+
+With a tick configured, every seat change inside the window is merged into a
+single `seats_patch` frame that keeps only the last value of each field per
+seat. With a tick of 0 (default) each change is broadcast immediately as a
+`seat_updated` event, as before.
+
+Changes are published to the seat's topics. A patch is published once,
+tagged with the topics of each of its seats: `crew:all` subscribers get it
+whole and every other subscriber only the seats of its topics, both live and
+when the event log replays it (see Flight.publish and EventLog.since).
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Ventana de agregación en milisegundos, 0 desactiva la agregación
+SEAT_COALESCE_MS = int(os.getenv("SEAT_COALESCE_MS", "0"))
+
+
+class SeatUpdateCoalescer:
+    def __init__(
+        self,
+        publish: Callable[..., Awaitable[None]],
+        tick_ms: int = SEAT_COALESCE_MS,
+        topics_for: Optional[Callable[[str], List[str]]] = None
+    ):
+        self.publish_event = publish
+        self.topics_for = topics_for
+        self.tick = tick_ms / 1000
+        self.pending: Dict[str, dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.tick > 0
+
+    async def publish(self, seat_id: str, updates: dict):
+        """Broadcast a seat change, or merge it into the current window"""
+        if not self.enabled:
+            await self.publish_event({
+                "event": "seat_updated",
+                "data": {
+                    "seatId": seat_id,
+                    "updates": updates
+                }
+            }, self.topics_for(seat_id) if self.topics_for else None)
+            return
+
+        self.pending.setdefault(seat_id, {}).update(updates)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_tick())
+
+    async def flush(self):
+        """Broadcast every pending change as one seats_patch frame"""
+        if not self.pending:
+            return
+        seats, self.pending = self.pending, {}
+        await self.publish_patch(seats)
+
+    async def publish_patch(self, seats: Dict[str, dict]):
+        """Broadcast the changes of several seats right away as one seats_patch frame"""
+        if self.topics_for is None:
+            await self.publish_event({
+                "event": "seats_patch",
+                "data": {"seats": seats}
+            })
+            return
+
+        # Temas de cada asiento: cada suscriptor recibe (o recupera al reconectar) solo sus asientos
+        parts = {seat_id: self.topics_for(seat_id) for seat_id in seats}
+        topics = sorted({topic for seat_topics in parts.values() for topic in seat_topics})
+        await self.publish_event({
+            "event": "seats_patch",
+            "data": {"seats": seats}
+        }, topics, parts=parts)
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_after_tick(self):
+        try:
+            await asyncio.sleep(self.tick)
+        finally:
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,258 @@
+"""
+Compact seat state of a cabin.
+
+Seats are not kept as one dict per seat: the cabin is a grid of rows by seat
+letters (the layout of build_default_seats, "12C" is row 12, letter C) and
+each field is a column indexed by the position of the seat in that grid:
+
+- is_occupied / is_buckled: one bit per seat
+- seat_class: one byte per seat, index into the list of class names
+- passenger_name: interned strings, a cabin has few distinct names
+- last_updated: microseconds since the epoch (naive, as datetime.now())
+
+A seat dict is only built when a seat is read (get_seat, REST, snapshots),
+so memory per flight no longer grows with a dict, its keys and an ISO string
+per seat.
+
+The bitmap snapshot packs the occupancy and belts of the whole cabin in a few
+dozen bytes:
+
+    {"firstRow": 1, "lastRow": 33, "letters": "ABCDEF",
+     "occupied": "<base64>", "buckled": "<base64>",
+     "classes": [["business", 48], ["economy", 150]]}
+
+Bit i is the seat at grid position i = (row - firstRow) * len(letters) +
+letter index, most significant bit first (byte i // 8, mask 0x80 >> i % 8).
+`classes` lists the class of consecutive positions as [name, count] runs and
+`missing`, only present when the grid has gaps, marks positions without seat.
+"""
+
+import base64
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from topics import SEAT_ID_PATTERN
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# last_updated vacío
+NO_TIMESTAMP = -1
+NO_CLASS = 255
+
+
+def parse_seat_id(seat_id: str) -> Tuple[int, str]:
+    match = SEAT_ID_PATTERN.match(seat_id)
+    if not match:
+        raise ValueError(f"Invalid seat id {seat_id!r}, expected <row><letter>")
+    return int(match.group(1)), match.group(2)
+
+
+class SeatLayout:
+    """Grid of rows first_row..last_row by seat letters"""
+
+    def __init__(self, first_row: int, last_row: int, letters: str):
+        self.first_row = first_row
+        self.last_row = last_row
+        self.letters = letters
+        self._letter_index = {letter: index for index, letter in enumerate(letters)}
+
+    @classmethod
+    def from_seat_ids(cls, seat_ids: Iterable[str]) -> "SeatLayout":
+        parsed = [parse_seat_id(seat_id) for seat_id in seat_ids]
+        if not parsed:
+            return cls(1, 0, "")
+        rows = [row for row, _ in parsed]
+        return cls(min(rows), max(rows), "".join(sorted({letter for _, letter in parsed})))
+
+    def __len__(self) -> int:
+        return max(0, self.last_row - self.first_row + 1) * len(self.letters)
+
+    def index(self, seat_id: str) -> Optional[int]:
+        # Un id que no es str (p. ej. un número enviado por un cliente) no es un asiento
+        match = SEAT_ID_PATTERN.match(seat_id) if isinstance(seat_id, str) else None
+        if not match:
+            return None
+        row = int(match.group(1))
+        letter = self._letter_index.get(match.group(2))
+        if letter is None or not self.first_row <= row <= self.last_row:
+            return None
+        return (row - self.first_row) * len(self.letters) + letter
+
+    def seat_id(self, index: int) -> str:
+        row, letter = divmod(index, len(self.letters))
+        return f"{self.first_row + row}{self.letters[letter]}"
+
+    def to_dict(self) -> dict:
+        return {"firstRow": self.first_row, "lastRow": self.last_row, "letters": self.letters}
+
+
+class Bitset:
+    def __init__(self, size: int):
+        self.bits = bytearray((size + 7) // 8)
+
+    def __getitem__(self, index: int) -> bool:
+        return bool(self.bits[index >> 3] & (0x80 >> (index & 7)))
+
+    def __setitem__(self, index: int, value: bool):
+        if value:
+            self.bits[index >> 3] |= 0x80 >> (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def to_base64(self) -> str:
+        return base64.b64encode(bytes(self.bits)).decode("ascii")
+
+
+def timestamp_to_micros(value: Optional[str]) -> Optional[int]:
+    """ISO timestamp as microseconds since the epoch, None if it is not one we can restore exactly"""
+    if value is None:
+        return NO_TIMESTAMP
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is not None or parsed.isoformat() != value:
+        return None
+    return (parsed - EPOCH) // MICROSECOND
+
+
+def micros_to_timestamp(value: int) -> Optional[str]:
+    if value == NO_TIMESTAMP:
+        return None
+    return (EPOCH + value * MICROSECOND).isoformat()
+
+
+class SeatTable(Mapping[str, dict]):
+    """Seats of a cabin stored column by column, read as seat dicts"""
+
+    def __init__(self, seats: Iterable[dict] = ()):
+        seats = list(seats)
+        self.layout = SeatLayout.from_seat_ids(seat["seat_id"] for seat in seats)
+        size = len(self.layout)
+        self.present = Bitset(size)
+        self.occupied = Bitset(size)
+        self.buckled = Bitset(size)
+        self.classes: List[str] = []
+        self.seat_class = bytearray([NO_CLASS]) * size
+        self.names: List[Optional[str]] = [None] * size
+        self.last_updated = array("q", [NO_TIMESTAMP]) * size
+        # Posición -> campos sin columna (o timestamps que no caben en ella)
+        self.extra: Dict[int, dict] = {}
+        self.count = 0
+        for seat in seats:
+            index = self.layout.index(seat["seat_id"])
+            if not self.present[index]:
+                self.present[index] = True
+                self.count += 1
+            self._write(index, seat)
+
+    def __getitem__(self, seat_id: str) -> dict:
+        index = self.layout.index(seat_id)
+        if index is None or not self.present[index]:
+            raise KeyError(seat_id)
+        return self._read(index)
+
+    def __contains__(self, seat_id) -> bool:
+        index = self.layout.index(seat_id)
+        return index is not None and self.present[index]
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self.layout)):
+            if self.present[index]:
+                yield self.layout.seat_id(index)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def update(self, seat_id: str, updates: dict):
+        """Set fields of an existing seat"""
+        index = self.layout.index(seat_id)
+        if index is None or not self.present[index]:
+            raise KeyError(seat_id)
+        self._write(index, updates)
+
+    def is_buckled(self, seat_id: str) -> bool:
+        return self.buckled[self.layout.index(seat_id)]
+
+    def class_of(self, seat_id: str) -> Optional[str]:
+        class_index = self.seat_class[self.layout.index(seat_id)]
+        return None if class_index == NO_CLASS else self.classes[class_index]
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {
+            self.layout.seat_id(index): self._read(index)
+            for index in range(len(self.layout)) if self.present[index]
+        }
+
+    def to_bitmap(self) -> dict:
+        """Occupancy, belts and classes of the whole cabin, see the module docstring"""
+        bitmap = dict(
+            self.layout.to_dict(),
+            occupied=self.occupied.to_base64(),
+            buckled=self.buckled.to_base64(),
+            classes=self._class_runs()
+        )
+        if self.count < len(self.layout):
+            missing = Bitset(len(self.layout))
+            for index in range(len(self.layout)):
+                missing[index] = not self.present[index]
+            bitmap["missing"] = missing.to_base64()
+        return bitmap
+
+    def _class_runs(self) -> List[list]:
+        runs: List[list] = []
+        for class_index in self.seat_class:
+            name = None if class_index == NO_CLASS else self.classes[class_index]
+            if runs and runs[-1][0] == name:
+                runs[-1][1] += 1
+            else:
+                runs.append([name, 1])
+        return runs
+
+    def _read(self, index: int) -> dict:
+        class_index = self.seat_class[index]
+        seat = {
+            "seat_id": self.layout.seat_id(index),
+            "passenger_name": self.names[index],
+            "is_occupied": self.occupied[index],
+            "is_buckled": self.buckled[index],
+            "seat_class": None if class_index == NO_CLASS else self.classes[class_index],
+            "last_updated": micros_to_timestamp(self.last_updated[index])
+        }
+        extra = self.extra.get(index)
+        if extra:
+            seat.update(extra)
+        return seat
+
+    def _write(self, index: int, fields: dict):
+        for key, value in fields.items():
+            if key == "is_occupied":
+                self.occupied[index] = bool(value)
+            elif key == "is_buckled":
+                self.buckled[index] = bool(value)
+            elif key == "passenger_name":
+                self.names[index] = sys.intern(value) if isinstance(value, str) else value
+            elif key == "seat_class":
+                self.seat_class[index] = self._class_index(value)
+            elif key == "last_updated":
+                micros = timestamp_to_micros(value)
+                if micros is None:
+                    self.extra.setdefault(index, {})[key] = value
+                else:
+                    self.last_updated[index] = micros
+                    self.extra.get(index, {}).pop(key, None)
+            elif key != "seat_id":
+                self.extra.setdefault(index, {})[key] = value
+
+    def _class_index(self, name: Optional[str]) -> int:
+        if name is None:
+            return NO_CLASS
+        try:
+            return self.classes.index(name)
+        except ValueError:
+            if len(self.classes) >= NO_CLASS:
+                raise ValueError("Too many seat classes")
+            self.classes.append(name)
+            return len(self.classes) - 1
@@ -0,0 +1,245 @@
+"""
+Batched sensor ingestion.
+
+Seat and lavatory door sensors post their readings in batches, as NDJSON
+(one JSON reading per line), to POST /flights/{flight_id}/sensors instead of
+sending one WebSocket message per reading on /ws:
+
+    {"sensor": "belt", "seatId": "12C", "value": true}
+    {"sensor": "occupancy", "seatId": "12C", "value": false}
+    {"sensor": "door", "bathroomId": "aft", "seatId": "12C", "value": "enter"}
+
+A reading may carry "t", the epoch milliseconds at which the gateway read it;
+without it the arrival time is used. A door reading without bathroomId is
+resolved like the door sensor events of /ws.
+
+Debouncing: a new value of a sensor is only applied once it has held for
+SENSOR_DEBOUNCE_MS, so a signal flapping inside the window never reaches the
+cabin state. A value that goes back to the current state cancels the pending
+change. The value of a door includes the seat entering, so an exit followed
+by another passenger's entry is still a change. Pending values settle on the
+next batch or on a timer.
+
+Every reading that settles at the same moment is applied as a single state
+transition (CabinState.apply_sensor_batch) and persisted as a single write
+batch; the seat changes of the transition are broadcast as one seats_patch.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from cabin_state import CabinState
+from encoding import DecodeError, loads
+from structured_log import get_logger
+
+log = get_logger("sensor_ingest")
+
+# Tiempo que un valor nuevo debe mantenerse antes de aplicarse, 0 lo aplica en el siguiente lote
+SENSOR_DEBOUNCE_MS = int(os.getenv("SENSOR_DEBOUNCE_MS", "300"))
+# Lecturas máximas por petición
+SENSOR_BATCH_MAX = int(os.getenv("SENSOR_BATCH_MAX", "5000"))
+
+# Sensor de asiento -> campo del asiento
+SEAT_SENSORS = {"belt": "is_buckled", "occupancy": "is_occupied"}
+DOOR_ACTIONS = {"enter": True, "exit": False}
+
+
+class SensorReading(NamedTuple):
+    # ("belt" | "occupancy", seat_id) o ("door", bathroom_id)
+    key: Tuple[str, str]
+    value: bool
+    # Pasajero que entra en el lavabo (solo lecturas de puerta)
+    seat_id: Optional[str]
+    at: float
+
+
+class SensorBatch:
+    """Readings that settled together: seat field updates and lavatory door changes"""
+
+    def __init__(self):
+        self.seats: Dict[str, dict] = {}
+        # bathroom_id -> (ocupado, asiento que entra)
+        self.doors: Dict[str, Tuple[bool, Optional[str]]] = {}
+
+    def add(self, reading: SensorReading):
+        sensor, target = reading.key
+        if sensor == "door":
+            self.doors[target] = (reading.value, reading.seat_id)
+        else:
+            self.seats.setdefault(target, {})[SEAT_SENSORS[sensor]] = reading.value
+
+    def __len__(self) -> int:
+        return sum(len(updates) for updates in self.seats.values()) + len(self.doors)
+
+
+def parse_reading(state: CabinState, raw: dict, now: float) -> SensorReading:
+    """Validate one reading against the cabin, raises ValueError with the message for the gateway"""
+    if not isinstance(raw, dict):
+        raise ValueError("Lectura no válida")
+    sensor = raw.get("sensor")
+    seat_id = raw.get("seatId")
+    bathroom_id = raw.get("bathroomId")
+    value = raw.get("value")
+    at = raw.get("t")
+    # Campos de otro tipo (listas, objetos) rechazan solo esta lectura
+    if not isinstance(sensor, str):
+        raise ValueError("Tipo de sensor no válido")
+    if at is None:
+        at = now
+    elif not isinstance(at, (int, float)) or isinstance(at, bool):
+        raise ValueError("Marca de tiempo no válida")
+    # Un reloj adelantado no puede retrasar la aplicación de la lectura
+    at = min(float(at), now)
+    if seat_id is not None and (not isinstance(seat_id, str) or state.get_seat(seat_id) is None):
+        raise ValueError("Asiento no encontrado")
+    if bathroom_id is not None and not isinstance(bathroom_id, str):
+        raise ValueError("Baño no encontrado")
+
+    if sensor in SEAT_SENSORS:
+        if seat_id is None:
+            raise ValueError("ID de asiento requerido")
+        if not isinstance(value, bool):
+            raise ValueError("Valor del sensor no válido")
+        return SensorReading((sensor, seat_id), value, None, at)
+    if sensor == "door":
+        if not isinstance(value, str) or value not in DOOR_ACTIONS:
+            raise ValueError("Acción de puerta no válida")
+        lavatory = state.resolve_lavatory(bathroom_id, seat_id)
+        if lavatory is None:
+            raise ValueError("Baño no encontrado")
+        return SensorReading(("door", lavatory.bathroom_id), DOOR_ACTIONS[value], seat_id, at)
+    raise ValueError("Tipo de sensor no válido")
+
+
+class SensorIngestor:
+    """Debounces the readings of one flight and applies the settled ones in batches"""
+
+    def __init__(self, state: CabinState, apply: Callable[[SensorBatch], Awaitable[None]],
+                 debounce_ms: int = SENSOR_DEBOUNCE_MS):
+        self.state = state
+        self.apply = apply
+        self.window = debounce_ms
+        # Cambio pendiente de cada sensor, desde la primera lectura con ese valor
+        self.pending: Dict[Tuple[str, str], SensorReading] = {}
+        self.received = 0
+        self.rejected = 0
+        # Lecturas que no llegaron a aplicarse: el valor volvió atrás o ya era el del estado
+        self.debounced = 0
+        self.applied = 0
+        self.transitions = 0
+        self._lock = asyncio.Lock()
+        self._settle_task: Optional[asyncio.Task] = None
+
+    def unchanged(self, reading: SensorReading) -> bool:
+        """Whether a reading leaves its sensor as the cabin state already is"""
+        sensor, target = reading.key
+        if sensor == "door":
+            lavatory = self.state.lavatories.get(target)
+            # La entrada de otro pasajero cambia el lavabo aunque siga ocupado
+            return lavatory.is_occupied == reading.value and (
+                not reading.value or reading.seat_id is None or reading.seat_id == lavatory.current_user
+            )
+        return reading.value == bool(self.state.get_seat(target).get(SEAT_SENSORS[sensor], False))
+
+    async def ingest(self, lines: Iterable[bytes]) -> dict:
+        """Debounce a batch of NDJSON readings and apply every change that has settled"""
+        now = time.time() * 1000
+        rejected: List[dict] = []
+        received = 0
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            received += 1
+            if received > SENSOR_BATCH_MAX:
+                rejected.append({"line": number, "error": "Demasiadas lecturas en el lote"})
+                continue
+            try:
+                reading = parse_reading(self.state, loads(line), now)
+            except DecodeError:
+                rejected.append({"line": number, "error": "JSON no válido"})
+                continue
+            except ValueError as e:
+                rejected.append({"line": number, "error": str(e)})
+                continue
+            self._observe(reading)
+        self.received += received
+        self.rejected += len(rejected)
+
+        applied = await self.settle(now)
+        self._schedule()
+        return {
+            "received": received,
+            "applied": applied,
+            "pending": len(self.pending),
+            "rejected": rejected
+        }
+
+    def _observe(self, reading: SensorReading):
+        previous = self.pending.get(reading.key)
+        if self.unchanged(reading):
+            # El valor volvió al del estado antes de asentarse: no hay cambio
+            self.debounced += 1
+            if previous is not None:
+                del self.pending[reading.key]
+        elif previous is not None and (previous.value, previous.seat_id) == (reading.value, reading.seat_id):
+            # Mismo valor pendiente: se conserva desde cuándo se mantiene
+            self.debounced += 1
+            self.pending[reading.key] = reading._replace(at=previous.at)
+        else:
+            if previous is not None:
+                self.debounced += 1
+            self.pending[reading.key] = reading
+
+    async def settle(self, now: Optional[float] = None) -> int:
+        """Apply as one transition every pending change that has held for the debounce window"""
+        async with self._lock:
+            if now is None:
+                now = time.time() * 1000
+            batch = SensorBatch()
+            for key, reading in list(self.pending.items()):
+                if now - reading.at >= self.window:
+                    del self.pending[key]
+                    # Otro cliente pudo aplicar el mismo valor mientras tanto
+                    if not self.unchanged(reading):
+                        batch.add(reading)
+            if not len(batch):
+                return 0
+            await self.apply(batch)
+            self.applied += len(batch)
+            self.transitions += 1
+            return len(batch)
+
+    def _schedule(self):
+        if self.pending and self._settle_task is None:
+            self._settle_task = asyncio.create_task(self._settle_pending())
+
+    async def _settle_pending(self):
+        try:
+            while self.pending:
+                due = min(reading.at for reading in self.pending.values()) + self.window
+                await asyncio.sleep(max(0.0, due - time.time() * 1000) / 1000)
+                try:
+                    await self.settle()
+                except Exception as e:
+                    log.error("sensor_apply_failed", flight=self.state.flight_id, error=str(e))
+        finally:
+            self._settle_task = None
+
+    def stats(self) -> dict:
+        return {
+            "debounceMs": self.window,
+            "received": self.received,
+            "rejected": self.rejected,
+            "debounced": self.debounced,
+            "applied": self.applied,
+            "transitions": self.transitions,
+            "pending": len(self.pending)
+        }
+
+    async def stop(self):
+        """Stop the settle timer; changes that have not settled yet are dropped"""
+        if self._settle_task is not None:
+            self._settle_task.cancel()
+            self._settle_task = None
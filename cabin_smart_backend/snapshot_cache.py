@@ -0,0 +1,52 @@
+"""
+Versioned cache of the pre-serialized initial_state snapshot.
+
+The snapshot is rebuilt at most once per state version. Requests that arrive
+while a build for the same version is running wait for that build instead of
+starting their own, so a reconnect storm costs a single build.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable, Optional
+
+from encoding import EncodedMessage
+
+
+class SnapshotCache:
+    def __init__(self, builder: Callable[[], Awaitable[EncodedMessage]], version: Callable[[], Hashable]):
+        self.builder = builder
+        self.version = version
+        self.builds = 0
+        self._version: Optional[Hashable] = None
+        self._message: Optional[EncodedMessage] = None
+        self._building: Optional[asyncio.Task] = None
+        self._building_version: Optional[Hashable] = None
+
+    async def get(self) -> EncodedMessage:
+        """Return the snapshot for the current version, building it if needed"""
+        version = self.version()
+        if self._message is not None and self._version == version:
+            return self._message
+
+        if self._building is None or self._building_version != version:
+            self._building_version = version
+            self._building = asyncio.create_task(self._build(version))
+        # shield: si un cliente se desconecta no cancela la construcción compartida
+        return await asyncio.shield(self._building)
+
+    def invalidate(self):
+        self._message = None
+        self._version = None
+
+    async def _build(self, version: Hashable) -> EncodedMessage:
+        try:
+            message = await self.builder()
+            self.builds += 1
+            # Solo se guarda si nadie ha empezado una versión más nueva mientras tanto
+            if self._building_version == version:
+                self._version = version
+                self._message = message
+            return message
+        finally:
+            if self._building_version == version:
+                self._building = None
@@ -0,0 +1,205 @@
+"""
+Non-blocking structured logging.
+
+Server modules log events, not sentences: an event name plus fields,
+
+    log = get_logger("connection_manager")
+    log.info("ws_connected", flight="LH123", connections=198)
+
+rendered as one JSON object per line (LOG_FORMAT=json) or as
+`time level logger event key=value...` (LOG_FORMAT=text).
+
+The event loop never writes to stdout: records are put on a bounded queue
+(stdlib QueueHandler) and a background thread (QueueListener) formats and
+writes them. When the queue is full the record is dropped and counted
+instead of blocking the loop.
+
+Filtering is decided before a record is built, so a filtered call costs a
+dictionary lookup:
+
+- LOG_LEVEL: minimum level (INFO)
+- LOG_EVENT_LEVELS: level of specific events, e.g. "ws_connected:DEBUG"
+  silences connection churn at the default level
+- LOG_SAMPLING: fraction of specific events kept, e.g. "ws_connected:0.01"
+  keeps one in a hundred; kept records carry `sampled` (how many calls each
+  one stands for) so counts can be rebuilt
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, TextIO
+
+from encoding import dumps
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_FORMATS = ("json", "text")
+LOG_EVENT_LEVELS = os.getenv("LOG_EVENT_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "cabin_smart"
+
+
+def parse_event_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, level = entry.rpartition(":")
+        number = logging.getLevelName(level.strip().upper())
+        if not event or not isinstance(number, int):
+            raise ValueError(f"Invalid event level {entry!r}, expected event:LEVEL")
+        levels[event.strip()] = number
+    return levels
+
+
+def parse_sampling(spec: str) -> Dict[str, int]:
+    """Sampling rates as the interval between kept records (0.01 -> one in 100)"""
+    intervals = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = entry.rpartition(":")
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = 0.0
+        if not event or not 0 < rate <= 1:
+            raise ValueError(f"Invalid sampling rate {entry!r}, expected event:rate with 0 < rate <= 1")
+        intervals[event.strip()] = round(1 / rate)
+    return intervals
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name.rpartition(".")[2],
+            "event": record.msg,
+        }
+        entry.update(getattr(record, "fields", {}))
+        return dumps(entry).decode("utf-8")
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        created = datetime.fromtimestamp(record.created).isoformat(sep=" ", timespec="milliseconds")
+        return f"{created} {record.levelname:<7} {record.name.rpartition('.')[2]} {record.msg} {fields}".rstrip()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: records that do not fit in the queue are dropped and counted"""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Los campos ya son datos: no hace falta formatear en el hilo que registra
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventLogger:
+    """Logs events with fields, after the level and sampling of the event type"""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def log(self, level: int, event: str, **fields):
+        level = _config.event_levels.get(event, level)
+        if not self._logger.isEnabledFor(level):
+            return
+        interval = _config.sampling.get(event)
+        if interval is not None and interval > 1:
+            seen = _config.sample_counts[event] = _config.sample_counts.get(event, 0) + 1
+            if seen % interval != 1:
+                return
+            fields["sampled"] = interval
+        self._logger.log(level, event, extra={"fields": fields})
+
+    def debug(self, event: str, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+
+class _Config:
+    def __init__(self):
+        self.event_levels: Dict[str, int] = {}
+        self.sampling: Dict[str, int] = {}
+        self.sample_counts: Dict[str, int] = {}
+        self.handler: Optional[logging.Handler] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.lock = threading.Lock()
+
+
+_config = _Config()
+
+
+def configure(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, event_levels: str = LOG_EVENT_LEVELS,
+              sampling: str = LOG_SAMPLING, stream: Optional[TextIO] = None, background: bool = True,
+              queue_size: int = LOG_QUEUE_SIZE):
+    """(Re)configure the server logs; with background=False records are written by the caller"""
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {fmt!r}, expected one of {LOG_FORMATS}")
+    with _config.lock:
+        shutdown()
+        _config.event_levels = parse_event_levels(event_levels)
+        _config.sampling = parse_sampling(sampling)
+        _config.sample_counts = {}
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        if background:
+            records: queue.Queue = queue.Queue(maxsize=queue_size)
+            _config.handler = DroppingQueueHandler(records)
+            _config.listener = logging.handlers.QueueListener(records, output)
+            _config.listener.start()
+        else:
+            _config.handler = output
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(level.upper())
+        logger.propagate = False
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(_config.handler)
+
+
+def shutdown():
+    """Write every queued record and stop the writer thread"""
+    if _config.listener is not None:
+        _config.listener.stop()
+        _config.listener = None
+
+
+def dropped() -> int:
+    """Records dropped because the queue was full"""
+    return getattr(_config.handler, "dropped", 0)
+
+
+def get_logger(name: str) -> EventLogger:
+    if _config.handler is None:
+        configure()
+    return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+atexit.register(shutdown)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Check that the queries issued by the backend are served by indexes.
+
+Runs `explain` on every query shape used against MongoDB and asserts the
+winning plan is an index scan and never a collection scan.
+"""
+
+import asyncio
+from database import (
+    connect_to_mongo,
+    close_mongo_connection,
+    get_database,
+    init_indexes,
+    init_seats_collection,
+    init_bathroom_status_collection,
+    SEATS_COLLECTION,
+    BATHROOM_QUEUE_COLLECTION,
+    BATHROOM_STATUS_COLLECTION
+)
+
+# (colección, filtro, orden) de cada consulta que hace el backend
+QUERY_SHAPES = [
+    (SEATS_COLLECTION, {"seat_id": "1A"}, None),
+    (BATHROOM_QUEUE_COLLECTION, {"seat_id": "1A"}, None),
+    (BATHROOM_QUEUE_COLLECTION, {}, {"timestamp": 1}),
+    (BATHROOM_STATUS_COLLECTION, {"bathroom_id": "main"}, None),
+]
+
+def plan_stages(plan: dict):
+    """Yield every stage name of a query plan tree"""
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+async def explain(collection: str, query_filter: dict, sort: dict = None):
+    db = await get_database()
+    command = {"find": collection, "filter": query_filter}
+    if sort:
+        command["sort"] = sort
+    result = await db.command("explain", command, verbosity="queryPlanner")
+    winning_plan = result["queryPlanner"]["winningPlan"]
+    # MongoDB 7+ envuelve el plan clásico en "queryPlan"
+    return list(plan_stages(winning_plan.get("queryPlan", winning_plan)))
+
+async def check_query_plans():
+    await connect_to_mongo()
+    await init_indexes()
+    await init_seats_collection()
+    await init_bathroom_status_collection()
+
+    try:
+        for collection, query_filter, sort in QUERY_SHAPES:
+            stages = await explain(collection, query_filter, sort)
+            assert "COLLSCAN" not in stages, f"{collection} {query_filter} uses a collection scan: {stages}"
+            assert any(stage and stage.endswith("IXSCAN") for stage in stages), \
+                f"{collection} {query_filter} does not use an index: {stages}"
+            print(f"✅ {collection} {query_filter or sort}: {' <- '.join(stages)}")
+    finally:
+        await close_mongo_connection()
+
+    print("✅ Todas las consultas usan índices")
+
+if __name__ == "__main__":
+    asyncio.run(check_query_plans())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Conformance checks shared by every storage backend.
+
+The same scenarios run against the in-memory, SQLite and (with --mongo)
+MongoDB repositories, so CabinState behaves identically on all of them.
+
+    python test_repositories.py            # memory y sqlite
+    python test_repositories.py --mongo    # también MongoDB (MONGODB_URL)
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+from typing import Awaitable, Callable, List, Tuple
+
+# Reintentos rápidos de las escrituras fallidas (ver retries_failed_batches)
+os.environ.setdefault("WRITE_RETRY_MS", "10")
+
+from cabin_state import CabinState
+from database import connect_to_mongo, close_mongo_connection, get_database, collection_name
+from repository import CabinRepository, MemoryRepository, MongoRepository, SqliteRepository
+from write_batch import WriteBatch
+
+BATHROOM_IDS = ["fwd", "aft"]
+CHECKS: List[Tuple[str, Callable]] = []
+
+
+def check(function):
+    CHECKS.append((function.__doc__, function))
+    return function
+
+
+@check
+async def seeds_the_cabin(open_repository):
+    """init seeds the cabin, every lavatory and an empty queue"""
+    repository = await open_repository("A")
+    seats = await repository.load_seats()
+    assert len(seats) == 198, len(seats)
+    assert {"seat_id", "passenger_name", "is_occupied", "is_buckled", "seat_class"} <= set(seats[0])
+    assert "_id" not in seats[0]
+    lavatories = await repository.load_lavatories(BATHROOM_IDS)
+    assert sorted(lavatory["bathroom_id"] for lavatory in lavatories) == sorted(BATHROOM_IDS)
+    assert not any(lavatory["is_occupied"] for lavatory in lavatories)
+    assert await repository.load_queue() == []
+
+
+@check
+async def updates_return_post_image(open_repository):
+    """update_seat merges fields and returns the whole updated seat"""
+    repository = await open_repository("A")
+    seat = await repository.update_seat("1A", {"is_occupied": False, "last_updated": "t1"})
+    assert seat["seat_id"] == "1A" and seat["is_occupied"] is False and seat["last_updated"] == "t1"
+    assert "passenger_name" in seat and "_id" not in seat
+    stored = {seat["seat_id"]: seat for seat in await repository.load_seats()}["1A"]
+    assert stored == seat, (stored, seat)
+    assert await repository.update_seat("99Z", {"is_occupied": True}) is None
+
+
+@check
+async def toggles_the_belt(open_repository):
+    """toggle_seat_belt flips is_buckled and returns the post-image"""
+    repository = await open_repository("A")
+    before = (await repository.update_seat("2B", {"is_buckled": False}))["is_buckled"]
+    first = await repository.toggle_seat_belt("2B", "t1")
+    second = await repository.toggle_seat_belt("2B", "t2")
+    assert first["is_buckled"] is (not before) and first["last_updated"] == "t1"
+    assert second["is_buckled"] is before and second["last_updated"] == "t2"
+    assert await repository.toggle_seat_belt("99Z", "t3") is None
+
+
+@check
+async def concurrent_toggles_do_not_collide(open_repository):
+    """Concurrent toggles on one seat are all applied"""
+    repository = await open_repository("A")
+    before = (await repository.update_seat("3C", {"is_buckled": False}))["is_buckled"]
+    await asyncio.gather(*[repository.toggle_seat_belt("3C", f"t{n}") for n in range(9)])
+    seat = {seat["seat_id"]: seat for seat in await repository.load_seats()}["3C"]
+    assert seat["is_buckled"] is (not before)
+
+
+@check
+async def keeps_queue_order(open_repository):
+    """The queue loads in arrival order and rejects duplicates"""
+    repository = await open_repository("A")
+    for index, seat_id in enumerate(["10A", "4B", "20F"]):
+        await repository.add_to_queue({"seat_id": seat_id, "passenger_name": seat_id, "timestamp": f"2024-01-01T00:00:0{index}"})
+    try:
+        await repository.add_to_queue({"seat_id": "4B", "passenger_name": "4B", "timestamp": "2024-01-01T00:00:09"})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("duplicate queue entry accepted")
+    assert await repository.remove_from_queue("4B") is True
+    assert await repository.remove_from_queue("4B") is False
+    queue = await repository.load_queue()
+    assert [item["seat_id"] for item in queue] == ["10A", "20F"], queue
+    assert "_id" not in queue[0]
+
+
+@check
+async def upserts_lavatories(open_repository):
+    """update_lavatory returns the post-image and creates unknown lavatories"""
+    repository = await open_repository("A")
+    lavatory = await repository.update_lavatory("fwd", {"is_occupied": True, "current_user": "1A", "last_updated": "t1"})
+    assert lavatory == {"bathroom_id": "fwd", "is_occupied": True, "current_user": "1A", "last_updated": "t1"}, lavatory
+    created = await repository.update_lavatory("mid", {"zone": "mid", "is_occupied": False})
+    assert created["bathroom_id"] == "mid" and created["zone"] == "mid"
+    loaded = await repository.load_lavatories(["fwd"])
+    assert len(loaded) == 1 and loaded[0]["current_user"] == "1A"
+
+
+@check
+async def applies_batches(open_repository):
+    """apply_batch writes a coalesced batch: merged updates, queue replacements and lavatory upserts"""
+    repository = await open_repository("A")
+    await repository.add_to_queue({"seat_id": "8A", "passenger_name": "Antes", "timestamp": "t0"})
+    await repository.add_to_queue({"seat_id": "8B", "passenger_name": "Sale", "timestamp": "t0"})
+    batch = WriteBatch()
+    batch.add(("update_seat", ("8A", {"is_buckled": True, "last_updated": "t1"})))
+    batch.add(("update_seat", ("8A", {"is_buckled": False, "last_updated": "t2"})))
+    batch.add(("update_seat", ("8C", {"is_occupied": False})))
+    batch.add(("remove_from_queue", ("8A",)))
+    batch.add(("add_to_queue", ({"seat_id": "8A", "passenger_name": "Después", "timestamp": "t3"},)))
+    batch.add(("remove_from_queue", ("8B",)))
+    batch.add(("add_to_queue", ({"seat_id": "8D", "passenger_name": "Nuevo", "timestamp": "t4"},)))
+    batch.add(("add_to_queue", ({"seat_id": "8E", "passenger_name": "Fugaz", "timestamp": "t5"},)))
+    batch.add(("remove_from_queue", ("8E",)))
+    batch.add(("update_lavatory", ("fwd", {"is_occupied": True, "current_user": "8F"})))
+    batch.add(("update_lavatory", ("fwd", {"last_updated": "t6"})))
+    assert batch.ops == 11 and len(batch) == 7, len(batch)
+    await repository.apply_batch(batch)
+    seats = {seat["seat_id"]: seat for seat in await repository.load_seats()}
+    assert seats["8A"]["is_buckled"] is False and seats["8A"]["last_updated"] == "t2"
+    assert seats["8C"]["is_occupied"] is False
+    queue = await repository.load_queue()
+    assert [(item["seat_id"], item["passenger_name"]) for item in queue] == [("8A", "Después"), ("8D", "Nuevo")], queue
+    lavatory = (await repository.load_lavatories(["fwd"]))[0]
+    assert lavatory["current_user"] == "8F" and lavatory["is_occupied"] is True and lavatory["last_updated"] == "t6"
+
+
+@check
+async def retries_failed_batches(open_repository):
+    """A write-behind batch that fails is retried with the writes queued meanwhile, nothing is lost"""
+    repository = await open_repository("A")
+    apply_batch = repository.apply_batch
+    errors = 2
+
+    async def failing_apply_batch(batch):
+        nonlocal errors
+        if errors:
+            errors -= 1
+            # Peor caso: el lote llega a escribirse y aun así la llamada falla
+            await apply_batch(batch)
+            raise ConnectionError("almacenamiento no disponible")
+        await apply_batch(batch)
+
+    repository.apply_batch = failing_apply_batch
+    state = CabinState("conformance-A", write_mode="async", repository=repository,
+                       lavatory_layout="fwd:forward:all,aft:aft:all")
+    await state.load()
+    state.start()
+    await state.add_to_queue("9A", "Ana")
+    await state.toggle_seat_belt("9B")
+    await asyncio.sleep(0.1)
+    await state.update_seat("9B", {"is_occupied": False})
+    await state.stop()
+    assert state.write_metrics.failed_flushes == 2, state.write_metrics.to_dict()
+    seats = {seat["seat_id"]: seat for seat in await repository.load_seats()}
+    assert seats["9B"]["is_buckled"] is state.seats["9B"]["is_buckled"] and seats["9B"]["is_occupied"] is False
+    assert [item["seat_id"] for item in await repository.load_queue()] == ["9A"]
+
+
+@check
+async def init_is_idempotent(open_repository):
+    """A second init keeps seats and lavatories but clears the queue, unless told to keep it"""
+    repository = await open_repository("A")
+    await repository.update_seat("5D", {"passenger_name": "Persistente"})
+    await repository.update_lavatory("aft", {"is_occupied": True})
+    await repository.add_to_queue({"seat_id": "5D", "passenger_name": "Persistente", "timestamp": "t"})
+    # Worker reiniciado con otros en marcha: la cola sigue siendo la de sus pares
+    await repository.init(BATHROOM_IDS, clear_queue=False)
+    assert [item["seat_id"] for item in await repository.load_queue()] == ["5D"]
+    await repository.init(BATHROOM_IDS)
+    seats = {seat["seat_id"]: seat for seat in await repository.load_seats()}
+    assert len(seats) == 198 and seats["5D"]["passenger_name"] == "Persistente"
+    assert (await repository.load_lavatories(["aft"]))[0]["is_occupied"] is True
+    assert await repository.load_queue() == []
+
+
+@check
+async def survives_reopening(open_repository):
+    """Writes are visible to a new repository of the same flight"""
+    first = await open_repository("A")
+    await first.update_seat("7F", {"is_occupied": False, "last_updated": "t1"})
+    await first.update_lavatory("fwd", {"current_user": "7F"})
+    await first.close()
+    second = await open_repository("A")
+    seat = {seat["seat_id"]: seat for seat in await second.load_seats()}["7F"]
+    assert seat["is_occupied"] is False and seat["last_updated"] == "t1"
+    assert (await second.load_lavatories(["fwd"]))[0]["current_user"] == "7F"
+
+
+@check
+async def isolates_flights(open_repository):
+    """Each flight has its own storage"""
+    first = await open_repository("A")
+    second = await open_repository("B")
+    await first.update_seat("6E", {"passenger_name": "Solo en A"})
+    await first.add_to_queue({"seat_id": "6E", "passenger_name": "Solo en A", "timestamp": "t"})
+    seat = {seat["seat_id"]: seat for seat in await second.load_seats()}["6E"]
+    assert seat["passenger_name"] != "Solo en A"
+    assert await second.load_queue() == []
+
+
+async def run_checks(name: str, factory: Callable[[str], CabinRepository], reset: Callable[[], Awaitable[None]]):
+    failures = 0
+    for description, function in CHECKS:
+        await reset()
+        opened: List[CabinRepository] = []
+
+        async def open_repository(flight_id: str) -> CabinRepository:
+            repository = factory(f"conformance-{flight_id}")
+            await repository.init(BATHROOM_IDS)
+            opened.append(repository)
+            return repository
+
+        try:
+            await function(open_repository)
+            print(f"✅ {name}: {description}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {name}: {description} {e}")
+        finally:
+            for repository in opened:
+                await repository.close()
+    return failures
+
+
+async def main(with_mongo: bool):
+    failures = 0
+
+    # Memoria: cada repositorio nuevo empieza vacío, salvo dentro de un mismo check
+    memory = {}
+
+    async def reset_memory():
+        memory.clear()
+
+    def memory_factory(flight_id):
+        # Misma instancia por vuelo dentro de un check, como una base de datos compartida
+        return memory.setdefault(flight_id, MemoryRepository(flight_id))
+
+    failures += await run_checks("memory", memory_factory, reset_memory)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cabin_smart.db")
+
+        async def reset_sqlite():
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        failures += await run_checks("sqlite", lambda flight_id: SqliteRepository(flight_id, path), reset_sqlite)
+
+    if with_mongo:
+        await connect_to_mongo()
+
+        async def reset_mongo():
+            db = await get_database()
+            for flight_id in ("conformance-A", "conformance-B"):
+                for base in ("seats", "bathroom_queue", "bathroom_status"):
+                    await db.drop_collection(collection_name(base, flight_id))
+
+        try:
+            failures += await run_checks("mongo", MongoRepository, reset_mongo)
+            await reset_mongo()
+        finally:
+            await close_mongo_connection()
+
+    if failures:
+        raise SystemExit(f"❌ {failures} comprobaciones fallidas")
+    print("✅ Todos los backends cumplen el contrato")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="incluir MongoDB (requiere MONGODB_URL)")
+    args = parser.parse_args()
+    asyncio.run(main(args.mongo))
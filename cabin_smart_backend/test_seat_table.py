@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Checks of the column-wise seat state (seat_table.py).
+
+SeatTable must behave like the dict of seats it replaced: unknown ids,
+including ids that are not strings, are simply not found. The last checks
+send those ids through /ws on an in-memory server.
+
+    python test_seat_table.py
+"""
+
+import os
+
+# Servidor en este proceso, sin MongoDB
+os.environ.setdefault("CABIN_STORAGE", "memory")
+
+from typing import Callable, List, Tuple
+
+from database import build_default_seats
+from seat_table import SeatTable
+
+CHECKS: List[Tuple[str, Callable]] = []
+
+
+def check(function):
+    CHECKS.append((function.__doc__, function))
+    return function
+
+
+@check
+def reads_what_was_written():
+    """Seats read back as the dicts they were loaded from"""
+    seats = build_default_seats()
+    table = SeatTable(seats)
+    assert len(table) == 198 and list(table)[:2] == ["1A", "1B"], list(table)[:2]
+    assert table["12C"] == seats[11 * 6 + 2], table["12C"]
+    table.update("12C", {"is_buckled": True, "last_updated": "2024-01-01T10:00:00.000001"})
+    assert table["12C"]["is_buckled"] is True
+    assert table["12C"]["last_updated"] == "2024-01-01T10:00:00.000001"
+
+
+@check
+def unknown_ids_are_not_found():
+    """Unknown and non-string seat ids are not found, as with a dict"""
+    table = SeatTable(build_default_seats())
+    for seat_id in ("99A", "1Z", "", "12c", 12, 12.0, None, ("1", "A")):
+        assert table.get(seat_id) is None, seat_id
+        assert seat_id not in table, seat_id
+    try:
+        table.update(12, {"is_buckled": True})
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("update de un id numérico sin KeyError")
+
+
+@check
+def numeric_seat_id_over_websocket():
+    """A numeric seatId on /ws is answered with an error and keeps the socket open"""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client, client.websocket_connect("/ws?topics=seat:1A") as websocket:
+        assert websocket.receive_json()["event"] == "initial_state"
+        for event in ("toggle_seat_belt", "update_seat_status", "join_bathroom_queue"):
+            websocket.send_json({"event": event, "data": {"seatId": 12, "updates": {"isInSeat": False}}})
+            reply = websocket.receive_json()
+            assert reply == {"event": "error", "data": {"message": "Asiento no encontrado"}}, (event, reply)
+        websocket.send_json({"event": "bathroom_door_sensor", "data": {"seatId": 12, "action": "exit"}})
+        while True:
+            reply = websocket.receive_json()
+            if reply["event"] == "bathroom_door_sensor_processed":
+                break
+        response = client.post("/sensors", content=b'{"sensor": "belt", "seatId": 12, "value": true}\n')
+        assert response.status_code == 200, response.status_code
+        assert response.json()["rejected"] == [{"line": 1, "error": "Asiento no encontrado"}], response.json()
+
+
+def main_checks():
+    failures = 0
+    for description, function in CHECKS:
+        try:
+            function()
+            print(f"✅ {description}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {description} {e}")
+    if failures:
+        raise SystemExit(f"❌ {failures} comprobaciones fallidas")
+    print("✅ SeatTable se comporta como el dict de asientos")
+
+
+if __name__ == "__main__":
+    main_checks()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Checks of topic subscriptions on /ws (topics.py, Flight.publish).
+
+A seats_patch reaches every subscriber once, with the seats of all its
+topics, both live and when it resumes with lastSeq. Runs on an in-memory
+server with seat changes coalesced.
+
+    python test_topics.py
+"""
+
+import os
+
+# Servidor en este proceso, sin MongoDB, con los cambios de asiento agrupados en seats_patch
+os.environ.setdefault("CABIN_STORAGE", "memory")
+os.environ["SEAT_COALESCE_MS"] = "50"
+os.environ["WS_SEAT_RATE_LIMITS"] = ""
+
+from typing import Callable, List, Tuple
+
+from fastapi.testclient import TestClient
+
+import main
+
+CHECKS: List[Tuple[str, Callable]] = []
+
+
+def check(function):
+    CHECKS.append((function.__doc__, function))
+    return function
+
+
+def toggle_and_wait(client: TestClient, seat_ids: List[str]):
+    """Toggle the belts of some seats from a crew client and wait for the patch with all of them"""
+    with client.websocket_connect("/ws") as crew:
+        assert crew.receive_json()["event"] == "initial_state"
+        for seat_id in seat_ids:
+            crew.send_json({"event": "toggle_seat_belt", "data": {"seatId": seat_id}})
+        seen = set()
+        while not seen >= set(seat_ids):
+            message = crew.receive_json()
+            if message["event"] == "seats_patch":
+                seen.update(message["data"]["seats"])
+
+
+def next_patch(websocket) -> dict:
+    while True:
+        message = websocket.receive_json()
+        if message["event"] == "seats_patch":
+            return message
+
+
+@check
+def one_patch_for_several_topics():
+    """A client subscribed to seat:12C and row:12 gets one seats_patch with 12A and 12C"""
+    with TestClient(main.app) as client, client.websocket_connect("/ws?topics=seat:12C,row:12") as passenger:
+        assert passenger.receive_json()["event"] == "initial_state"
+        toggle_and_wait(client, ["12C", "12A", "14B"])
+        patch = next_patch(passenger)
+        assert set(patch["data"]["seats"]) == {"12A", "12C"}, patch
+        # Nada más en cola: el siguiente mensaje es la respuesta a un evento propio
+        passenger.send_json({"event": "subscribe", "data": {"topics": ["seat:12C", "row:12"]}})
+        reply = passenger.receive_json()
+        assert reply["event"] == "subscribed", reply
+
+
+@check
+def one_patch_on_resume():
+    """On resume with lastSeq the same client gets the missed patch once, with the seats of its topics"""
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws?topics=seat:12C,row:12") as passenger:
+            initial = passenger.receive_json()
+            last_seq, epoch = initial["seq"], initial["data"]["epoch"]
+        toggle_and_wait(client, ["12C", "12A", "14B"])
+        url = f"/ws?topics=seat:12C,row:12&lastSeq={last_seq}&epoch={epoch}"
+        with client.websocket_connect(url) as passenger:
+            resumed = passenger.receive_json()
+            assert resumed["event"] == "resumed", resumed
+            missed = [passenger.receive_json() for _ in range(resumed["data"]["missed"])]
+            patches = [message for message in missed if message["event"] == "seats_patch"]
+            assert len(patches) == 1 and set(patches[0]["data"]["seats"]) == {"12A", "12C"}, missed
+
+
+def main_checks():
+    failures = 0
+    for description, function in CHECKS:
+        try:
+            function()
+            print(f"✅ {description}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {description} {e}")
+    if failures:
+        raise SystemExit(f"❌ {failures} comprobaciones fallidas")
+    print("✅ Cada suscriptor recibe un solo seats_patch")
+
+
+if __name__ == "__main__":
+    main_checks()
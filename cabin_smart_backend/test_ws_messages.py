@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Checks of how /ws handles client messages (main.py, dispatcher.py).
+
+Malformed messages are answered with an error and never close the socket,
+and a message rejected by a rate limit is answered in its turn, after the
+replies to earlier messages of the same seat. Runs on an in-memory server.
+
+    python test_ws_messages.py
+"""
+
+import os
+
+# Servidor en este proceso, sin MongoDB
+os.environ.setdefault("CABIN_STORAGE", "memory")
+
+from typing import Callable, List, Tuple
+
+from fastapi.testclient import TestClient
+
+import main
+
+CHECKS: List[Tuple[str, Callable]] = []
+
+INVALID = {"event": "error", "data": {"message": "Mensaje no válido"}}
+
+
+def check(function):
+    CHECKS.append((function.__doc__, function))
+    return function
+
+
+@check
+def malformed_payloads_keep_the_socket_open():
+    """A message whose data (or the message itself) is not an object is answered with an error"""
+    with TestClient(main.app) as client, client.websocket_connect("/ws?topics=seat:1A") as websocket:
+        assert websocket.receive_json()["event"] == "initial_state"
+        malformed = [
+            {"event": "toggle_seat_belt", "data": 5},
+            {"event": "bathroom_door_sensor", "data": ["12C"]},
+            {"event": "join_bathroom_queue", "data": None},
+            "toggle_seat_belt",
+            [1, 2],
+        ]
+        for message in malformed:
+            websocket.send_json(message)
+            reply = websocket.receive_json()
+            assert reply == INVALID, (message, reply)
+        # La conexión sigue atendiendo mensajes
+        websocket.send_json({"event": "toggle_seat_belt", "data": {"seatId": "1A"}})
+        while True:
+            reply = websocket.receive_json()
+            if reply["event"] == "seat_belt_toggled":
+                break
+
+
+@check
+def rate_limited_replies_keep_their_order():
+    """Toggles over the seat limit are rejected after the replies to the accepted ones, with their seatId"""
+    with TestClient(main.app) as client, client.websocket_connect("/ws?topics=seat:2A") as websocket:
+        assert websocket.receive_json()["event"] == "initial_state"
+        # toggle_seat_belt: ráfaga de 5 por asiento (WS_SEAT_RATE_LIMITS por defecto)
+        for _ in range(7):
+            websocket.send_json({"event": "toggle_seat_belt", "data": {"seatId": "2A"}})
+        replies = []
+        while len(replies) < 7:
+            reply = websocket.receive_json()
+            if reply["event"] in ("seat_belt_toggled", "error"):
+                replies.append(reply)
+        assert [reply["event"] for reply in replies] == ["seat_belt_toggled"] * 5 + ["error"] * 2, replies
+        for reply in replies[5:]:
+            assert reply["data"]["code"] == "rate_limited" and reply["data"]["seatId"] == "2A", reply
+
+
+def main_checks():
+    failures = 0
+    for description, function in CHECKS:
+        try:
+            function()
+            print(f"✅ {description}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {description} {e}")
+    if failures:
+        raise SystemExit(f"❌ {failures} comprobaciones fallidas")
+    print("✅ Los mensajes de /ws se atienden sin cerrar la conexión")
+
+
+if __name__ == "__main__":
+    main_checks()
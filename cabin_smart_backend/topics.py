@@ -0,0 +1,60 @@
+"""
+Subscription topics for WebSocket clients.
+
+Seat events are published to the topics of the seat they concern:
+`seat:<id>`, `row:<n>` and `class:<business|economy>`. A client only receives
+them if it subscribed to one of those topics or to `crew:all`. Events
+published without topics (signs, bathroom status, queue changes) go to
+everyone. Clients that do not choose topics are subscribed to `crew:all`.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+ALL_TOPIC = "crew:all"
+DEFAULT_TOPICS = frozenset({ALL_TOPIC})
+
+TOPIC_PATTERN = re.compile(r"^(seat:\d{1,3}[A-Z]|row:\d{1,3}|class:(business|economy)|crew:all)$")
+SEAT_ID_PATTERN = re.compile(r"^(\d+)([A-Z])$")
+
+
+def seat_topics(seat_id: str, seat_class: Optional[str] = None) -> List[str]:
+    """Topics a change of this seat is published to"""
+    topics = [f"seat:{seat_id}"]
+    match = SEAT_ID_PATTERN.match(seat_id)
+    if match:
+        topics.append(f"row:{match.group(1)}")
+    if seat_class:
+        topics.append(f"class:{seat_class}")
+    return topics
+
+
+def parse_topics(raw) -> Set[str]:
+    """Validate topics given as a list or a comma separated string"""
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    topics = {topic.strip() for topic in raw if topic and topic.strip()}
+    invalid = [topic for topic in topics if not TOPIC_PATTERN.match(topic)]
+    if invalid:
+        raise ValueError(f"Invalid topics: {', '.join(sorted(invalid))}")
+    return topics or set(DEFAULT_TOPICS)
+
+
+def wants(subscribed: Set[str], topics: Optional[Iterable[str]], include_all: bool = True) -> bool:
+    """Whether a client with these subscriptions receives an event"""
+    if topics is None:
+        return True
+    if include_all and ALL_TOPIC in subscribed:
+        return True
+    return any(topic in subscribed for topic in topics)
+
+
+def patch_for(payload: dict, parts: Dict[str, Iterable[str]], subscribed: Set[str]) -> Optional[dict]:
+    """The seats_patch seen by a client with these subscriptions: only the seats of its topics, or None"""
+    seats = {
+        seat_id: updates for seat_id, updates in payload["data"]["seats"].items()
+        if any(topic in subscribed for topic in parts.get(seat_id, ()))
+    }
+    if not seats:
+        return None
+    return dict(payload, data=dict(payload["data"], seats=seats))
@@ -0,0 +1,121 @@
+"""
+Write-behind batching.
+
+In "async" write mode the pending mutations of a flight are collected for
+up to WRITE_BATCH_MS or WRITE_BATCH_SIZE operations and coalesced before
+reaching the repository: seat and lavatory updates are merged per document
+(last write wins, field by field) and a queue insertion followed by a
+removal of the same seat cancels out. The repository applies the batch in
+as few round trips as it can (one bulk_write per collection on MongoDB,
+one transaction on SQLite).
+
+A batch the repository fails to write is retried with exponential backoff,
+from WRITE_RETRY_MS up to WRITE_RETRY_MAX_MS, with the operations queued in
+the meantime added behind it (last write wins), so a transient storage error
+delays writes but never drops them.
+"""
+
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+WRITE_BATCH_MS = float(os.getenv("WRITE_BATCH_MS", "50"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_RETRY_MS = float(os.getenv("WRITE_RETRY_MS", "100"))
+WRITE_RETRY_MAX_MS = float(os.getenv("WRITE_RETRY_MAX_MS", "5000"))
+
+
+class WriteBatch:
+    def __init__(self):
+        # seat_id / bathroom_id -> campos a escribir
+        self.seats: Dict[str, dict] = {}
+        self.lavatories: Dict[str, dict] = {}
+        # seat_id -> (estaba en la cola antes del lote, elemento final o None si ya no está)
+        self._queue: Dict[str, Tuple[bool, Optional[dict]]] = {}
+        # Operaciones recibidas, antes de agrupar
+        self.ops = 0
+
+    def add(self, op: Tuple[str, tuple]):
+        method, args = op
+        self.ops += 1
+        if method == "update_seat":
+            seat_id, updates = args
+            self.seats.setdefault(seat_id, {}).update(updates)
+        elif method == "update_lavatory":
+            bathroom_id, updates = args
+            self.lavatories.setdefault(bathroom_id, {}).update(updates)
+        elif method == "add_to_queue":
+            item = args[0]
+            was_queued = self._queue[item["seat_id"]][0] if item["seat_id"] in self._queue else False
+            self._queue[item["seat_id"]] = (was_queued, item)
+        elif method == "remove_from_queue":
+            seat_id = args[0]
+            was_queued = self._queue[seat_id][0] if seat_id in self._queue else True
+            self._queue[seat_id] = (was_queued, None)
+        else:
+            raise ValueError(f"Cannot batch {method!r}")
+
+    def retrying(self):
+        """Prepare a failed batch to be written again
+
+        The failed write may have inserted some queue entries: every seat of the
+        batch is deleted from the stored queue before its entry is inserted again.
+        """
+        self._queue = {seat_id: (True, item) for seat_id, (_, item) in self._queue.items()}
+
+    @property
+    def queue_deletes(self) -> List[str]:
+        """Seats whose stored queue entry has to go (removed, or replaced by a new one)"""
+        return [seat_id for seat_id, (was_queued, _) in self._queue.items() if was_queued]
+
+    @property
+    def queue_inserts(self) -> List[dict]:
+        return [item for _, item in self._queue.values() if item is not None]
+
+    def __len__(self) -> int:
+        """Writes left after coalescing"""
+        return len(self.seats) + len(self.lavatories) + len(self.queue_deletes) + len(self.queue_inserts)
+
+
+class WriteMetrics:
+    def __init__(self):
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.failed_ops = 0
+        # Operaciones escritas y escrituras reales tras agrupar
+        self.ops = 0
+        self.writes = 0
+        self.last_flush_size = 0
+        self.max_flush_size = 0
+        # Retraso de un lote: desde que se encoló su operación más antigua hasta que quedó escrito
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def record(self, batch: WriteBatch, oldest: float, failed: bool = False):
+        lag = time.monotonic() - oldest
+        self.flushes += 1
+        if failed:
+            self.failed_flushes += 1
+            self.failed_ops += batch.ops
+        else:
+            self.ops += batch.ops
+            self.writes += len(batch)
+        self.last_flush_size = len(batch)
+        self.max_flush_size = max(self.max_flush_size, len(batch))
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def to_dict(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "failedFlushes": self.failed_flushes,
+            "failedOps": self.failed_ops,
+            "ops": self.ops,
+            "writes": self.writes,
+            "coalesced": self.ops - self.writes,
+            "lastFlushSize": self.last_flush_size,
+            "maxFlushSize": self.max_flush_size,
+            "avgFlushSize": round(self.writes / (self.flushes - self.failed_flushes), 2) if self.flushes > self.failed_flushes else 0,
+            "lastLagMs": round(self.last_lag * 1000, 2),
+            "maxLagMs": round(self.max_lag * 1000, 2),
+        }
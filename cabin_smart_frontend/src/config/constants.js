@@ -6,7 +6,10 @@ export const API_BASE_URL = process.env.NODE_ENV === 'production'
 // WebSocket Configuration
 export const WS_CONFIG = {
 url: import.meta.env.VITE_WS_URL || (window.location.protocol === 'https:' ? 'wss:' : 'ws:') + '//' + window.location.host,
-  path: '/ws',
+  // Vuelo al que se conecta este cliente (por defecto el del servidor)
+  path: import.meta.env.VITE_FLIGHT_ID
+    ? `/ws?flightId=${encodeURIComponent(import.meta.env.VITE_FLIGHT_ID)}`
+    : '/ws',
   transports: ['websocket'],
   reconnectAttempts: 5,
   reconnectDelay: 1000,
@@ -34,7 +37,10 @@ export const EVENTS = {
   CONNECT: 'connect',
   DISCONNECT: 'disconnect',
   SEAT_UPDATED: 'seat_updated',
+  SEATS_PATCH: 'seats_patch',
   BATHROOM_QUEUE_UPDATED: 'bathroom_queue_updated',
+  QUEUE_ITEM_ADDED: 'queue_item_added',
+  QUEUE_ITEM_REMOVED: 'queue_item_removed',
   INITIAL_STATE: 'initial_state',
   ERROR: 'error',
   TOGGLE_SEAT_BELT: 'toggle_seat_belt',
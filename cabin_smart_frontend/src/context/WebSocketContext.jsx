@@ -1,4 +1,4 @@
-import { createContext, useContext, useState, useCallback, useEffect } from 'react';
+import { createContext, useContext, useState, useCallback, useEffect, useRef } from 'react';
 import { useNotification } from './NotificationContext';
 import useWebSocket from '../hooks/useWebSocket';
 import { EVENTS, WS_CONFIG } from '../config/constants';
@@ -12,6 +12,8 @@ export const WebSocketProvider = ({ children }) => {
   const [bathroomQueue, setBathroomQueue] = useState([]);
   const [bathroomStatus, setBathroomStatus] = useState({ is_occupied: false, current_user: null });
   const [connectedUsers, setConnectedUsers] = useState(0);
+  // Last applied bathroom queue version, deltas at or below it are ignored
+  const bathroomQueueVersion = useRef(0);
 
   // Handle WebSocket connection and events
   const { isConnected, send, on } = useWebSocket(WS_CONFIG.path, {
@@ -28,6 +30,7 @@ export const WebSocketProvider = ({ children }) => {
     const handleInitialState = (data) => {
       setSeats(data.seats || {});
       setBathroomQueue(data.bathroomQueue || []);
+      bathroomQueueVersion.current = data.bathroomQueueVersion || 0;
       setBathroomStatus(data.bathroomStatus || { is_occupied: false, current_user: null });
       setConnectedUsers(data.connectedUsers || 0);
     };
@@ -43,11 +46,43 @@ export const WebSocketProvider = ({ children }) => {
       }));
     };
 
+    // Handle coalesced seat updates (one frame for many seats)
+    const handleSeatsPatch = (data) => {
+      setSeats(prevSeats => {
+        const nextSeats = { ...prevSeats };
+        Object.entries(data.seats || {}).forEach(([seatId, updates]) => {
+          nextSeats[seatId] = { ...prevSeats[seatId], ...updates };
+        });
+        return nextSeats;
+      });
+    };
+
     // Handle bathroom queue updates
     const handleBathroomQueueUpdate = (data) => {
+      if (data.version !== undefined) {
+        if (data.version < bathroomQueueVersion.current) return;
+        bathroomQueueVersion.current = data.version;
+      }
       setBathroomQueue(data.queue || []);
     };
 
+    // Handle incremental bathroom queue changes
+    const handleQueueItemAdded = (data) => {
+      if (data.version <= bathroomQueueVersion.current) return;
+      bathroomQueueVersion.current = data.version;
+      setBathroomQueue(prevQueue => {
+        const nextQueue = prevQueue.filter(item => item.seat_id !== data.item.seat_id);
+        nextQueue.splice(data.position - 1, 0, data.item);
+        return nextQueue;
+      });
+    };
+
+    const handleQueueItemRemoved = (data) => {
+      if (data.version <= bathroomQueueVersion.current) return;
+      bathroomQueueVersion.current = data.version;
+      setBathroomQueue(prevQueue => prevQueue.filter(item => item.seat_id !== data.seatId));
+    };
+
     // Handle user count updates
     const handleUserCountUpdate = (data) => {
       setConnectedUsers(data.count || 0);
@@ -75,7 +110,10 @@ export const WebSocketProvider = ({ children }) => {
     // Subscribe to WebSocket events
     const cleanupInitialState = on(EVENTS.INITIAL_STATE, handleInitialState);
     const cleanupSeatUpdate = on(EVENTS.SEAT_UPDATED, handleSeatUpdate);
+    const cleanupSeatsPatch = on(EVENTS.SEATS_PATCH, handleSeatsPatch);
     const cleanupBathroomQueue = on(EVENTS.BATHROOM_QUEUE_UPDATED, handleBathroomQueueUpdate);
+    const cleanupQueueItemAdded = on(EVENTS.QUEUE_ITEM_ADDED, handleQueueItemAdded);
+    const cleanupQueueItemRemoved = on(EVENTS.QUEUE_ITEM_REMOVED, handleQueueItemRemoved);
     const cleanupBathroomStatus = on('bathroom_status_updated', handleBathroomStatusUpdate);
     const cleanupBathroomDirectAccess = on('bathroom_direct_access', handleBathroomDirectAccess);
     const cleanupBathroomAvailable = on('bathroom_available', handleBathroomAvailable);
@@ -85,7 +123,10 @@ export const WebSocketProvider = ({ children }) => {
     return () => {
       cleanupInitialState();
       cleanupSeatUpdate();
+      cleanupSeatsPatch();
       cleanupBathroomQueue();
+      cleanupQueueItemAdded();
+      cleanupQueueItemRemoved();
       cleanupBathroomStatus();
       cleanupBathroomDirectAccess();
       cleanupBathroomAvailable();
@@ -10,6 +10,8 @@ const useWebSocket = (url, options = {}) => {
   const eventHandlers = useRef({});
   const reconnectTimer = useRef(null);
   const connectRef = useRef(null);
+  // Last broadcast sequence and server epoch seen, used to resume after a reconnect
+  const resumeState = useRef({ seq: null, epoch: null });
   const { 
     autoReconnect = true,
     reconnectInterval = 5000,
@@ -45,6 +47,11 @@ const useWebSocket = (url, options = {}) => {
         wsUrl = `${protocol}//${window.location.host}${url.startsWith('/') ? '' : '/'}${url}`;
       }
       
+      const { seq, epoch } = resumeState.current;
+      if (seq !== null && epoch) {
+        wsUrl += `${wsUrl.includes('?') ? '&' : '?'}lastSeq=${seq}&epoch=${epoch}`;
+      }
+      
       log('Connecting to WebSocket:', wsUrl);
       ws.current = new WebSocket(wsUrl);
       
@@ -104,6 +111,14 @@ const useWebSocket = (url, options = {}) => {
           const message = JSON.parse(event.data);
           log('Received message:', message);
           
+          // Track the resume point: snapshots and resumes carry the epoch
+          if (message.data && message.data.epoch) {
+            resumeState.current.epoch = message.data.epoch;
+          }
+          if (typeof message.seq === 'number') {
+            resumeState.current.seq = message.seq;
+          }
+          
           // Call the appropriate event handler
           if (message.event && eventHandlers.current[message.event]) {
             eventHandlers.current[message.event].forEach(handler => {
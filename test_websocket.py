@@ -1,19 +1,48 @@
 #!/usr/bin/env python3
+"""
+Prueba de WebSocket y generador de carga para CabinSmart.
+
+    python test_websocket.py                          # prueba rápida contra ws://localhost:8000/ws
+    python test_websocket.py load --in-process        # carga contra un servidor en este proceso, sin MongoDB
+    python test_websocket.py load --url ws://localhost:8000 --flights 2 --server-pid 1234
+
+El modo `load` simula N vuelos con 198 pasajeros (un socket cada uno) y varias
+consolas de tripulación, y reproduce embarque, señal de cinturones y avalancha
+de lavabos. Informa de la latencia extremo a extremo de los broadcasts
+(p50/p95/p99, medida en cada destinatario), mensajes por segundo, CPU por
+evento y memoria por conexión.
+"""
+
+import argparse
 import asyncio
-import websockets
 import json
+import os
+import random
+import resource
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import websockets
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cabin_smart_backend")
+
+ROWS = 33
+SEATS_PER_ROW = 6
+SEAT_IDS = [f"{row}{chr(64 + seat)}" for row in range(1, ROWS + 1) for seat in range(1, SEATS_PER_ROW + 1)]
+
 
 async def test_websocket():
     uri = "ws://localhost:8000/ws"
-    
+
     try:
         async with websockets.connect(uri) as websocket:
             print("✅ Conexión WebSocket establecida exitosamente")
-            
+
             # Esperar mensaje inicial
             initial_message = await websocket.recv()
             print(f"📨 Mensaje inicial recibido: {initial_message}")
-            
+
             # Enviar un mensaje de prueba
             test_message = json.dumps({
                 "event": "toggle_seat_belt",
@@ -21,15 +50,277 @@ async def test_websocket():
             })
             await websocket.send(test_message)
             print(f"📤 Mensaje enviado: {test_message}")
-            
+
             # Esperar respuesta
             response = await websocket.recv()
             print(f"📥 Respuesta recibida: {response}")
-            
+
             print("✅ Test de WebSocket completado exitosamente")
-            
+
     except Exception as e:
         print(f"❌ Error en conexión WebSocket: {e}")
 
+
+# Generador de carga
+class LoadStats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies: List[float] = []
+        # (vuelo, asiento) -> instante del último cambio enviado
+        self.sent_at: Dict[Tuple[str, str], float] = {}
+
+    def mark_sent(self, flight_id: str, seat_id: Optional[str] = None):
+        self.sent += 1
+        if seat_id:
+            self.sent_at[(flight_id, seat_id)] = time.perf_counter()
+
+    def record(self, flight_id: str, raw):
+        now = time.perf_counter()
+        self.received += 1
+        message = json.loads(raw)
+        event = message.get("event")
+        if event == "seat_updated":
+            seats = [message["data"]["seatId"]]
+        elif event == "seats_patch":
+            seats = list(message["data"]["seats"])
+        else:
+            return
+        for seat_id in seats:
+            sent_at = self.sent_at.get((flight_id, seat_id))
+            if sent_at is not None:
+                self.latencies.append(now - sent_at)
+
+
+class FlightSimulation:
+    def __init__(self, url: str, flight_id: str, passengers: int, crew: int, stats: LoadStats, passenger_topics: bool):
+        self.url = url
+        self.flight_id = flight_id
+        self.seats = SEAT_IDS[:passengers]
+        self.crew_count = crew
+        self.stats = stats
+        self.passenger_topics = passenger_topics
+        self.passengers: Dict[str, websockets.WebSocketClientProtocol] = {}
+        self.crew: List[websockets.WebSocketClientProtocol] = []
+        self.readers: List[asyncio.Task] = []
+
+    async def _open(self, query: str, limit: asyncio.Semaphore):
+        async with limit:
+            websocket = await websockets.connect(f"{self.url}/ws?flightId={self.flight_id}{query}", max_size=None)
+            await websocket.recv()  # initial_state
+            self.readers.append(asyncio.create_task(self._read(websocket)))
+            return websocket
+
+    async def _read(self, websocket):
+        try:
+            async for raw in websocket:
+                self.stats.record(self.flight_id, raw)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def connect(self, limit: asyncio.Semaphore):
+        self.crew = await asyncio.gather(*[self._open("", limit) for _ in range(self.crew_count)])
+        sockets = await asyncio.gather(*[
+            self._open(f"&topics=seat:{seat_id}" if self.passenger_topics else "", limit)
+            for seat_id in self.seats
+        ])
+        self.passengers = dict(zip(self.seats, sockets))
+
+    async def close(self):
+        for websocket in list(self.passengers.values()) + self.crew:
+            await websocket.close()
+        for reader in self.readers:
+            reader.cancel()
+
+    async def _send(self, websocket, event: str, data: dict, seat_id: Optional[str] = None):
+        self.stats.mark_sent(self.flight_id, seat_id)
+        await websocket.send(json.dumps({"event": event, "data": data}))
+
+    async def _at(self, delay: float, coroutine):
+        await asyncio.sleep(delay)
+        await coroutine
+
+    async def boarding(self, seconds: float):
+        """Passengers take their seats at random times"""
+        await asyncio.gather(*[
+            self._at(random.uniform(0, seconds), self._send(
+                websocket, "update_seat_status", {"seatId": seat_id, "updates": {"isInSeat": True}}, seat_id
+            ))
+            for seat_id, websocket in self.passengers.items()
+        ])
+
+    async def seatbelt_sign(self, seconds: float):
+        """Everybody buckles up within a short window after the sign turns on"""
+        await asyncio.gather(*[
+            self._at(random.expovariate(3 / seconds) % seconds, self._send(
+                websocket, "toggle_seat_belt", {"seatId": seat_id}, seat_id
+            ))
+            for seat_id, websocket in self.passengers.items()
+        ])
+
+    async def lavatory_rush(self, passengers: int, cycles: int):
+        """A group joins the lavatory queue and the door sensor cycles through them"""
+        queued = random.sample(self.seats, min(passengers, len(self.seats)))
+        await asyncio.gather(*[
+            self._at(random.uniform(0, 1), self._send(self.passengers[seat_id], "join_bathroom_queue", {"seatId": seat_id}))
+            for seat_id in queued
+        ])
+        sensor = self.crew[0] if self.crew else self.passengers[queued[0]]
+        for seat_id in queued[:cycles]:
+            await self._send(sensor, "bathroom_door_sensor", {"action": "exit"})
+            await asyncio.sleep(0.02)
+            await self._send(sensor, "bathroom_door_sensor", {"action": "enter", "seatId": seat_id})
+            await asyncio.sleep(0.02)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def process_cpu_seconds(pid: Optional[int]) -> float:
+    if pid is None:
+        return time.process_time()
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_bytes(pid: Optional[int]) -> int:
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Sin /proc: pico de memoria del proceso (KB en Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def start_in_process_server(flight_ids: List[str], port: int):
+    """Run the backend in this event loop with in-memory state and no MongoDB"""
+    os.environ.setdefault("CABIN_STORAGE", "memory")
+    os.environ["FLIGHT_IDS"] = ",".join(flight_ids)
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+    import main as backend
+
+    server = uvicorn.Server(uvicorn.Config(backend.app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run_load(args):
+    # Cada conexión usa uno o dos descriptores de fichero
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    flight_ids = [f"LOAD{index:03d}" for index in range(1, args.flights + 1)]
+    server = None
+    url = args.url.rstrip("/")
+    pid = args.server_pid
+    # El servidor en proceso escribe en stdout en cada conexión: se silencia durante la prueba
+    quiet = open(os.devnull, "w") if args.in_process else None
+    stdout = sys.stdout
+
+    try:
+        if args.in_process:
+            sys.stdout = quiet
+            server, server_task = await start_in_process_server(flight_ids, args.port)
+            url = f"ws://127.0.0.1:{args.port}"
+        else:
+            for flight_id in flight_ids:
+                # Abre el vuelo si el servidor no lo tiene ya
+                await asyncio.to_thread(_open_remote_flight, url, flight_id)
+
+        stats = LoadStats()
+        simulations = [
+            FlightSimulation(url, flight_id, args.passengers, args.crew, stats, not args.no_topics)
+            for flight_id in flight_ids
+        ]
+        rss_before = process_rss_bytes(pid)
+        limit = asyncio.Semaphore(200)
+        await asyncio.gather(*[simulation.connect(limit) for simulation in simulations])
+        connections = sum(len(s.passengers) + len(s.crew) for s in simulations)
+        rss_after = process_rss_bytes(pid)
+
+        phases = [
+            ("embarque", lambda s: s.boarding(args.boarding_seconds)),
+            ("señal de cinturones", lambda s: s.seatbelt_sign(args.seatbelt_seconds)),
+            ("avalancha de lavabos", lambda s: s.lavatory_rush(args.lavatory_passengers, args.lavatory_cycles)),
+        ]
+        results = []
+        for name, phase in phases:
+            print(f"▶ {name}...", file=sys.stderr)
+            stats.latencies, sent, received = [], stats.sent, stats.received
+            cpu, started = process_cpu_seconds(pid), time.perf_counter()
+            await asyncio.gather(*[phase(simulation) for simulation in simulations])
+            await asyncio.sleep(args.settle)
+            elapsed = time.perf_counter() - started
+            events = stats.sent - sent
+            results.append((
+                name, events, stats.received - received, elapsed,
+                list(stats.latencies), (process_cpu_seconds(pid) - cpu) / max(events, 1)
+            ))
+
+        for simulation in simulations:
+            await simulation.close()
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+        sys.stdout = stdout
+        if quiet:
+            quiet.close()
+
+    origin = "servidor + clientes" if args.in_process else ("servidor" if pid else "clientes")
+    print(f"\n{args.flights} vuelo(s) × {args.passengers} pasajeros + {args.crew} consola(s) de tripulación = {connections} conexiones")
+    print(f"Memoria por conexión ({origin}): {(rss_after - rss_before) / max(connections, 1) / 1024:.1f} KB\n")
+    header = f"{'fase':<22}{'eventos':>9}{'frames':>10}{'msg/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'CPU µs/ev':>11}"
+    print(header)
+    print("-" * len(header))
+    for name, events, received, elapsed, latencies, cpu_per_event in results:
+        # La fase de lavabos no cambia asientos: sin latencias de asiento que medir
+        quantiles = "".join(
+            f"{percentile(latencies, q) * 1000:>9.1f}" if latencies else f"{'-':>9}" for q in (0.50, 0.95, 0.99)
+        )
+        print(f"{name:<22}{events:>9}{received:>10}{received / elapsed:>10.0f}{quantiles}{cpu_per_event * 1e6:>11.0f}")
+    print(f"\nCPU por evento medida en: {origin}. Latencia: envío del cambio → recepción en cada destinatario.")
+
+
+def _open_remote_flight(url: str, flight_id: str):
+    import urllib.request
+    http_url = url.replace("ws://", "http://").replace("wss://", "https://")
+    request = urllib.request.Request(f"{http_url}/flights/{flight_id}", method="POST")
+    urllib.request.urlopen(request).read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    load = subparsers.add_parser("load", help="generador de carga")
+    load.add_argument("--url", default="ws://localhost:8000", help="servidor externo (sin /ws)")
+    load.add_argument("--in-process", action="store_true", help="levantar el backend en este proceso, sin MongoDB")
+    load.add_argument("--port", type=int, default=8765, help="puerto del servidor en proceso")
+    load.add_argument("--server-pid", type=int, help="PID del servidor externo para medir su CPU y memoria")
+    load.add_argument("--flights", type=int, default=1)
+    load.add_argument("--passengers", type=int, default=len(SEAT_IDS), help="pasajeros por vuelo (máx. 198)")
+    load.add_argument("--crew", type=int, default=2, help="consolas de tripulación por vuelo")
+    load.add_argument("--no-topics", action="store_true", help="los pasajeros reciben todos los eventos")
+    load.add_argument("--boarding-seconds", type=float, default=5.0)
+    load.add_argument("--seatbelt-seconds", type=float, default=1.0)
+    load.add_argument("--lavatory-passengers", type=int, default=30)
+    load.add_argument("--lavatory-cycles", type=int, default=10)
+    load.add_argument("--settle", type=float, default=1.0, help="segundos de espera tras cada fase")
+    args = parser.parse_args()
+
+    if args.command == "load":
+        args.passengers = min(args.passengers, len(SEAT_IDS))
+        asyncio.run(run_load(args))
+    else:
+        asyncio.run(test_websocket())
+
 if __name__ == "__main__":
-    asyncio.run(test_websocket())
+    main()